@@ -1,5 +1,5 @@
 """Chapters API endpoints."""
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from typing import List, Optional
@@ -8,8 +8,10 @@ import asyncio
 
 from app.database.postgres import get_db
 from app.database.qdrant_client import get_vector_manager
-from app.services.embeddings import generate_embedding
-from app.services.auto_analysis import trigger_chapter_analysis
+from app.services.embeddings import embed
+from app.services.job_queue import get_job_queue
+from app.services.chapter_blocks import get_chapter_block_service
+from app.services.lexical_index import get_lexical_index
 from app.api.v1.models import ChapterCreate, ChapterUpdate, ChapterResponse, IdeaCreate, IdeaResponse
 
 router = APIRouter()
@@ -18,23 +20,19 @@ router = APIRouter()
 @router.post("/chapters", response_model=ChapterResponse)
 async def create_chapter(
     chapter: ChapterCreate,
-    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db)
 ):
     """Create a new chapter with optional automatic analysis."""
     # Calculate word count
     word_count = len(chapter.content.split())
     
-    # Generate embedding
-    embedding = generate_embedding(chapter.content)
-    
     # Save to PostgreSQL (with new fields)
     result = await db.execute(
         text("""
             INSERT INTO chapters (title, content, chapter_number, book_id, pov_character, 
-                                  word_count, embedding, language, metadata)
+                                  word_count, language, metadata)
             VALUES (:title, :content, :chapter_number, :book_id, :pov_character,
-                    :word_count, :embedding, :language, :metadata)
+                    :word_count, :language, :metadata)
             RETURNING id, title, content, chapter_number, word_count, created_at, updated_at
         """),
         {
@@ -44,14 +42,21 @@ async def create_chapter(
             "book_id": chapter.book_id,
             "pov_character": chapter.pov_character,
             "word_count": word_count,
-            "embedding": str(embedding),
             "language": chapter.language,
             "metadata": json.dumps(chapter.metadata)
         }
     )
-    await db.commit()
     row = result.fetchone()
     
+    # Split into paragraph blocks; the chapter embedding pools the block embeddings
+    blocks = await get_chapter_block_service().sync(db, row.id, chapter.content)
+    embedding = blocks["embedding"] or await embed(chapter.content)
+    await db.execute(
+        text("UPDATE chapters SET embedding = :embedding WHERE id = :id"),
+        {"embedding": str(embedding), "id": row.id}
+    )
+    await db.commit()
+    
     # Save to Qdrant
     vector_manager = get_vector_manager()
     vector_manager.upsert_vectors(
@@ -69,15 +74,24 @@ async def create_chapter(
         }]
     )
     
-    # 🤖 Trigger automatic LLM analysis in background
+    # Index overlapping passages so retrieval sees the whole chapter
+    await get_chapter_block_service().index_passages(
+        {"id": row.id, "title": chapter.title, "chapter_number": chapter.chapter_number,
+         "book_id": chapter.book_id},
+        blocks["texts"]
+    )
+    
+    # 🤖 Queue automatic LLM analysis for a worker process
     if chapter.auto_analyze and chapter.series_id and chapter.book_id:
-        background_tasks.add_task(
-            run_chapter_analysis,
-            chapter_id=row.id,
-            chapter_content=chapter.content,
-            book_id=chapter.book_id,
-            series_id=chapter.series_id,
-            chapter_number=chapter.chapter_number or 1
+        await get_job_queue().enqueue(
+            "chapter_analysis",
+            {
+                "chapter_id": row.id,
+                "book_id": chapter.book_id,
+                "series_id": chapter.series_id,
+                "chapter_number": chapter.chapter_number or 1
+            },
+            concurrency_key=f"chapter_analysis:{row.id}"
         )
     
     return ChapterResponse(
@@ -91,29 +105,6 @@ async def create_chapter(
     )
 
 
-async def run_chapter_analysis(
-    chapter_id: int,
-    chapter_content: str,
-    book_id: int,
-    series_id: int,
-    chapter_number: int
-):
-    """Run analysis in background and store results."""
-    import logging
-    logger = logging.getLogger(__name__)
-    try:
-        results = await trigger_chapter_analysis(
-            chapter_id=chapter_id,
-            chapter_content=chapter_content,
-            book_id=book_id,
-            series_id=series_id,
-            chapter_number=chapter_number
-        )
-        logger.info(f"Chapter {chapter_id} auto-analysis complete: {list(results.keys())}")
-    except Exception as e:
-        logger.error(f"Chapter {chapter_id} auto-analysis failed: {e}")
-
-
 @router.get("/chapters", response_model=List[ChapterResponse])
 async def list_chapters(
     skip: int = 0,
@@ -196,11 +187,6 @@ async def update_chapter(
         params["content"] = chapter.content
         params["word_count"] = len(chapter.content.split())
         updates.append("word_count = :word_count")
-        
-        # Update embedding
-        embedding = generate_embedding(chapter.content)
-        params["embedding"] = str(embedding)
-        updates.append("embedding = :embedding")
     
     if chapter.chapter_number is not None:
         updates.append("chapter_number = :chapter_number")
@@ -219,24 +205,35 @@ async def update_chapter(
         UPDATE chapters 
         SET {', '.join(updates)}
         WHERE id = :chapter_id
-        RETURNING id, title, content, chapter_number, word_count, created_at, updated_at
+        RETURNING id, title, content, chapter_number, word_count, book_id, created_at, updated_at
     """
     
     result = await db.execute(text(query), params)
-    await db.commit()
     row = result.fetchone()
     
     if not row:
         raise HTTPException(status_code=404, detail="Chapter not found")
     
-    # Update Qdrant if content changed
+    # Re-embed only the paragraph blocks that changed
+    blocks = None
     if chapter.content is not None:
+        blocks = await get_chapter_block_service().sync(db, row.id, chapter.content)
+        if blocks["changed"] and blocks["embedding"]:
+            await db.execute(
+                text("UPDATE chapters SET embedding = :embedding WHERE id = :id"),
+                {"embedding": str(blocks["embedding"]), "id": row.id}
+            )
+    await db.commit()
+    
+    # Update Qdrant if the text or its metadata changed
+    metadata_changed = chapter.title is not None or chapter.chapter_number is not None
+    if blocks and blocks["embedding"] and (blocks["changed"] or metadata_changed):
         vector_manager = get_vector_manager()
         vector_manager.upsert_vectors(
             collection="chapters",
             points=[{
                 "id": row.id,
-                "vector": embedding,
+                "vector": blocks["embedding"],
                 "payload": {
                     "id": row.id,
                     "title": row.title,
@@ -247,6 +244,35 @@ async def update_chapter(
             }]
         )
     
+    if (blocks and blocks["changed"]) or metadata_changed:
+        block_texts = blocks["texts"] if blocks else [
+            b["content"] for b in await get_chapter_block_service().get_blocks(db, row.id)
+        ]
+        await get_chapter_block_service().index_passages(
+            {"id": row.id, "title": row.title, "chapter_number": row.chapter_number,
+             "book_id": row.book_id},
+            block_texts
+        )
+    
+    # 🤖 Queue analysis of the blocks that changed
+    if chapter.auto_analyze and blocks and blocks["pending"] and row.book_id:
+        series_result = await db.execute(
+            text("SELECT series_id FROM books WHERE id = :book_id"),
+            {"book_id": row.book_id}
+        )
+        book = series_result.fetchone()
+        if book and book.series_id:
+            await get_job_queue().enqueue(
+                "chapter_analysis",
+                {
+                    "chapter_id": row.id,
+                    "book_id": row.book_id,
+                    "series_id": book.series_id,
+                    "chapter_number": row.chapter_number or 1
+                },
+                concurrency_key=f"chapter_analysis:{row.id}"
+            )
+    
     return ChapterResponse(
         id=row.id,
         title=row.title,
@@ -275,11 +301,53 @@ async def delete_chapter(
     
     # Delete from Qdrant
     vector_manager = get_vector_manager()
-    vector_manager.delete_vectors("chapters", [str(chapter_id)])
+    vector_manager.delete_vectors("chapters", [chapter_id])
+    vector_manager.delete_by_filter("chapter_passages", {"chapter_id": chapter_id})
+    await get_lexical_index().delete(f"chapter:{chapter_id}:")
     
     return {"message": "Chapter deleted successfully"}
 
 
+@router.post("/chapters/reindex")
+async def reindex_chapters(
+    chapter_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Rebuild paragraph blocks, the passage index and the lexical index for
+    one or all chapters. Use after upgrading to index chapters saved before
+    passage or lexical indexing.
+    """
+    result = await db.execute(
+        text("""
+            SELECT id, title, content, chapter_number, book_id
+            FROM chapters
+            WHERE CAST(:chapter_id AS integer) IS NULL OR id = :chapter_id
+            ORDER BY id
+        """),
+        {"chapter_id": chapter_id}
+    )
+    rows = result.fetchall()
+    
+    block_service = get_chapter_block_service()
+    passages = 0
+    for row in rows:
+        blocks = await block_service.sync(db, row.id, row.content)
+        if blocks["changed"] and blocks["embedding"]:
+            await db.execute(
+                text("UPDATE chapters SET embedding = :embedding WHERE id = :id"),
+                {"embedding": str(blocks["embedding"]), "id": row.id}
+            )
+        await db.commit()
+        passages += await block_service.index_passages(
+            {"id": row.id, "title": row.title, "chapter_number": row.chapter_number,
+             "book_id": row.book_id},
+            blocks["texts"]
+        )
+    
+    return {"chapters": len(rows), "passages": passages}
+
+
 # Ideas endpoints
 @router.post("/ideas", response_model=IdeaResponse)
 async def create_idea(
@@ -287,7 +355,7 @@ async def create_idea(
     db: AsyncSession = Depends(get_db)
 ):
     """Create a new idea/note."""
-    embedding = generate_embedding(idea.content)
+    embedding = await embed(idea.content)
     
     result = await db.execute(
         text("""
@@ -3,18 +3,23 @@ from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Awaitable
 from uuid import UUID, uuid4
 import json
+import time
 import asyncio
 import logging
 
-from app.database.postgres import get_db
+from app.database.postgres import get_db, AsyncSessionLocal
 from app.database.redis_client import get_conversation_cache
 from app.services.llm_service import get_llm_service
+from app.services.llm_scheduler import Priority
 from app.services.rag_service import get_rag_service
 from app.services.web_search import get_web_search_service
-from app.services.embeddings import generate_embedding
+from app.services.embeddings import embed
+from app.services.chat_persistence import get_chat_persistence
+from app.services.lexical_index import get_lexical_index
+from app.services.entity_lookup import get_entity_lookup_service
 from app.services.document_service import get_long_context_manager
 from app.services.story_analysis import get_story_analysis_service
 from app.services.intent_service import get_intent_service, IntentType, DetectedIntent, FunctionResult
@@ -25,140 +30,29 @@ router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
-async def auto_sync_to_knowledge(session_id, db: AsyncSession):
-    """
-    Auto-sync new messages to knowledge base if sync is enabled for this session.
-    Called after each new message pair is saved.
-    """
-    try:
-        # Check if sync is enabled for this session
-        result = await db.execute(
-            text("""
-                SELECT knowledge_sync_enabled, synced_knowledge_id, last_synced_message_id
-                FROM chat_sessions WHERE id = :session_id
-            """),
-            {"session_id": session_id}
-        )
-        session = result.fetchone()
-        
-        if not session or not session.knowledge_sync_enabled or not session.synced_knowledge_id:
-            return  # Sync not enabled
-        
-        # Get all messages (to rebuild full content)
-        msg_result = await db.execute(
-            text("""
-                SELECT id, role, content
-                FROM chat_messages
-                WHERE session_id = :session_id
-                ORDER BY created_at ASC
-            """),
-            {"session_id": session_id}
-        )
-        messages = msg_result.fetchall()
-        
-        if not messages:
-            return
-        
-        # Format content
-        content_parts = []
-        for msg in messages:
-            role_label = "User" if msg.role == "user" else "Assistant"
-            content_parts.append(f"**{role_label}**: {msg.content}")
-        
-        full_content = "\n\n".join(content_parts)
-        last_message_id = messages[-1].id
-        
-        # Skip if no new messages since last sync
-        if session.last_synced_message_id and last_message_id <= session.last_synced_message_id:
-            return
-        
-        # Generate new embedding
-        embedding = generate_embedding(full_content)
-        
-        # Update knowledge entry
-        await db.execute(
-            text("""
-                UPDATE knowledge_base 
-                SET content = :content, embedding = :embedding, updated_at = NOW()
-                WHERE id = :knowledge_id
-            """),
-            {
-                "content": full_content,
-                "embedding": str(embedding),
-                "knowledge_id": session.synced_knowledge_id
-            }
-        )
-        
-        # Update last synced message ID
-        await db.execute(
-            text("""
-                UPDATE chat_sessions 
-                SET last_synced_message_id = :last_msg_id
-                WHERE id = :session_id
-            """),
-            {"last_msg_id": last_message_id, "session_id": session_id}
-        )
-        
-        # Update Qdrant
-        from app.database.qdrant_client import get_vector_manager
-        vector_manager = get_vector_manager()
-        
-        # Get title for Qdrant payload
-        title_result = await db.execute(
-            text("SELECT title FROM knowledge_base WHERE id = :kid"),
-            {"kid": session.synced_knowledge_id}
-        )
-        title_row = title_result.fetchone()
-        
-        vector_manager.upsert_vectors(
-            collection="knowledge",
-            points=[{
-                "id": session.synced_knowledge_id,
-                "vector": embedding,
-                "payload": {
-                    "id": session.synced_knowledge_id,
-                    "source_type": "chat",
-                    "title": title_row.title if title_row else "Synced Chat",
-                    "content": full_content[:500],
-                    "tags": ['chat-synced', 'auto-updated']
-                }
-            }]
-        )
-        
-        logger.info(f"Auto-synced session {session_id} to knowledge {session.synced_knowledge_id}")
-        
-    except Exception as e:
-        logger.error(f"Auto-sync failed for session {session_id}: {e}")
-
 # Supported languages
 SUPPORTED_LANGUAGES = ["en", "zh-TW", "zh-CN"]
 
 
-async def get_categorized_knowledge(db: AsyncSession, query_embedding: List[float], 
-                                     categories: List[str] = None, 
-                                     language: str = None) -> Dict[str, List[Dict]]:
-    """Retrieve knowledge organized by category."""
-    from app.database.qdrant_client import get_vector_manager
-    
-    vector_manager = get_vector_manager()
-    
-    # Build filter conditions
+def categorized_knowledge_search(categories: List[str] = None,
+                                 language: str = None) -> Dict[str, Any]:
+    """Build the knowledge search spec used for categorized retrieval."""
     filter_conditions = {}
     if categories:
         filter_conditions["category"] = categories
     if language:
         filter_conditions["language"] = language
     
-    # Search in knowledge collection
-    results = vector_manager.search(
-        collection="knowledge",
-        query_vector=query_embedding,
-        limit=20,
-        score_threshold=0.5,
-        filter_conditions=filter_conditions if filter_conditions else None
-    )
-    
-    # Organize by category
+    return {
+        "collection": "knowledge",
+        "limit": 20,
+        "score_threshold": 0.5,
+        "filter_conditions": filter_conditions if filter_conditions else None
+    }
+
+
+def organize_by_category(results: List[Dict[str, Any]]) -> Dict[str, List[Dict]]:
+    """Group knowledge search results by category."""
     categorized = {}
     for r in results:
         payload = r["payload"]
@@ -177,36 +71,103 @@ async def get_categorized_knowledge(db: AsyncSession, query_embedding: List[floa
 
 
 async def get_character_profiles(db: AsyncSession, query: str) -> List[Dict]:
-    """Get relevant character profiles from the database (only approved ones)."""
-    # Search for characters mentioned in the query - only approved ones
-    result = await db.execute(
-        text("""
-            SELECT name, description, personality, appearance, background, 
-                   goals, relationships_summary, first_appearance
-            FROM character_profiles
-            WHERE (name ILIKE :pattern 
-               OR description ILIKE :pattern
-               OR personality ILIKE :pattern)
-               AND (verification_status = 'approved' OR verification_status IS NULL)
-            LIMIT 5
-        """),
-        {"pattern": f"%{query}%"}
-    )
-    rows = result.fetchall()
-    
-    return [
-        {
-            "name": row.name,
-            "description": row.description,
-            "personality": row.personality,
-            "appearance": row.appearance,
-            "background": row.background,
-            "goals": row.goals,
-            "relationships_summary": row.relationships_summary,
-            "first_appearance": row.first_appearance
+    """Get approved character profiles mentioned in the query, via the indexed entity lookup."""
+    return await get_entity_lookup_service().find_characters(db, query, limit=5)
+
+
+async def get_character_profiles_isolated(query: str) -> List[Dict]:
+    """Character profile lookup on its own session, so it can run alongside other stages."""
+    async with AsyncSessionLocal() as session:
+        return await get_character_profiles(session, query)
+
+
+async def retrieve_chat_context(request: ChatRequest, language: str) -> Dict[str, Any]:
+    """RAG context with categorized knowledge in place of the plain knowledge hits."""
+    rag_service = get_rag_service()
+    # Categorized knowledge rides in the same batched search
+    context = await rag_service.retrieve_context(
+        query=request.message,
+        include_knowledge=False,
+        include_graph=request.include_graph,
+        extra_searches={
+            "categorized_knowledge": categorized_knowledge_search(request.categories, language)
         }
-        for row in rows
-    ]
+    )
+    categorized_knowledge = organize_by_category(context.pop("categorized_knowledge", []))
+    context["knowledge"] = []
+    for cat, items in categorized_knowledge.items():
+        for item in items:
+            item["category"] = cat
+            context["knowledge"].append(item)
+    return context
+
+
+async def get_story_position(request: ChatRequest) -> Optional[Dict[str, Any]]:
+    """LLM-aware story position context; None if it can't be loaded."""
+    try:
+        story_service = get_story_analysis_service(request.provider, Priority.INTERACTIVE)
+        return await story_service.get_chapter_position_context(
+            series_id=request.series_id,
+            book_id=request.book_id,
+            chapter_number=request.chapter_number
+        )
+    except Exception as e:
+        # Log but don't fail if position context fails
+        logger.warning(f"Failed to get position context: {e}")
+        return None
+
+
+class ChatPipeline:
+    """
+    Runs independent chat stages as concurrent tasks.
+    
+    Stages start as soon as their inputs are known and are awaited only
+    where their result is needed. Wall time per stage is recorded, and
+    stages still running when the turn short-circuits are cancelled.
+    """
+    
+    def __init__(self):
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.timings: Dict[str, float] = {}
+        self.cancelled: List[str] = []
+        self.token_usage: Optional[Dict[str, Any]] = None
+    
+    async def _timed(self, name: str, awaitable: Awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    
+    def start(self, name: str, awaitable: Awaitable):
+        """Launch a stage in the background."""
+        self.tasks[name] = asyncio.create_task(self._timed(name, awaitable))
+    
+    async def run(self, name: str, awaitable: Awaitable):
+        """Run a stage inline, recording its time."""
+        return await self._timed(name, awaitable)
+    
+    async def result(self, name: str, default: Any = None):
+        """Wait for a launched stage; `default` if it was never started."""
+        task = self.tasks.get(name)
+        return await task if task else default
+    
+    def cancel_pending(self):
+        """Cancel stages that are still running."""
+        for name, task in self.tasks.items():
+            if not task.done():
+                task.cancel()
+                self.cancelled.append(name)
+            elif not task.cancelled():
+                # Mark errors of unconsumed stages as retrieved
+                task.exception()
+    
+    def metadata(self) -> Dict[str, Any]:
+        """Per-stage timings and prompt token usage for the response."""
+        metadata = {"timings_ms": self.timings, "cancelled": self.cancelled}
+        if self.token_usage is not None:
+            metadata["token_usage"] = self.token_usage
+        return metadata
 
 
 # =============================================================================
@@ -317,7 +278,7 @@ async def handle_save_to_knowledge(intent: DetectedIntent, db: AsyncSession) ->
     title = intent.parameters.get("title", f"Note from chat")
     
     try:
-        embedding = generate_embedding(content)
+        embedding = await embed(content)
         result = await db.execute(
             text("""
                 INSERT INTO knowledge_base (source_type, title, content, embedding)
@@ -328,6 +289,7 @@ async def handle_save_to_knowledge(intent: DetectedIntent, db: AsyncSession) ->
         )
         await db.commit()
         kb_id = result.fetchone().id
+        await get_lexical_index().index_knowledge(kb_id, title, content, source_type='chat')
         return FunctionResult(
             success=True,
             result={"knowledge_id": kb_id},
@@ -346,7 +308,7 @@ async def handle_save_to_knowledge(intent: DetectedIntent, db: AsyncSession) ->
 async def handle_analyze_consistency(intent: DetectedIntent, db: AsyncSession, provider: str) -> FunctionResult:
     """Handle consistency analysis intent."""
     try:
-        story_service = get_story_analysis_service(provider)
+        story_service = get_story_analysis_service(provider, Priority.INTERACTIVE)
         # Get the most recent chapter content for analysis
         result = await db.execute(
             text("SELECT content FROM chapters ORDER BY updated_at DESC LIMIT 1")
@@ -395,7 +357,8 @@ async def detect_intent_only(
             "intent": intent.intent.value,
             "confidence": intent.confidence,
             "parameters": intent.parameters,
-            "explanation": intent.explanation
+            "explanation": intent.explanation,
+            "source": intent.source
         }
     except Exception as e:
         logger.error(f"Intent detection failed: {e}")
@@ -433,55 +396,81 @@ async def chat(
         await db.commit()
         session_id = result.fetchone().id
     
+    # Get conversation cache
+    cache = await get_conversation_cache()
+    
     # ==========================================================================
-    # INTENT DETECTION with Ollama Qwen3
+    # Launch independent stages; only the function handlers wait on intent
+    # ==========================================================================
+    pipeline = ChatPipeline()
+    intent_service = get_intent_service()
+    pipeline.start("intent", intent_service.detect_intent(
+        message=request.message,
+        context={"language": language}
+    ))
+    pipeline.start("history", cache.get_messages(str(session_id), 20))
+    if request.use_rag:
+        pipeline.start("retrieval", retrieve_chat_context(request, language))
+        pipeline.start("characters", get_character_profiles_isolated(request.message))
+    if request.use_web_search:
+        search_service = get_web_search_service()
+        pipeline.start("web_search", asyncio.to_thread(search_service.search, request.message, max_results=3))
+    if request.series_id and request.book_id and request.chapter_number:
+        pipeline.start("story_position", get_story_position(request))
+    
+    try:
+        return await _run_chat_turn(request, language, session_id, cache, pipeline, db)
+    finally:
+        pipeline.cancel_pending()
+
+
+async def _run_chat_turn(request: ChatRequest, language: str, session_id, cache,
+                         pipeline: ChatPipeline, db: AsyncSession) -> ChatResponse:
+    """Consume the chat pipeline stages, generate the reply and persist it."""
+    # ==========================================================================
+    # INTENT DETECTION
     # ==========================================================================
     detected_intent = None
     function_result = None
     intent_prefix = ""
     
     try:
-        intent_service = get_intent_service()
-        detected_intent = await intent_service.detect_intent(
-            message=request.message,
-            context={"language": language}
-        )
+        detected_intent = await pipeline.result("intent")
         
         logger.info(f"Detected intent: {detected_intent.intent.value} (confidence: {detected_intent.confidence})")
         
         # Execute function based on intent if confidence is high enough
         if detected_intent.confidence >= 0.7:
             if detected_intent.intent == IntentType.CREATE_CHARACTER:
-                function_result = await handle_create_character(detected_intent, db)
+                function_result = await pipeline.run("handler", handle_create_character(detected_intent, db))
             elif detected_intent.intent == IntentType.CREATE_WORLD_RULE:
-                function_result = await handle_create_world_rule(detected_intent, db)
+                function_result = await pipeline.run("handler", handle_create_world_rule(detected_intent, db))
             elif detected_intent.intent == IntentType.CREATE_FORESHADOWING:
-                function_result = await handle_create_foreshadowing(detected_intent, db)
+                function_result = await pipeline.run("handler", handle_create_foreshadowing(detected_intent, db))
             elif detected_intent.intent == IntentType.SAVE_TO_KNOWLEDGE:
-                function_result = await handle_save_to_knowledge(detected_intent, db)
+                function_result = await pipeline.run("handler", handle_save_to_knowledge(detected_intent, db))
             elif detected_intent.intent == IntentType.ANALYZE_CONSISTENCY:
-                function_result = await handle_analyze_consistency(detected_intent, db, request.provider)
+                function_result = await pipeline.run("handler", handle_analyze_consistency(detected_intent, db, request.provider))
         
         # Prepare intent prefix for response
         if function_result:
             intent_prefix = f"**[{detected_intent.intent.value.upper()}]** {function_result.message}\n\n"
             if not function_result.should_continue_chat:
-                # Return early if function completed the request
+                # Return early if function completed the request; drop speculative context
+                pipeline.cancel_pending()
                 return ChatResponse(
                     session_id=session_id,
                     message=intent_prefix,
                     context_used={"intent": detected_intent.intent.value},
-                    sources=[]
+                    sources=[],
+                    metadata=pipeline.metadata()
                 )
     except Exception as e:
         logger.warning(f"Intent detection/execution failed: {e}")
         # Continue with normal chat if intent detection fails
     
-    # Get conversation cache
-    cache = await get_conversation_cache()
-    
     # Get conversation history (more for long context)
-    history = await cache.get_messages(str(session_id), 20)
+    history = await pipeline.result("history", [])
     conversation_history = [
         {"role": m["role"], "content": m["content"]}
         for m in history
@@ -492,30 +481,10 @@ async def chat(
     sources = []
     
     if request.use_rag:
-        rag_service = get_rag_service()
-        
-        # Get standard RAG context
-        rag_context = await rag_service.retrieve_context(
-            query=request.message,
-            include_graph=request.include_graph
-        )
-        context.update(rag_context)
-        
-        # Get categorized knowledge
-        query_embedding = generate_embedding(request.message)
-        categorized_knowledge = await get_categorized_knowledge(
-            db, query_embedding, 
-            request.categories, 
-            language
-        )
-        context["knowledge"] = []
-        for cat, items in categorized_knowledge.items():
-            for item in items:
-                item["category"] = cat
-                context["knowledge"].append(item)
+        context.update(await pipeline.result("retrieval"))
         
         # Get character profiles
-        character_profiles = await get_character_profiles(db, request.message)
+        character_profiles = await pipeline.result("characters")
         if character_profiles:
             if "characters" not in context:
                 context["characters"] = []
@@ -533,8 +502,7 @@ async def chat(
     
     # Web search if enabled
     if request.use_web_search:
-        search_service = get_web_search_service()
-        web_results = search_service.search(request.message, max_results=3)
+        web_results = await pipeline.result("web_search")
         context["web_search"] = web_results
         sources.extend([
             {"type": "web", "title": r.get("title", ""), "url": r.get("url", "")}
@@ -542,91 +510,54 @@ async def chat(
         ])
     
     # Add story position context (Improvement #4) - LLM-aware story position
-    if request.series_id and request.book_id and request.chapter_number:
-        try:
-            story_service = get_story_analysis_service(request.provider)
-            position_context = await story_service.get_chapter_position_context(
-                series_id=request.series_id,
-                book_id=request.book_id,
-                chapter_number=request.chapter_number
-            )
-            context["story_position"] = position_context
-        except Exception as e:
-            # Log but don't fail if position context fails
-            import logging
-            logging.getLogger(__name__).warning(f"Failed to get position context: {e}")
+    position_context = await pipeline.result("story_position")
+    if position_context is not None:
+        context["story_position"] = position_context
     
     # Generate response with full context
-    llm_service = get_llm_service(request.provider)
-    response_text = await llm_service.generate_with_context(
+    llm_service = get_llm_service(request.provider, Priority.INTERACTIVE)
+    messages, max_tokens, pipeline.token_usage = llm_service.build_messages(
         user_message=request.message,
         context=context,
         conversation_history=conversation_history,
-        temperature=request.temperature,
-        max_tokens=request.max_tokens,
         language=language,
+        max_tokens=request.max_tokens,
         uploaded_content=request.uploaded_content
     )
-    
-    # Save messages to database
-    user_embedding = generate_embedding(request.message)
-    assistant_embedding = generate_embedding(response_text)
-    
-    await db.execute(
-        text("""
-            INSERT INTO chat_messages (session_id, role, content, embedding, metadata)
-            VALUES (:session_id, 'user', :content, :embedding, :metadata)
-        """),
-        {
-            "session_id": session_id,
-            "content": request.message,
-            "embedding": str(user_embedding),
-            "metadata": json.dumps({
-                "use_rag": request.use_rag, 
-                "use_web_search": request.use_web_search,
-                "language": language,
-                "has_upload": bool(request.uploaded_content)
-            })
-        }
-    )
-    
-    await db.execute(
-        text("""
-            INSERT INTO chat_messages (session_id, role, content, embedding, metadata)
-            VALUES (:session_id, 'assistant', :content, :embedding, :metadata)
-        """),
-        {
-            "session_id": session_id,
-            "content": response_text,
-            "embedding": str(assistant_embedding),
-            "metadata": json.dumps({
-                "provider": request.provider or "default", 
-                "sources_count": len(sources),
-                "language": language
-            })
-        }
+    response_text = await pipeline.run(
+        "generation", llm_service.generate_semantic(
+            request.message, context, messages, request.temperature, max_tokens, language,
+            extra=(request.uploaded_content,)
+        )
     )
     
-    # Update session timestamp
-    await db.execute(
-        text("UPDATE chat_sessions SET updated_at = NOW() WHERE id = :session_id"),
-        {"session_id": session_id}
+    # Cache the turn and queue it for persistence; embeddings and inserts happen behind the response
+    await get_chat_persistence().save_turn(
+        cache,
+        session_id,
+        [
+            {
+                "role": "user",
+                "content": request.message,
+                "metadata": {
+                    "use_rag": request.use_rag,
+                    "use_web_search": request.use_web_search,
+                    "language": language,
+                    "has_upload": bool(request.uploaded_content)
+                }
+            },
+            {
+                "role": "assistant",
+                "content": response_text,
+                "metadata": {
+                    "provider": request.provider or "default",
+                    "sources_count": len(sources),
+                    "language": language
+                }
+            }
+        ],
+        context=context
     )
-    await db.commit()
-    
-    # Cache messages
-    await cache.cache_message(str(session_id), {
-        "role": "user",
-        "content": request.message
-    })
-    await cache.cache_message(str(session_id), {
-        "role": "assistant",
-        "content": response_text
-    })
-    
-    # Cache context for this session
-    if context:
-        await cache.cache_context(str(session_id), context)
     
     # Prepend intent action result if any
     final_message = intent_prefix + response_text if intent_prefix else response_text
@@ -636,14 +567,16 @@ async def chat(
         context["detected_intent"] = {
             "type": detected_intent.intent.value,
             "confidence": detected_intent.confidence,
-            "parameters": detected_intent.parameters
+            "parameters": detected_intent.parameters,
+            "source": detected_intent.source
         }
     
     return ChatResponse(
         session_id=session_id,
         message=final_message,
         context_used=context if context else None,
-        sources=sources if sources else None
+        sources=sources if sources else None,
+        metadata=pipeline.metadata()
     )
 
 
@@ -675,111 +608,61 @@ async def chat_stream(
     # Get conversation cache
     cache = await get_conversation_cache()
     
-    # Get conversation history
-    history = await cache.get_messages(str(session_id), 20)
-    conversation_history = [
-        {"role": m["role"], "content": m["content"]}
-        for m in history
-    ]
-    
-    # Retrieve RAG context if enabled
-    context = {}
+    # History, RAG context and web search run concurrently
+    pipeline = ChatPipeline()
+    pipeline.start("history", cache.get_messages(str(session_id), 20))
     if request.use_rag:
-        rag_service = get_rag_service()
-        context = await rag_service.retrieve_context(
-            query=request.message,
-            include_graph=request.include_graph
-        )
-        
-        # Get categorized knowledge
-        query_embedding = generate_embedding(request.message)
-        categorized_knowledge = await get_categorized_knowledge(
-            db, query_embedding, 
-            request.categories, 
-            language
-        )
-        context["knowledge"] = []
-        for cat, items in categorized_knowledge.items():
-            for item in items:
-                item["category"] = cat
-                context["knowledge"].append(item)
-    
-    # Web search if enabled
+        pipeline.start("retrieval", retrieve_chat_context(request, language))
     if request.use_web_search:
         search_service = get_web_search_service()
-        web_results = search_service.search(request.message, max_results=3)
-        context["web_search"] = web_results
+        pipeline.start("web_search", asyncio.to_thread(search_service.search, request.message, max_results=3))
     
-    async def generate():
-        llm_service = get_llm_service(request.provider)
-        full_response = ""
+    try:
+        history = await pipeline.result("history", [])
+        conversation_history = [
+            {"role": m["role"], "content": m["content"]}
+            for m in history
+        ]
         
-        # Build messages with language support
-        system_prompt = llm_service._build_novel_system_prompt(language)
-        if context:
-            context_text = llm_service._format_context(context, language)
-            system_prompt += f"\n\n## Retrieved Context:\n{context_text}"
+        # Retrieve RAG context if enabled
+        context = await pipeline.result("retrieval", {})
         
-        # Add uploaded content if present
-        if request.uploaded_content:
-            upload_header = {
-                "en": "## Uploaded Document Content:",
-                "zh-TW": "## 上傳的文件內容：",
-                "zh-CN": "## 上传的文档内容："
-            }.get(language, "## Uploaded Document Content:")
-            system_prompt += f"\n\n{upload_header}\n{request.uploaded_content[:8000]}"
+        # Web search if enabled
+        if request.use_web_search:
+            context["web_search"] = await pipeline.result("web_search")
+    finally:
+        pipeline.cancel_pending()
+    
+    async def generate():
+        llm_service = get_llm_service(request.provider, Priority.INTERACTIVE)
+        full_response = ""
         
-        messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(conversation_history[-20:])
-        messages.append({"role": "user", "content": request.message})
+        # Build messages with language support, packed into the model's window
+        messages, max_tokens, pipeline.token_usage = llm_service.build_messages(
+            user_message=request.message,
+            context=context,
+            conversation_history=conversation_history,
+            language=language,
+            max_tokens=request.max_tokens,
+            uploaded_content=request.uploaded_content
+        )
         
         # Send session_id first
-        yield f"data: {json.dumps({'type': 'session', 'session_id': str(session_id)})}\n\n"
+        yield f"data: {json.dumps({'type': 'session', 'session_id': str(session_id), 'metadata': pipeline.metadata()})}\n\n"
         
         # Stream response
-        async for chunk in llm_service.stream(messages, request.temperature, request.max_tokens):
+        async for chunk in llm_service.stream_semantic(
+            request.message, context, messages, request.temperature, max_tokens, language,
+            extra=(request.uploaded_content,)
+        ):
             full_response += chunk
             yield f"data: {json.dumps({'type': 'content', 'content': chunk})}\n\n"
         
-        # Save to database after streaming completes
-        user_embedding = generate_embedding(request.message)
-        assistant_embedding = generate_embedding(full_response)
-        
-        await db.execute(
-            text("""
-                INSERT INTO chat_messages (session_id, role, content, embedding, metadata)
-                VALUES (:session_id, 'user', :content, :embedding, :metadata)
-            """),
-            {
-                "session_id": session_id, 
-                "content": request.message, 
-                "embedding": str(user_embedding),
-                "metadata": json.dumps({"language": language})
-            }
-        )
-        
-        await db.execute(
-            text("""
-                INSERT INTO chat_messages (session_id, role, content, embedding, metadata)
-                VALUES (:session_id, 'assistant', :content, :embedding, :metadata)
-            """),
-            {
-                "session_id": session_id, 
-                "content": full_response, 
-                "embedding": str(assistant_embedding),
-                "metadata": json.dumps({"language": language})
-            }
-        )
-        
-        await db.execute(
-            text("UPDATE chat_sessions SET updated_at = NOW() WHERE id = :session_id"),
-            {"session_id": session_id}
-        )
-        await db.commit()
-        
-        # Cache messages
-        await cache.cache_message(str(session_id), {"role": "user", "content": request.message})
-        await cache.cache_message(str(session_id), {"role": "assistant", "content": full_response})
+        # Cache the turn and queue it for persistence
+        await get_chat_persistence().save_turn(cache, session_id, [
+            {"role": "user", "content": request.message, "metadata": {"language": language}},
+            {"role": "assistant", "content": full_response, "metadata": {"language": language}}
+        ])
         
         yield f"data: {json.dumps({'type': 'done'})}\n\n"
     
@@ -9,7 +9,8 @@ import os
 
 from app.database.postgres import get_db
 from app.database.qdrant_client import get_vector_manager
-from app.services.embeddings import generate_embedding, generate_embeddings
+from app.services.ingestion import get_ingestion_service, chunk_point_id
+from app.services.lexical_index import get_lexical_index
 from app.services.document_service import (
     DocumentParser, TextChunker, KNOWLEDGE_CATEGORIES, SUPPORTED_LANGUAGES,
     get_document_parser, get_text_chunker
@@ -104,54 +105,13 @@ async def upload_document(
     doc_row = result.fetchone()
     await db.commit()
     
-    # Process and store chunks with embeddings
-    vector_manager = get_vector_manager()
-    chunk_points = []
-    
-    for chunk in chunks:
-        embedding = generate_embedding(chunk["content"])
-        
-        # Save chunk to database
-        chunk_result = await db.execute(
-            text("""
-                INSERT INTO document_chunks (document_id, chunk_index, content, token_count, embedding, metadata)
-                VALUES (:doc_id, :chunk_index, :content, :token_count, :embedding, :metadata)
-                RETURNING id
-            """),
-            {
-                "doc_id": doc_row.id,
-                "chunk_index": chunk["chunk_index"],
-                "content": chunk["content"],
-                "token_count": chunk["token_count"],
-                "embedding": str(embedding),
-                "metadata": json.dumps({"category": category, "language": language})
-            }
-        )
-        chunk_id = chunk_result.fetchone().id
-        
-        chunk_points.append({
-            "id": f"doc_{doc_row.id}_chunk_{chunk['chunk_index']}",
-            "vector": embedding,
-            "payload": {
-                "document_id": doc_row.id,
-                "chunk_id": chunk_id,
-                "chunk_index": chunk["chunk_index"],
-                "content": chunk["content"][:500],
-                "category": category,
-                "language": language,
-                "filename": file.filename
-            }
-        })
-    
-    await db.commit()
-    
-    # Store in Qdrant for vector search
-    if chunk_points:
-        # Create document chunks collection if needed
-        try:
-            vector_manager.upsert_vectors(collection="knowledge", points=chunk_points)
-        except Exception as e:
-            print(f"Qdrant error: {e}")
+    # Embed chunks in batches, bulk-insert them and index them in Qdrant
+    await get_ingestion_service().store_document_chunks(
+        db, doc_row.id, chunks,
+        filename=file.filename,
+        category=category,
+        language=language
+    )
     
     return {
         "id": doc_row.id,
@@ -312,12 +272,13 @@ async def delete_document(
     
     # Delete from Qdrant
     vector_manager = get_vector_manager()
-    chunk_ids = [f"doc_{document_id}_chunk_{i}" for i in range(chunk_count)]
+    chunk_ids = [chunk_point_id("document", document_id, i) for i in range(chunk_count)]
     if chunk_ids:
         try:
             vector_manager.delete_vectors("knowledge", chunk_ids)
         except Exception as e:
             print(f"Qdrant deletion error: {e}")
+    await get_lexical_index().delete(f"document_chunk:{document_id}:")
     
     return {"message": "Document deleted successfully"}
 
@@ -4,7 +4,7 @@ from typing import List, Dict, Any
 
 from app.database.neo4j_client import get_graph_manager
 from app.api.v1.models import (
-    CharacterCreate, RelationshipCreate, LocationCreate, EventCreate
+    CharacterCreate, RelationshipCreate, LocationCreate, EventCreate, GraphBulkUpsert
 )
 
 router = APIRouter()
@@ -112,6 +112,35 @@ async def create_event(event: EventCreate):
     return {"message": "Event created", "event": result}
 
 
+@router.post("/graph/bulk")
+async def bulk_upsert(bulk: GraphBulkUpsert):
+    """
+    Create or update many characters, locations, events and relationships
+    at once, e.g. to import a book's full cast and timeline.
+    """
+    graph_manager = await get_graph_manager()
+    try:
+        counters = await graph_manager.bulk_upsert(
+            characters=[c.model_dump() for c in bulk.characters],
+            locations=[l.model_dump() for l in bulk.locations],
+            events=[e.model_dump() for e in bulk.events],
+            relationships=[r.model_dump() for r in bulk.relationships]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "message": "Graph updated",
+        "received": {
+            "characters": len(bulk.characters),
+            "locations": len(bulk.locations),
+            "events": len(bulk.events),
+            "relationships": len(bulk.relationships)
+        },
+        **counters
+    }
+
+
 @router.get("/graph/timeline")
 async def get_timeline(start_chapter: int = None, end_chapter: int = None):
     """Get timeline events."""
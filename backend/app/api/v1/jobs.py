@@ -0,0 +1,48 @@
+"""Background job status API endpoints."""
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from app.services.job_queue import get_job_queue
+
+router = APIRouter()
+
+
+@router.get("/jobs")
+async def list_jobs(
+    status: Optional[str] = None,
+    job_type: Optional[str] = None,
+    limit: int = 50
+):
+    """List recent background jobs, optionally filtered by status or type."""
+    jobs = await get_job_queue().list_jobs(status=status, job_type=job_type, limit=limit)
+    return {"jobs": jobs, "total": len(jobs)}
+
+
+@router.get("/jobs/stats")
+async def job_stats():
+    """Job counts per provider and status, with the configured concurrency caps."""
+    queue = get_job_queue()
+    stats = await queue.get_stats()
+    return {
+        "providers": {
+            provider: {"limit": queue.provider_limit(provider), "counts": counts}
+            for provider, counts in stats.items()
+        }
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: int):
+    """Get the status and result of a background job."""
+    job = await get_job_queue().get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: int):
+    """Re-queue a job that failed permanently."""
+    if not await get_job_queue().retry(job_id):
+        raise HTTPException(status_code=400, detail="Only failed jobs can be retried")
+    return {"id": job_id, "status": "queued"}
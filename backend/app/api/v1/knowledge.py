@@ -9,7 +9,9 @@ import json
 
 from app.database.postgres import get_db
 from app.database.qdrant_client import get_vector_manager
-from app.services.embeddings import generate_embedding
+from app.services.embeddings import embed
+from app.services.lexical_index import get_lexical_index
+from app.services.knowledge_sync import get_knowledge_sync_service
 from app.api.v1.models import (
     KnowledgeCreate, KnowledgeResponse, SaveChatAsKnowledge
 )
@@ -24,7 +26,7 @@ async def create_knowledge(
 ):
     """Add a new knowledge base entry."""
     # Generate embedding
-    embedding = generate_embedding(knowledge.content)
+    embedding = await embed(knowledge.content)
     
     # Save to PostgreSQL
     category = getattr(knowledge, 'category', 'other') or 'other'
@@ -66,6 +68,9 @@ async def create_knowledge(
             }
         }]
     )
+    await get_lexical_index().index_knowledge(
+        row.id, knowledge.title, knowledge.content, category=category, source_type=knowledge.source_type
+    )
     
     return KnowledgeResponse(
         id=row.id,
@@ -174,6 +179,8 @@ async def delete_knowledge(
     # Delete from Qdrant
     vector_manager = get_vector_manager()
     vector_manager.delete_vectors("knowledge", [str(knowledge_id)])
+    vector_manager.delete_by_filter("knowledge", {"doc_id": knowledge_id})
+    await get_lexical_index().delete(f"knowledge:{knowledge_id}:")
     
     return {"message": "Knowledge entry deleted successfully"}
 
@@ -222,7 +229,7 @@ async def save_chat_as_knowledge(
     title = request.title or session.title or "Saved Chat"
     
     # Generate embedding
-    embedding = generate_embedding(full_content)
+    embedding = await embed(full_content)
     
     # Create knowledge entry (simple snapshot, no sync)
     result = await db.execute(
@@ -261,6 +268,9 @@ async def save_chat_as_knowledge(
             }
         }]
     )
+    await get_lexical_index().index_knowledge(
+        row.id, title, full_content, category='chat-saved', source_type='chat'
+    )
     
     return KnowledgeResponse(
         id=row.id,
@@ -329,9 +339,16 @@ async def toggle_sync(
     )
     await db.commit()
     
+    # Catch up on the messages so far; later ones are synced as they are persisted
+    knowledge_id = row.synced_knowledge_id
+    if new_status:
+        synced = await get_knowledge_sync_service().sync_session(session_id)
+        if synced and synced["knowledge_id"]:
+            knowledge_id = synced["knowledge_id"]
+    
     return {
         "sync_enabled": new_status,
-        "knowledge_id": row.synced_knowledge_id,
+        "knowledge_id": knowledge_id,
         "message": f"Sync {'enabled' if new_status else 'disabled'}"
     }
 
@@ -352,7 +369,7 @@ async def save_message_as_knowledge(
     Save a single AI response to knowledge, linked to its chat session.
     """
     # Generate embedding
-    embedding = generate_embedding(request.message_content)
+    embedding = await embed(request.message_content)
     
     # Save to database with session link
     result = await db.execute(
@@ -391,6 +408,9 @@ async def save_message_as_knowledge(
             }
         }]
     )
+    await get_lexical_index().index_knowledge(
+        row.id, row.title, request.message_content, category='ai-response', source_type='chat'
+    )
     
     return KnowledgeResponse(
         id=row.id,
@@ -35,6 +35,7 @@ class ChatResponse(BaseModel):
     message: str
     context_used: Optional[Dict[str, Any]] = None
     sources: Optional[List[Dict[str, Any]]] = None
+    metadata: Optional[Dict[str, Any]] = Field(None, description="Pipeline stage timings")
 
 
 # Session Models
@@ -106,6 +107,7 @@ class ChapterUpdate(BaseModel):
     title: Optional[str] = None
     content: Optional[str] = None
     chapter_number: Optional[int] = None
+    auto_analyze: bool = Field(True, description="Run automatic LLM analysis on changed paragraphs")
     metadata: Optional[Dict[str, Any]] = None
 
 
@@ -168,6 +170,13 @@ class EventCreate(BaseModel):
     location: Optional[str] = None
 
 
+class GraphBulkUpsert(BaseModel):
+    characters: List[CharacterCreate] = Field(default=[])
+    locations: List[LocationCreate] = Field(default=[])
+    events: List[EventCreate] = Field(default=[])
+    relationships: List[RelationshipCreate] = Field(default=[])
+
+
 # Search Models
 class SearchRequest(BaseModel):
     query: str
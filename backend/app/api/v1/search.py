@@ -1,10 +1,13 @@
 """Search API endpoints."""
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
 from typing import List, Dict, Any
 
 from app.database.postgres import get_db
 from app.services.rag_service import get_rag_service
+from app.services.lexical_index import get_lexical_index
+from app.services.chapter_blocks import split_blocks
 from app.services.web_search import get_web_search_service
 from app.api.v1.models import SearchRequest, SearchResponse, WebSearchRequest, WebSearchResponse
 
@@ -79,6 +82,72 @@ async def search_knowledge(
     return {"query": query, "results": results}
 
 
+@router.post("/search/lexical/rebuild")
+async def rebuild_lexical_index(db: AsyncSession = Depends(get_db)):
+    """
+    Rebuild the BM25 lexical index from chapters, knowledge entries and
+    document chunks. Use after upgrading to index content saved before
+    lexical indexing; new and edited content is indexed as it is saved.
+    Synced chat sessions are skipped: their chunks are indexed by the
+    knowledge sync and are not stored in the entry's content.
+    """
+    lexical_index = get_lexical_index()
+    
+    chapters = await db.execute(
+        text("SELECT id, title, content, chapter_number, book_id FROM chapters ORDER BY id")
+    )
+    chapter_rows = chapters.fetchall()
+    for row in chapter_rows:
+        await lexical_index.index_chapter(
+            {"id": row.id, "title": row.title, "chapter_number": row.chapter_number, "book_id": row.book_id},
+            split_blocks(row.content)
+        )
+    
+    knowledge = await db.execute(
+        text("""
+            SELECT id, title, content, category, source_type FROM knowledge_base
+            WHERE NOT COALESCE(is_synced_session, FALSE)
+            ORDER BY id
+        """)
+    )
+    knowledge_rows = knowledge.fetchall()
+    for row in knowledge_rows:
+        await lexical_index.index_knowledge(
+            row.id, row.title, row.content, category=row.category, source_type=row.source_type
+        )
+    
+    documents = await db.execute(
+        text("""
+            SELECT d.id, d.original_filename AS filename, d.category,
+                   array_agg(c.id ORDER BY c.chunk_index) AS chunk_ids,
+                   array_agg(c.chunk_index ORDER BY c.chunk_index) AS chunk_indexes,
+                   array_agg(c.content ORDER BY c.chunk_index) AS contents
+            FROM documents d
+            JOIN document_chunks c ON c.document_id = d.id
+            GROUP BY d.id
+            ORDER BY d.id
+        """)
+    )
+    document_rows = documents.fetchall()
+    for row in document_rows:
+        await lexical_index.index_document_chunks(
+            row.id,
+            [
+                {"chunk_id": chunk_id, "chunk_index": chunk_index, "content": content}
+                for chunk_id, chunk_index, content in zip(row.chunk_ids, row.chunk_indexes, row.contents)
+            ],
+            filename=row.filename,
+            category=row.category
+        )
+    
+    return {
+        "chapters": len(chapter_rows),
+        "knowledge": len(knowledge_rows),
+        "documents": len(document_rows),
+        "index": await lexical_index.get_stats()
+    }
+
+
 @router.post("/search/web", response_model=WebSearchResponse)
 async def web_search(request: WebSearchRequest):
     """Perform a web search."""
@@ -107,7 +176,7 @@ async def find_similar(
 ):
     """Find similar content based on an existing piece of content."""
     from sqlalchemy import text
-    from app.services.embeddings import generate_embedding
+    from app.services.embeddings import embed
     from app.database.qdrant_client import get_vector_manager
     
     # Get the content based on type
@@ -134,7 +203,7 @@ async def find_similar(
         raise HTTPException(status_code=404, detail="Content not found")
     
     # Generate embedding and search
-    embedding = generate_embedding(row.content)
+    embedding = await embed(row.content)
     vector_manager = get_vector_manager()
     
     # Search in the same collection, excluding the source
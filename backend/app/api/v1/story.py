@@ -8,6 +8,7 @@ import json
 
 from app.database.postgres import get_db
 from app.services.story_analysis import get_story_analysis_service
+from app.services.llm_scheduler import Priority
 from app.services.embeddings import generate_embedding
 
 router = APIRouter()
@@ -718,7 +719,7 @@ async def get_character_knowledge(
 @router.post("/story/analyze/knowledge-check")
 async def analyze_knowledge_check(request: KnowledgeCheckRequest):
     """Use LLM to check if character action is consistent with their knowledge."""
-    service = get_story_analysis_service()
+    service = get_story_analysis_service(priority=Priority.INTERACTIVE)
     result = await service.check_character_knowledge(
         character_name=request.character_name,
         proposed_action=request.proposed_action,
@@ -731,7 +732,7 @@ async def analyze_knowledge_check(request: KnowledgeCheckRequest):
 @router.post("/story/analyze/knowledge-query")
 async def analyze_knowledge_query(request: KnowledgeQueryRequest):
     """Ask LLM what a character knows about something."""
-    service = get_story_analysis_service()
+    service = get_story_analysis_service(priority=Priority.INTERACTIVE)
     result = await service.query_character_knowledge(
         character_name=request.character_name,
         question=request.question,
@@ -744,7 +745,7 @@ async def analyze_knowledge_query(request: KnowledgeQueryRequest):
 @router.post("/story/analyze/consistency")
 async def analyze_consistency(request: ConsistencyCheckRequest):
     """Use LLM to check content for consistency issues."""
-    service = get_story_analysis_service()
+    service = get_story_analysis_service(priority=Priority.INTERACTIVE)
     result = await service.check_consistency(
         content=request.content,
         series_id=request.series_id,
@@ -756,7 +757,7 @@ async def analyze_consistency(request: ConsistencyCheckRequest):
 @router.post("/story/analyze/foreshadowing")
 async def analyze_foreshadowing(request: ForeshadowingAnalysisRequest):
     """Use LLM to analyze foreshadowing opportunities."""
-    service = get_story_analysis_service()
+    service = get_story_analysis_service(priority=Priority.INTERACTIVE)
     result = await service.analyze_foreshadowing_opportunities(
         chapter_content=request.chapter_content,
         series_id=request.series_id,
@@ -773,7 +774,7 @@ async def get_story_position(
     chapter_number: int
 ):
     """Get chapter position context for AI-enhanced writing."""
-    service = get_story_analysis_service()
+    service = get_story_analysis_service(priority=Priority.INTERACTIVE)
     result = await service.get_chapter_position_context(
         series_id=series_id,
         book_id=book_id,
@@ -1,5 +1,5 @@
 """Document upload API endpoints."""
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from typing import List, Optional
@@ -8,10 +8,12 @@ import uuid
 import asyncio
 
 from app.database.postgres import get_db
-from app.database.qdrant_client import get_vector_manager
-from app.services.embeddings import generate_embedding
+from app.services.embeddings import embed
+from app.services.ingestion import get_ingestion_service
 from app.services.document_service import get_document_processor, KNOWLEDGE_CATEGORIES
 from app.services.document_extraction import get_document_extraction_service
+from app.services.job_queue import get_job_queue
+from app.config import settings
 
 router = APIRouter()
 
@@ -23,7 +25,6 @@ ALLOWED_EXTENSIONS = {'.pdf', '.docx', '.txt'}
 
 @router.post("/upload")
 async def upload_document(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     category: str = Form(None),
     title: str = Form(None),
@@ -91,14 +92,11 @@ async def upload_document(
     if not title:
         title = filename.rsplit('.', 1)[0]
     
-    # Get token count
-    token_count = processor.count_tokens(text_content)
-    
-    # Chunk the document for better retrieval
-    chunks = processor.chunk_text(text_content, chunk_size, chunk_overlap)
+    # Tokenize once for both the token count and the chunks
+    token_count, chunks = processor.tokenize_and_chunk(text_content, chunk_size, chunk_overlap)
     
     # Store the main document
-    main_embedding = generate_embedding(text_content[:8000])  # Embed summary/beginning
+    main_embedding = await embed(text_content[:8000])  # Embed summary/beginning
     
     result = await db.execute(
         text("""
@@ -124,28 +122,8 @@ async def upload_document(
     row = result.fetchone()
     doc_id = row.id
     
-    # Store chunks in Qdrant for better retrieval
-    vector_manager = get_vector_manager()
-    chunk_points = []
-    
-    for chunk in chunks:
-        chunk_embedding = generate_embedding(chunk['text'])
-        chunk_id = f"{doc_id}_chunk_{chunk['index']}"
-        
-        chunk_points.append({
-            "id": hash(chunk_id) % (2**63),  # Convert to int for Qdrant
-            "vector": chunk_embedding,
-            "payload": {
-                "doc_id": doc_id,
-                "chunk_index": chunk['index'],
-                "content": chunk['text'],
-                "title": title,
-                "category": category,
-                "token_count": chunk['token_count']
-            }
-        })
-    
-    vector_manager.upsert_vectors(collection="knowledge", points=chunk_points)
+    # Embed chunks in batches and store them in Qdrant for better retrieval
+    await get_ingestion_service().index_knowledge_chunks(doc_id, title, category, chunks)
     
     # Trigger story element extraction if enabled
     extraction_result = None
@@ -162,10 +140,13 @@ async def upload_document(
             except Exception as e:
                 return {"error": str(e)}
         
-        # Run extraction in background for large documents
+        # Queue extraction for a worker process for large documents
         if token_count > 5000:
-            background_tasks.add_task(run_extraction)
-            extraction_result = {"status": "processing", "message": "Story extraction running in background. Check Verification Hub."}
+            job_id = await get_job_queue().enqueue(
+                "document_extraction",
+                {"knowledge_id": doc_id, "filename": filename, "series_id": series_id, "book_id": None}
+            )
+            extraction_result = {"status": "queued", "job_id": job_id, "message": f"Story extraction queued. Track it at {settings.API_V1_PREFIX}/jobs/{job_id} and check Verification Hub."}
         else:
             # For smaller documents, run synchronously
             extraction_result = await run_extraction()
@@ -244,11 +225,10 @@ async def upload_batch(
                 doc_category = 'notes'
             
             title = filename.rsplit('.', 1)[0]
-            token_count = processor.count_tokens(text_content)
-            chunks = processor.chunk_text(text_content, 1000, 200)
+            token_count, chunks = processor.tokenize_and_chunk(text_content, 1000, 200)
             
             # Store document
-            main_embedding = generate_embedding(text_content[:8000])
+            main_embedding = await embed(text_content[:8000])
             
             result = await db.execute(
                 text("""
@@ -274,27 +254,7 @@ async def upload_batch(
             doc_id = row.id
             
             # Store chunks in Qdrant
-            vector_manager = get_vector_manager()
-            chunk_points = []
-            
-            for chunk in chunks:
-                chunk_embedding = generate_embedding(chunk['text'])
-                chunk_id = f"{doc_id}_chunk_{chunk['index']}"
-                
-                chunk_points.append({
-                    "id": hash(chunk_id) % (2**63),
-                    "vector": chunk_embedding,
-                    "payload": {
-                        "doc_id": doc_id,
-                        "chunk_index": chunk['index'],
-                        "content": chunk['text'],
-                        "title": title,
-                        "category": doc_category,
-                        "token_count": chunk['token_count']
-                    }
-                })
-            
-            vector_manager.upsert_vectors(collection="knowledge", points=chunk_points)
+            await get_ingestion_service().index_knowledge_chunks(doc_id, title, doc_category, chunks)
             
             results.append({
                 "id": doc_id,
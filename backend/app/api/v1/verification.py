@@ -15,6 +15,7 @@ from datetime import datetime
 import json
 
 from app.database.postgres import get_db
+from app.services.gazetteer import get_gazetteer
 
 router = APIRouter(prefix="/verification", tags=["Verification Hub"])
 
@@ -329,6 +330,7 @@ async def verify_character(
         )
     
     await db.commit()
+    await get_gazetteer().refresh_profiles([item_id])
     return {"status": "ok", "action": action.action}
 
 
@@ -578,5 +580,7 @@ async def bulk_verify(
             )
     
     await db.commit()
+    if bulk.item_type == "character":
+        await get_gazetteer().refresh_profiles(bulk.item_ids)
     return {"status": "ok", "updated": len(bulk.item_ids)}
 
@@ -1,9 +1,19 @@
 """Configuration settings for the Novel RAG application."""
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Callable, Optional
 from functools import lru_cache
 
 
+def _parse_provider_map(raw: str, cast: Callable[[str], object]) -> dict:
+    """Parse "provider:value,provider:value" into {provider: cast(value)}."""
+    values = {}
+    for item in raw.split(","):
+        if ":" in item:
+            provider, value = item.split(":", 1)
+            values[provider.strip()] = cast(value)
+    return values
+
+
 class Settings(BaseSettings):
     """Application settings loaded from environment variables."""
     
@@ -36,12 +46,27 @@ class Settings(BaseSettings):
     NEO4J_URI: str = "bolt://localhost:7687"
     NEO4J_USER: str = "neo4j"
     NEO4J_PASSWORD: str = "novelrag_neo4j"
+    GRAPH_NETWORK_MAX_DEPTH: int = 3  # Hop limit for character network queries
+    GRAPH_NETWORK_MAX_NODES: int = 200
+    GRAPH_BULK_BATCH_SIZE: int = 1000  # Rows per write transaction in bulk graph upserts
     
     # Redis
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
     REDIS_DB: int = 0
     CACHE_TTL: int = 3600  # 1 hour
+    CONVERSATION_CACHE_MAX_MESSAGES: int = 200  # Cached messages kept per session
+    
+    # Chat persistence
+    CHAT_WRITE_BEHIND: bool = True  # Persist chat turns in the background instead of before responding
+    CHAT_PERSIST_BATCH_SIZE: int = 200  # Turns per bulk write
+    CHAT_PERSIST_INTERVAL: float = 1.0  # Seconds between writes of queued turns
+    CHAT_PERSIST_CLAIM_IDLE: int = 60  # Seconds before an unacknowledged turn is taken over by another writer
+    
+    # Chat-to-knowledge sync
+    KNOWLEDGE_SYNC_CHUNK_TOKENS: int = 256  # Transcript window per synced chunk (the embedding model's input limit)
+    KNOWLEDGE_SYNC_CHUNK_OVERLAP: int = 32
+    KNOWLEDGE_SYNC_MAX_MESSAGES: int = 200  # Messages synced per transaction
     
     @property
     def redis_url(self) -> str:
@@ -50,15 +75,18 @@ class Settings(BaseSettings):
     # LM Studio (Local LLM)
     LM_STUDIO_URL: str = "http://localhost:1234/v1"
     LM_STUDIO_MODEL: str = "llama-4-maverick"
+    LM_STUDIO_CONTEXT_WINDOW: int = 32768  # Tokens; match the context length the model is loaded with
     
     # DeepSeek API
     DEEPSEEK_API_KEY: Optional[str] = None
     DEEPSEEK_API_URL: str = "https://api.deepseek.com/v1"
     DEEPSEEK_MODEL: str = "deepseek-chat"
+    DEEPSEEK_CONTEXT_WINDOW: int = 65536
     
     # Ollama (Local LLM with Qwen3 for intent detection)
     OLLAMA_URL: str = "http://localhost:11434"
     OLLAMA_MODEL: str = "qwen3:8b"
+    OLLAMA_CONTEXT_WINDOW: int = 8192  # Also sent to Ollama as num_ctx
     OLLAMA_INTENT_MODEL: str = "qwen3:8b"  # Model for intent detection
     
     # Default LLM provider: 'lm_studio', 'deepseek', or 'ollama'
@@ -66,14 +94,132 @@ class Settings(BaseSettings):
     
     # Intent detection provider (defaults to ollama for local fast inference)
     INTENT_DETECTION_PROVIDER: str = "ollama"
+    INTENT_FAST_PATH_ENABLED: bool = True  # Keyword + embedding tiers before the LLM
+    INTENT_KEYWORD_CONFIDENCE: float = 0.9  # Confidence reported for a trigger-phrase match
+    INTENT_CLASSIFIER_THRESHOLD: float = 0.5  # Min centroid similarity to skip the LLM
+    INTENT_CLASSIFIER_MARGIN: float = 0.05  # Min gap between the top two intents
+    
+    # Pooled HTTP clients for LLM providers
+    LLM_HTTP_MAX_CONNECTIONS: int = 20
+    LLM_HTTP_MAX_KEEPALIVE: int = 10
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 30.0  # seconds
+    LLM_HTTP_TIMEOUT: float = 120.0  # seconds
+    LLM_HTTP2: bool = True  # Used over TLS when the h2 package is installed
+    
+    # Per-process admission control for LLM calls. Each API process has the
+    # LLM_* budget and each worker process (app.worker) the WORKER_LLM_*
+    # budget; processes do not coordinate, so priorities only order calls
+    # within one process and a provider can receive the sum of all budgets.
+    # Keep the worker budget small so background jobs leave room for chat.
+    LLM_PROVIDER_CONCURRENCY: str = "deepseek:8,lm_studio:2,ollama:2"  # Concurrent calls per provider
+    LLM_DEFAULT_CONCURRENCY: int = 2  # For providers not listed above
+    LLM_PROVIDER_RATE_LIMITS: str = "deepseek:120"  # Calls per minute; unlisted providers are unlimited
+    WORKER_LLM_PROVIDER_CONCURRENCY: str = "deepseek:4,lm_studio:1,ollama:1"
+    WORKER_LLM_DEFAULT_CONCURRENCY: int = 1
+    WORKER_LLM_PROVIDER_RATE_LIMITS: str = "deepseek:40"
+    
+    @property
+    def llm_provider_concurrency(self) -> dict:
+        return _parse_provider_map(self.LLM_PROVIDER_CONCURRENCY, int)
+    
+    @property
+    def llm_provider_rate_limits(self) -> dict:
+        return _parse_provider_map(self.LLM_PROVIDER_RATE_LIMITS, float)
+    
+    @property
+    def worker_llm_provider_concurrency(self) -> dict:
+        return _parse_provider_map(self.WORKER_LLM_PROVIDER_CONCURRENCY, int)
+    
+    @property
+    def worker_llm_provider_rate_limits(self) -> dict:
+        return _parse_provider_map(self.WORKER_LLM_PROVIDER_RATE_LIMITS, float)
+    
+    # Persistent cache for opted-in deterministic LLM calls
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_TTL: int = 2592000  # 30 days
+    LLM_CACHE_MAX_ENTRIES: int = 50000
+    LLM_CACHE_PRUNE_EVERY: int = 100  # Writes between expiry/size pruning passes
+    
+    # Semantic response cache for near-duplicate chat questions
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95  # Min cosine similarity between questions
+    SEMANTIC_CACHE_TTL: int = 86400  # 1 day
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 10000
+    SEMANTIC_CACHE_PRUNE_EVERY: int = 100  # Writes between pruning passes
     
     # Embeddings
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
     EMBEDDING_DIMENSION: int = 384
+    EMBEDDING_BATCH_SIZE: int = 32  # Max texts per micro-batch
+    EMBEDDING_MAX_WAIT_MS: float = 5.0  # Max time to wait for a batch to fill
+    EMBEDDING_WORKERS: int = 1  # Threads running model inference
+    EMBEDDING_CACHE_SIZE: int = 10000  # In-process LRU entries
+    EMBEDDING_CACHE_TTL: int = 604800  # Redis tier TTL (7 days)
+    
+    # Document ingestion
+    INGEST_EMBED_BATCH_SIZE: int = 64  # Chunks per embedding batch
+    INGEST_DB_BATCH_SIZE: int = 500  # Chunk rows per bulk INSERT
+    INGEST_QDRANT_BATCH_SIZE: int = 256  # Points per Qdrant upsert
+    
+    # Story extraction from uploaded documents
+    EXTRACTION_CHUNK_SIZE: int = 4000  # Characters per extraction chunk
+    EXTRACTION_CONCURRENCY: int = 4  # Parallel LLM calls per document
+    EXTRACTION_MAX_CHUNKS: int = 0  # Chunks per extraction kind; 0 = whole document
+    
+    # Incremental chapter processing
+    CHAPTER_BLOCK_MIN_CHARS: int = 400  # Paragraphs are grouped into blocks of at least this size
+    CHAPTER_BLOCK_MAX_CHARS: int = 1500
+    CHAPTER_MINOR_EDIT_RATIO: float = 0.97  # Edited blocks this similar keep their analysis
+    CHAPTER_ANALYSIS_WINDOW: int = 2000  # Characters of changed blocks per analysis call
+    CHAPTER_SUMMARY_REFRESH_RATIO: float = 0.2  # Changed share of a chapter that refreshes its summary
+    CHAPTER_PASSAGE_TOKENS: int = 192  # Passage size; the embedding model truncates at 256 word pieces
+    CHAPTER_PASSAGE_OVERLAP: int = 32
+    CHAPTER_PASSAGE_FANOUT: int = 4  # Passages retrieved per requested chapter
+    CHAPTER_PASSAGE_POOLING: str = "max"  # Passage-to-chapter score pooling: 'max' or 'sum'
+    
+    # Background jobs
+    JOB_POLL_INTERVAL: float = 2.0  # Seconds between queue polls when idle
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BACKOFF: float = 30.0  # Base retry delay, doubled per attempt
+    JOB_LOCK_TIMEOUT: int = 3600  # Seconds without a heartbeat before a running job is presumed dead
+    JOB_HEARTBEAT_INTERVAL: float = 60.0  # Seconds between lock refreshes of a running job
+    JOB_PROVIDER_CONCURRENCY: str = "deepseek:4,lm_studio:1,ollama:1"  # Running jobs per provider
+    JOB_DEFAULT_CONCURRENCY: int = 1  # For providers not listed above
+    
+    @property
+    def job_provider_concurrency(self) -> dict:
+        return _parse_provider_map(self.JOB_PROVIDER_CONCURRENCY, int)
     
     # RAG Settings
     RAG_TOP_K: int = 5
     RAG_SIMILARITY_THRESHOLD: float = 0.7
+    RAG_VECTOR_TIMEOUT: float = 3.0  # Seconds per vector collection search
+    RAG_GRAPH_TIMEOUT: float = 5.0  # Seconds for the graph lookup
+    
+    # BM25 lexical index, fused with vector hits by reciprocal rank
+    LEXICAL_ENABLED: bool = True
+    LEXICAL_BM25_K1: float = 1.2
+    LEXICAL_BM25_B: float = 0.75
+    LEXICAL_CANDIDATES: int = 4  # Lexical hits fetched per collection, as a multiple of RAG_TOP_K
+    LEXICAL_TIMEOUT: float = 2.0  # Seconds for the lexical lookup
+    RRF_K: int = 60  # Reciprocal rank fusion constant
+    GAZETTEER_REFRESH_INTERVAL: float = 300.0  # Seconds between full reloads of entity names
+    
+    # Optional cross-encoder rerank of retrieved chapters, knowledge and ideas
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    RERANK_CANDIDATES: int = 4  # Candidates fetched per collection, as a multiple of RAG_TOP_K
+    RERANK_CANDIDATE_THRESHOLD: float = 0.3  # Vector similarity floor for candidates
+    RERANK_TOP_N: int = 8  # Hits kept across all collections
+    RERANK_MIN_SCORE: float = 0.0  # Cross-encoder score floor (0..1)
+    RERANK_BATCH_SIZE: int = 32
+    RERANK_MAX_LENGTH: int = 512  # Word pieces per (query, passage) pair
+    RERANK_CACHE_SIZE: int = 20000
+    RERANK_TIMEOUT: float = 3.0  # Seconds before falling back to vector ranking
+    
+    # Prompt assembly within the model's context window
+    CONTEXT_RESPONSE_SHARE: float = 0.25  # Max share of the window reserved for the response
+    CONTEXT_HISTORY_SHARE: float = 0.3  # Max share of the prompt budget for conversation history
     
     class Config:
         env_file = ".env"
@@ -1,4 +1,6 @@
 """Neo4j client for storing context, timelines, and relationships."""
+import asyncio
+import re
 from typing import Optional, List, Dict, Any
 from neo4j import AsyncGraphDatabase, AsyncDriver
 from app.config import settings
@@ -6,6 +8,24 @@ from app.config import settings
 # Neo4j driver instance
 driver: Optional[AsyncDriver] = None
 
+# Relationship types are interpolated into Cypher, so they must be plain identifiers
+RELATIONSHIP_TYPE = re.compile(r"^[A-Z_][A-Z0-9_]*$")
+
+# Characters with special meaning in Lucene query syntax
+LUCENE_SPECIAL = re.compile(r'([+\-!(){}\[\]^"~*?:\\/&|])')
+
+
+def lucene_query(query: str) -> str:
+    """
+    Full-text query for the entity index: the query's words against name
+    and title (boosted) and description, any word matching.
+    """
+    escaped = LUCENE_SPECIAL.sub(r"\\\1", query.strip())
+    escaped = re.sub(r"\b(AND|OR|NOT)\b", lambda m: m.group().lower(), escaped)
+    if not escaped:
+        return ""
+    return f"name:({escaped})^4 OR title:({escaped})^4 OR description:({escaped})"
+
 
 async def init_neo4j():
     """Initialize Neo4j connection."""
@@ -35,6 +55,12 @@ async def init_neo4j():
             CREATE INDEX chapter_number IF NOT EXISTS
             FOR (ch:Chapter) ON (ch.number)
         """)
+        # CJK analyzer: bigrams for Chinese/Japanese/Korean, standard tokens otherwise
+        await session.run("""
+            CREATE FULLTEXT INDEX entity_text IF NOT EXISTS
+            FOR (n:Character|Location|Event) ON EACH [n.name, n.title, n.description]
+            OPTIONS {indexConfig: {`fulltext.analyzer`: 'cjk'}}
+        """)
 
 
 async def close_neo4j():
@@ -51,6 +77,12 @@ def get_neo4j() -> AsyncDriver:
     return driver
 
 
+async def _story_changed():
+    """Retire semantically cached answers given before a graph write."""
+    from app.services.semantic_cache import invalidate_story_data
+    await invalidate_story_data()
+
+
 class NovelGraphManager:
     """Manager for novel-related graph operations."""
     
@@ -70,7 +102,11 @@ class NovelGraphManager:
                 RETURN c
             """, name=name, description=description, attributes=attrs)
             record = await result.single()
-            return dict(record["c"]) if record else None
+        await _story_changed()
+        if record:
+            from app.services.gazetteer import get_gazetteer
+            get_gazetteer().add_graph_entity("character", name)
+        return dict(record["c"]) if record else None
     
     async def create_relationship(self, char1: str, char2: str, 
                                   rel_type: str, properties: Dict[str, Any] = None) -> bool:
@@ -83,7 +119,8 @@ class NovelGraphManager:
                 MERGE (c1)-[r:{rel_type}]->(c2)
                 SET r += $properties, r.updated_at = datetime()
             """, char1=char1, char2=char2, properties=props)
-            return True
+        await _story_changed()
+        return True
     
     async def create_location(self, name: str, description: str = "",
                              attributes: Dict[str, Any] = None) -> Dict[str, Any]:
@@ -98,7 +135,11 @@ class NovelGraphManager:
                 RETURN l
             """, name=name, description=description, attributes=attrs)
             record = await result.single()
-            return dict(record["l"]) if record else None
+        await _story_changed()
+        if record:
+            from app.services.gazetteer import get_gazetteer
+            get_gazetteer().add_graph_entity("location", name)
+        return dict(record["l"]) if record else None
     
     async def create_event(self, event_id: str, title: str, description: str,
                           timestamp: str = None, chapter: int = None) -> Dict[str, Any]:
@@ -115,7 +156,8 @@ class NovelGraphManager:
             """, event_id=event_id, title=title, description=description,
                 timestamp=timestamp, chapter=chapter)
             record = await result.single()
-            return dict(record["e"]) if record else None
+        await _story_changed()
+        return dict(record["e"]) if record else None
     
     async def link_character_to_event(self, character: str, event_id: str, 
                                       role: str = "PARTICIPATES_IN"):
@@ -127,6 +169,7 @@ class NovelGraphManager:
                 MERGE (c)-[r:{role}]->(e)
                 SET r.updated_at = datetime()
             """, character=character, event_id=event_id)
+        await _story_changed()
     
     async def link_event_to_location(self, event_id: str, location: str):
         """Link an event to a location."""
@@ -137,19 +180,168 @@ class NovelGraphManager:
                 MERGE (e)-[r:OCCURS_AT]->(l)
                 SET r.updated_at = datetime()
             """, event_id=event_id, location=location)
+        await _story_changed()
     
-    async def get_character_network(self, character: str, depth: int = 2) -> Dict[str, Any]:
-        """Get a character's relationship network."""
+    async def bulk_upsert(self, characters: List[Dict[str, Any]] = None,
+                          locations: List[Dict[str, Any]] = None,
+                          events: List[Dict[str, Any]] = None,
+                          relationships: List[Dict[str, Any]] = None,
+                          batch_size: int = None) -> Dict[str, int]:
+        """
+        Merge batches of nodes and edges with UNWIND, in managed write
+        transactions of up to `batch_size` rows.
+        
+        - characters / locations: {name, description, attributes}
+        - events: {event_id, title, description, timestamp, chapter,
+          characters: [names], location}; participants and location are
+          linked as PARTICIPATES_IN and OCCURS_AT
+        - relationships: {character1, character2, relationship_type, properties}
+        
+        Nodes are written before edges, so a batch may reference nodes it
+        creates. `attributes` and `properties` must be flat maps. Returns
+        Neo4j's write counters summed over all transactions.
+        """
+        batch_size = batch_size or settings.GRAPH_BULK_BATCH_SIZE
+        characters, locations = characters or [], locations or []
+        events, relationships = events or [], relationships or []
+        
+        by_type: Dict[str, List[Dict[str, Any]]] = {}
+        for rel in relationships:
+            rel_type = rel["relationship_type"].upper().replace(" ", "_")
+            if not RELATIONSHIP_TYPE.match(rel_type):
+                raise ValueError(f"Invalid relationship type: {rel['relationship_type']}")
+            by_type.setdefault(rel_type, []).append({
+                "source": rel["character1"],
+                "target": rel["character2"],
+                "properties": rel.get("properties") or {}
+            })
+        
+        def node_rows(items):
+            return [
+                {"name": n["name"], "description": n.get("description") or "", "attributes": n.get("attributes") or {}}
+                for n in items
+            ]
+        
+        writes = [
+            ("""
+                UNWIND $rows AS row
+                MERGE (c:Character {name: row.name})
+                SET c += row.attributes, c.description = row.description, c.updated_at = datetime()
+            """, node_rows(characters)),
+            ("""
+                UNWIND $rows AS row
+                MERGE (l:Location {name: row.name})
+                SET l += row.attributes, l.description = row.description, l.updated_at = datetime()
+            """, node_rows(locations)),
+            ("""
+                UNWIND $rows AS row
+                MERGE (e:Event {id: row.event_id})
+                SET e.title = row.title,
+                    e.description = row.description,
+                    e.story_timestamp = row.timestamp,
+                    e.chapter = row.chapter,
+                    e.updated_at = datetime()
+            """, [
+                {
+                    "event_id": e["event_id"], "title": e.get("title"), "description": e.get("description"),
+                    "timestamp": e.get("timestamp"), "chapter": e.get("chapter")
+                }
+                for e in events
+            ]),
+            ("""
+                UNWIND $rows AS row
+                MATCH (c:Character {name: row.character})
+                MATCH (e:Event {id: row.event_id})
+                MERGE (c)-[r:PARTICIPATES_IN]->(e)
+                SET r.updated_at = datetime()
+            """, [
+                {"character": name, "event_id": e["event_id"]}
+                for e in events for name in e.get("characters") or []
+            ]),
+            ("""
+                UNWIND $rows AS row
+                MATCH (e:Event {id: row.event_id})
+                MATCH (l:Location {name: row.location})
+                MERGE (e)-[r:OCCURS_AT]->(l)
+                SET r.updated_at = datetime()
+            """, [{"event_id": e["event_id"], "location": e["location"]} for e in events if e.get("location")]),
+        ]
+        for rel_type, rows in by_type.items():
+            writes.append((f"""
+                UNWIND $rows AS row
+                MATCH (c1:Character {{name: row.source}})
+                MATCH (c2:Character {{name: row.target}})
+                MERGE (c1)-[r:{rel_type}]->(c2)
+                SET r += row.properties, r.updated_at = datetime()
+            """, rows))
+        
+        async def write(tx, query: str, rows: List[Dict[str, Any]]):
+            result = await tx.run(query, rows=rows)
+            summary = await result.consume()
+            return summary.counters
+        
+        totals = {"nodes_created": 0, "relationships_created": 0, "properties_set": 0}
         async with self.driver.session() as session:
-            result = await session.run("""
-                MATCH path = (c:Character {name: $character})-[*1..$depth]-(related)
-                RETURN c, collect(distinct path) as paths
-            """, character=character, depth=depth)
+            for query, rows in writes:
+                for start in range(0, len(rows), batch_size):
+                    counters = await session.execute_write(write, query, rows[start:start + batch_size])
+                    for key in totals:
+                        totals[key] += getattr(counters, key)
+        await _story_changed()
+        
+        from app.services.gazetteer import get_gazetteer
+        gazetteer = get_gazetteer()
+        for c in characters:
+            gazetteer.add_graph_entity("character", c["name"])
+        for l in locations:
+            gazetteer.add_graph_entity("location", l["name"])
+        return totals
+    
+    async def get_character_network(self, character: str, depth: int = 2,
+                                    max_nodes: int = None) -> Dict[str, Any]:
+        """
+        Get a character's relationship network: the distinct nodes within
+        `depth` hops (clamped to GRAPH_NETWORK_MAX_DEPTH, at most
+        `max_nodes`) and the relationships among them, aggregated in Neo4j
+        without materializing paths.
+        """
+        depth = max(1, min(int(depth), settings.GRAPH_NETWORK_MAX_DEPTH))
+        max_nodes = max_nodes or settings.GRAPH_NETWORK_MAX_NODES
+        async with self.driver.session() as session:
+            # Variable-length bounds cannot be parameters; depth is a clamped int
+            result = await session.run(f"""
+                MATCH (c:Character {{name: $character}})
+                OPTIONAL MATCH (c)-[*1..{depth}]-(related)
+                WHERE related <> c
+                WITH c, collect(DISTINCT related)[..$max_nodes] AS related
+                WITH c, related, related + c AS members
+                CALL {{
+                    WITH members
+                    UNWIND members AS a
+                    MATCH (a)-[r]->(b)
+                    WHERE b IN members
+                    RETURN collect({{
+                        source: coalesce(a.name, a.title, a.id),
+                        target: coalesce(b.name, b.title, b.id),
+                        type: type(r)
+                    }}) AS relationships
+                }}
+                RETURN c,
+                       [n IN related | {{
+                           name: coalesce(n.name, n.title, n.id),
+                           type: head(labels(n))
+                       }}] AS nodes,
+                       relationships
+            """, character=character, max_nodes=max_nodes)
             record = await result.single()
             if record:
                 return {
                     "character": dict(record["c"]),
-                    "paths_count": len(record["paths"])
+                    "depth": depth,
+                    "nodes": record["nodes"],
+                    "relationships": record["relationships"],
+                    "node_count": len(record["nodes"]),
+                    "relationship_count": len(record["relationships"])
                 }
             return None
     
@@ -215,31 +407,20 @@ class NovelGraphManager:
                 locations.append(loc)
             return locations
     
-    async def search_graph(self, query: str) -> Dict[str, Any]:
-        """Search across the graph for matching nodes."""
+    async def search_graph(self, query: str, limit: int = 20) -> Dict[str, Any]:
+        """Search characters, locations and events through the `entity_text` full-text index."""
+        results = {"characters": [], "locations": [], "events": []}
+        search = lucene_query(query)
+        if not search:
+            return results
         async with self.driver.session() as session:
             result = await session.run("""
-                CALL {
-                    MATCH (c:Character)
-                    WHERE toLower(c.name) CONTAINS toLower($query)
-                       OR toLower(c.description) CONTAINS toLower($query)
-                    RETURN c as node, 'Character' as type
-                    UNION
-                    MATCH (l:Location)
-                    WHERE toLower(l.name) CONTAINS toLower($query)
-                       OR toLower(l.description) CONTAINS toLower($query)
-                    RETURN l as node, 'Location' as type
-                    UNION
-                    MATCH (e:Event)
-                    WHERE toLower(e.title) CONTAINS toLower($query)
-                       OR toLower(e.description) CONTAINS toLower($query)
-                    RETURN e as node, 'Event' as type
-                }
-                RETURN node, type
-                LIMIT 20
-            """, query=query)
+                CALL db.index.fulltext.queryNodes('entity_text', $search, {limit: $limit})
+                YIELD node, score
+                RETURN node, [label IN labels(node) WHERE label IN ['Character', 'Location', 'Event']][0] AS type
+                ORDER BY score DESC
+            """, search=search, limit=limit)
             
-            results = {"characters": [], "locations": [], "events": []}
             async for record in result:
                 node_type = record["type"].lower() + "s"
                 results[node_type].append(dict(record["node"]))
@@ -248,59 +429,89 @@ class NovelGraphManager:
     async def get_context_for_response(self, characters: List[str] = None,
                                        locations: List[str] = None,
                                        chapter: int = None) -> Dict[str, Any]:
-        """Get comprehensive context from graph for generating responses."""
-        context = {"characters": [], "locations": [], "events": [], "relationships": []}
+        """
+        Get comprehensive context from graph for generating responses.
         
+        Characters, locations and chapter events are each fetched with a
+        single query, and the three run concurrently, so the number of
+        round trips does not grow with the number of entities.
+        """
+        character_data, location_data, events = await asyncio.gather(
+            self._characters_with_relationships(characters or []),
+            self._locations_with_events(locations or []),
+            self._chapter_events(chapter)
+        )
+        return {
+            "characters": character_data,
+            "locations": location_data,
+            "events": events,
+            "relationships": []
+        }
+    
+    async def _characters_with_relationships(self, names: List[str]) -> List[Dict[str, Any]]:
+        """Characters by name, in the given order, with their character relationships."""
+        if not names:
+            return []
         async with self.driver.session() as session:
-            # Get character details and relationships
-            if characters:
-                for char_name in characters:
-                    result = await session.run("""
-                        MATCH (c:Character {name: $name})
-                        OPTIONAL MATCH (c)-[r]-(other:Character)
-                        RETURN c, collect({
-                            type: type(r), 
-                            target: other.name, 
-                            direction: CASE WHEN startNode(r) = c THEN 'outgoing' ELSE 'incoming' END
-                        }) as rels
-                    """, name=char_name)
-                    record = await result.single()
-                    if record:
-                        char_data = dict(record["c"])
-                        char_data["relationships"] = [r for r in record["rels"] if r["target"]]
-                        context["characters"].append(char_data)
-            
-            # Get location details
-            if locations:
-                for loc_name in locations:
-                    result = await session.run("""
-                        MATCH (l:Location {name: $name})
-                        OPTIONAL MATCH (e:Event)-[:OCCURS_AT]->(l)
-                        RETURN l, collect(e.title) as events
-                    """, name=loc_name)
-                    record = await result.single()
-                    if record:
-                        loc_data = dict(record["l"])
-                        loc_data["events"] = record["events"]
-                        context["locations"].append(loc_data)
-            
-            # Get chapter events
-            if chapter is not None:
-                result = await session.run("""
-                    MATCH (e:Event {chapter: $chapter})
-                    OPTIONAL MATCH (c:Character)-[:PARTICIPATES_IN]->(e)
-                    OPTIONAL MATCH (e)-[:OCCURS_AT]->(l:Location)
-                    RETURN e, collect(distinct c.name) as characters, 
-                           collect(distinct l.name) as locations
-                    ORDER BY e.story_timestamp
-                """, chapter=chapter)
-                async for record in result:
-                    event = dict(record["e"])
-                    event["characters"] = record["characters"]
-                    event["locations"] = record["locations"]
-                    context["events"].append(event)
-        
-        return context
+            result = await session.run("""
+                UNWIND range(0, size($names) - 1) AS i
+                MATCH (c:Character {name: $names[i]})
+                OPTIONAL MATCH (c)-[r]-(other:Character)
+                WITH i, c, collect({
+                    type: type(r), 
+                    target: other.name, 
+                    direction: CASE WHEN startNode(r) = c THEN 'outgoing' ELSE 'incoming' END
+                }) as rels
+                RETURN c, rels
+                ORDER BY i
+            """, names=names)
+            characters = []
+            async for record in result:
+                char_data = dict(record["c"])
+                char_data["relationships"] = [r for r in record["rels"] if r["target"]]
+                characters.append(char_data)
+            return characters
+    
+    async def _locations_with_events(self, names: List[str]) -> List[Dict[str, Any]]:
+        """Locations by name, in the given order, with the titles of events there."""
+        if not names:
+            return []
+        async with self.driver.session() as session:
+            result = await session.run("""
+                UNWIND range(0, size($names) - 1) AS i
+                MATCH (l:Location {name: $names[i]})
+                OPTIONAL MATCH (e:Event)-[:OCCURS_AT]->(l)
+                WITH i, l, collect(e.title) as events
+                RETURN l, events
+                ORDER BY i
+            """, names=names)
+            locations = []
+            async for record in result:
+                loc_data = dict(record["l"])
+                loc_data["events"] = record["events"]
+                locations.append(loc_data)
+            return locations
+    
+    async def _chapter_events(self, chapter: Optional[int]) -> List[Dict[str, Any]]:
+        """Events of a chapter with their characters and locations."""
+        if chapter is None:
+            return []
+        async with self.driver.session() as session:
+            result = await session.run("""
+                MATCH (e:Event {chapter: $chapter})
+                OPTIONAL MATCH (c:Character)-[:PARTICIPATES_IN]->(e)
+                OPTIONAL MATCH (e)-[:OCCURS_AT]->(l:Location)
+                RETURN e, collect(distinct c.name) as characters, 
+                       collect(distinct l.name) as locations
+                ORDER BY e.story_timestamp
+            """, chapter=chapter)
+            events = []
+            async for record in result:
+                event = dict(record["e"])
+                event["characters"] = record["characters"]
+                event["locations"] = record["locations"]
+                events.append(event)
+            return events
 
 
 async def get_graph_manager() -> NovelGraphManager:
@@ -1,4 +1,5 @@
 """Qdrant vector database client for semantic search."""
+import asyncio
 from typing import List, Dict, Any, Optional
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
@@ -10,6 +11,7 @@ qdrant: Optional[QdrantClient] = None
 
 COLLECTIONS = {
     "chapters": "novel_chapters",
+    "chapter_passages": "novel_chapter_passages",
     "knowledge": "novel_knowledge",
     "ideas": "novel_ideas",
     "messages": "chat_messages"
@@ -57,18 +59,53 @@ class VectorSearchManager:
     def __init__(self, client: QdrantClient):
         self.client = client
     
-    def upsert_vectors(self, collection: str, points: List[Dict[str, Any]]):
-        """Insert or update vectors in a collection."""
+    def upsert_vectors(self, collection: str, points: List[Dict[str, Any]],
+                       batch_size: int = 256):
+        """Insert or update vectors in a collection, in pages of `batch_size`."""
         collection_name = COLLECTIONS.get(collection, collection)
-        point_structs = [
-            PointStruct(
-                id=p["id"],
-                vector=p["vector"],
-                payload=p.get("payload", {})
-            )
-            for p in points
+        for start in range(0, len(points), batch_size):
+            point_structs = [
+                PointStruct(
+                    id=p["id"],
+                    vector=p["vector"],
+                    payload=p.get("payload", {})
+                )
+                for p in points[start:start + batch_size]
+            ]
+            self.client.upsert(collection_name=collection_name, points=point_structs)
+    
+    def _build_filter(self, filter_conditions: Dict[str, Any] = None) -> Optional[models.Filter]:
+        """Build a Qdrant filter from a {key: value-or-list} mapping."""
+        if not filter_conditions:
+            return None
+        must_conditions = []
+        for key, value in filter_conditions.items():
+            if isinstance(value, list):
+                must_conditions.append(
+                    models.FieldCondition(
+                        key=key,
+                        match=models.MatchAny(any=value)
+                    )
+                )
+            else:
+                must_conditions.append(
+                    models.FieldCondition(
+                        key=key,
+                        match=models.MatchValue(value=value)
+                    )
+                )
+        return models.Filter(must=must_conditions)
+    
+    def _format_results(self, results) -> List[Dict[str, Any]]:
+        """Convert scored points to {id, score, payload} dicts."""
+        return [
+            {
+                "id": r.id,
+                "score": r.score,
+                "payload": r.payload
+            }
+            for r in results
         ]
-        self.client.upsert(collection_name=collection_name, points=point_structs)
     
     def search(self, collection: str, query_vector: List[float], 
                limit: int = 5, score_threshold: float = None,
@@ -76,43 +113,78 @@ class VectorSearchManager:
         """Search for similar vectors."""
         collection_name = COLLECTIONS.get(collection, collection)
         
-        # Build filter if provided
-        query_filter = None
-        if filter_conditions:
-            must_conditions = []
-            for key, value in filter_conditions.items():
-                if isinstance(value, list):
-                    must_conditions.append(
-                        models.FieldCondition(
-                            key=key,
-                            match=models.MatchAny(any=value)
-                        )
-                    )
-                else:
-                    must_conditions.append(
-                        models.FieldCondition(
-                            key=key,
-                            match=models.MatchValue(value=value)
-                        )
-                    )
-            query_filter = models.Filter(must=must_conditions)
-        
         results = self.client.search(
             collection_name=collection_name,
             query_vector=query_vector,
             limit=limit,
             score_threshold=score_threshold,
-            query_filter=query_filter
+            query_filter=self._build_filter(filter_conditions)
         )
         
-        return [
-            {
-                "id": r.id,
-                "score": r.score,
-                "payload": r.payload
-            }
-            for r in results
+        return self._format_results(results)
+    
+    async def asearch(self, collection: str, query_vector: List[float],
+                      limit: int = 5, score_threshold: float = None,
+                      filter_conditions: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Search without blocking the event loop."""
+        return await asyncio.to_thread(
+            self.search, collection, query_vector, limit, score_threshold, filter_conditions
+        )
+    
+    def _search_collection_batch(self, collection: str,
+                                 searches: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Run several searches against one collection in a single round trip."""
+        collection_name = COLLECTIONS.get(collection, collection)
+        requests = [
+            models.SearchRequest(
+                vector=s["query_vector"],
+                limit=s.get("limit", 5),
+                score_threshold=s.get("score_threshold"),
+                filter=self._build_filter(s.get("filter_conditions")),
+                with_payload=True
+            )
+            for s in searches
         ]
+        batch_results = self.client.search_batch(
+            collection_name=collection_name,
+            requests=requests
+        )
+        return [self._format_results(results) for results in batch_results]
+    
+    def _group_by_collection(self, searches: List[Dict[str, Any]]) -> Dict[str, List[int]]:
+        """Group search indexes by collection, preserving order."""
+        groups: Dict[str, List[int]] = {}
+        for i, s in enumerate(searches):
+            groups.setdefault(s["collection"], []).append(i)
+        return groups
+    
+    def search_batch(self, searches: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        Run many searches with one round trip per collection.
+        
+        Each search is a dict with `collection`, `query_vector` and optional
+        `limit`, `score_threshold` and `filter_conditions`. Returns one
+        {id, score, payload} list per search, in input order.
+        """
+        results: List[List[Dict[str, Any]]] = [[] for _ in searches]
+        for collection, indexes in self._group_by_collection(searches).items():
+            group_results = self._search_collection_batch(collection, [searches[i] for i in indexes])
+            for i, group_result in zip(indexes, group_results):
+                results[i] = group_result
+        return results
+    
+    async def asearch_batch(self, searches: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Like search_batch, with the per-collection round trips run concurrently."""
+        groups = list(self._group_by_collection(searches).items())
+        group_results = await asyncio.gather(*(
+            asyncio.to_thread(self._search_collection_batch, collection, [searches[i] for i in indexes])
+            for collection, indexes in groups
+        ))
+        results: List[List[Dict[str, Any]]] = [[] for _ in searches]
+        for (_, indexes), batch in zip(groups, group_results):
+            for i, group_result in zip(indexes, batch):
+                results[i] = group_result
+        return results
     
     def delete_vectors(self, collection: str, ids: List[str]):
         """Delete vectors by ID."""
@@ -122,6 +194,18 @@ class VectorSearchManager:
             points_selector=models.PointIdsList(points=ids)
         )
     
+    def delete_by_filter(self, collection: str, filter_conditions: Dict[str, Any],
+                         keep_ids: List[str] = None):
+        """Delete vectors matching a filter, except those in `keep_ids`."""
+        collection_name = COLLECTIONS.get(collection, collection)
+        query_filter = self._build_filter(filter_conditions)
+        if keep_ids:
+            query_filter.must_not = [models.HasIdCondition(has_id=keep_ids)]
+        self.client.delete(
+            collection_name=collection_name,
+            points_selector=models.FilterSelector(filter=query_filter)
+        )
+    
     def get_collection_info(self, collection: str) -> Dict[str, Any]:
         """Get collection information."""
         collection_name = COLLECTIONS.get(collection, collection)
@@ -1,31 +1,43 @@
 """Redis client for caching conversation threads."""
 import json
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import redis.asyncio as redis
 from app.config import settings
 
-# Redis client instance
+# Redis client instances
 redis_client: Optional[redis.Redis] = None
+# Client without response decoding, for binary values (packed vectors)
+redis_binary_client: Optional[redis.Redis] = None
 
 
 async def init_redis():
     """Initialize Redis connection."""
-    global redis_client
+    global redis_client, redis_binary_client
     redis_client = redis.Redis(
         host=settings.REDIS_HOST,
         port=settings.REDIS_PORT,
         db=settings.REDIS_DB,
         decode_responses=True
     )
+    redis_binary_client = redis.Redis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        decode_responses=False
+    )
     # Test connection
     await redis_client.ping()
 
 
 async def close_redis():
     """Close Redis connection."""
-    global redis_client
+    global redis_client, redis_binary_client
     if redis_client:
         await redis_client.close()
+        redis_client = None
+    if redis_binary_client:
+        await redis_binary_client.close()
+        redis_binary_client = None
 
 
 def get_redis() -> redis.Redis:
@@ -35,8 +47,24 @@ def get_redis() -> redis.Redis:
     return redis_client
 
 
+def get_binary_redis() -> redis.Redis:
+    """Get Redis client that returns raw bytes."""
+    if not redis_binary_client:
+        raise RuntimeError("Redis not initialized")
+    return redis_binary_client
+
+
 class ConversationCache:
-    """Cache manager for conversation threads."""
+    """
+    Cache manager for conversation threads.
+    
+    Each session has exactly two keys, `conv:{<session_id>}:messages` (a
+    list capped at CONVERSATION_CACHE_MAX_MESSAGES) and
+    `conv:{<session_id>}:context`. The braces are a hash tag, so both keys
+    share a cluster slot and can be written in one MULTI; since the key
+    names are known, nothing ever pattern-scans the keyspace. Messages are
+    stored as compact JSON arrays: [role, content] or [role, content, extra].
+    """
     
     PREFIX = "conv:"
     MESSAGES_SUFFIX = ":messages"
@@ -45,41 +73,92 @@ class ConversationCache:
     def __init__(self, client: redis.Redis):
         self.client = client
         self.ttl = settings.CACHE_TTL
+        self.max_messages = settings.CONVERSATION_CACHE_MAX_MESSAGES
+    
+    def _keys(self, session_id: str) -> tuple:
+        """(messages key, context key) for a session."""
+        tag = f"{self.PREFIX}{{{session_id}}}"
+        return tag + self.MESSAGES_SUFFIX, tag + self.CONTEXT_SUFFIX
+    
+    @staticmethod
+    def encode_message(message: Dict[str, Any]) -> str:
+        """Compact JSON encoding of a message."""
+        extra = {k: v for k, v in message.items() if k not in ("role", "content")}
+        packed = [message.get("role"), message.get("content")] + ([extra] if extra else [])
+        return json.dumps(packed, ensure_ascii=False, separators=(",", ":"), default=str)
+    
+    @staticmethod
+    def decode_message(data: str) -> Dict[str, Any]:
+        """Inverse of encode_message."""
+        packed = json.loads(data)
+        if isinstance(packed, dict):
+            return packed
+        message = {"role": packed[0], "content": packed[1]}
+        if len(packed) > 2:
+            message.update(packed[2])
+        return message
+    
+    async def append_messages(self, session_id: str, messages: List[Dict[str, Any]],
+                              context: Dict[str, Any] = None,
+                              outbox: Tuple[str, Dict[str, str]] = None):
+        """
+        Append messages (and optionally replace the cached context) in a
+        single MULTI round trip, trimming the list and refreshing TTLs.
+        
+        `outbox` is a (stream, fields) entry added to a Redis stream in the
+        same transaction, so a turn is cached and queued for persistence
+        atomically (on a single Redis node; a cluster would reject the
+        cross-slot MULTI).
+        """
+        messages_key, context_key = self._keys(session_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            if outbox:
+                pipe.xadd(*outbox)
+            if messages:
+                pipe.rpush(messages_key, *(self.encode_message(m) for m in messages))
+                pipe.ltrim(messages_key, -self.max_messages, -1)
+                pipe.expire(messages_key, self.ttl)
+            if context:
+                pipe.set(context_key, json.dumps(context, ensure_ascii=False, default=str), ex=self.ttl)
+            else:
+                pipe.expire(context_key, self.ttl)
+            await pipe.execute()
     
     async def cache_message(self, session_id: str, message: Dict[str, Any]):
         """Cache a message in a conversation thread."""
-        key = f"{self.PREFIX}{session_id}{self.MESSAGES_SUFFIX}"
-        await self.client.rpush(key, json.dumps(message))
-        await self.client.expire(key, self.ttl)
+        await self.append_messages(session_id, [message])
     
     async def get_messages(self, session_id: str, limit: int = 50) -> List[Dict[str, Any]]:
-        """Get cached messages for a conversation."""
-        key = f"{self.PREFIX}{session_id}{self.MESSAGES_SUFFIX}"
-        messages = await self.client.lrange(key, -limit, -1)
-        return [json.loads(m) for m in messages]
+        """Get cached messages for a conversation, extending the session's TTL."""
+        messages_key, context_key = self._keys(session_id)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.lrange(messages_key, -limit, -1)
+            pipe.expire(messages_key, self.ttl)
+            pipe.expire(context_key, self.ttl)
+            messages, _, _ = await pipe.execute()
+        return [self.decode_message(m) for m in messages]
     
     async def cache_context(self, session_id: str, context: Dict[str, Any]):
         """Cache conversation context (RAG results, graph data, etc.)."""
-        key = f"{self.PREFIX}{session_id}{self.CONTEXT_SUFFIX}"
-        await self.client.set(key, json.dumps(context), ex=self.ttl)
+        _, context_key = self._keys(session_id)
+        await self.client.set(context_key, json.dumps(context, ensure_ascii=False, default=str), ex=self.ttl)
     
     async def get_context(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Get cached context for a conversation."""
-        key = f"{self.PREFIX}{session_id}{self.CONTEXT_SUFFIX}"
-        data = await self.client.get(key)
+        _, context_key = self._keys(session_id)
+        data = await self.client.get(context_key)
         return json.loads(data) if data else None
     
     async def clear_session(self, session_id: str):
         """Clear all cached data for a session."""
-        keys = await self.client.keys(f"{self.PREFIX}{session_id}*")
-        if keys:
-            await self.client.delete(*keys)
+        await self.client.delete(*self._keys(session_id))
     
     async def extend_ttl(self, session_id: str):
         """Extend TTL for an active session."""
-        keys = await self.client.keys(f"{self.PREFIX}{session_id}*")
-        for key in keys:
-            await self.client.expire(key, self.ttl)
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key in self._keys(session_id):
+                pipe.expire(key, self.ttl)
+            await pipe.execute()
 
 
 async def get_conversation_cache() -> ConversationCache:
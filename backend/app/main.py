@@ -9,7 +9,16 @@ from app.database.postgres import init_db, close_db
 from app.database.redis_client import init_redis, close_redis
 from app.database.neo4j_client import init_neo4j, close_neo4j
 from app.database.qdrant_client import init_qdrant
-from app.api.v1 import chat, knowledge, chapters, search, sessions, graph, upload, documents, story, verification
+from app.services.embeddings import close_embedding_engine, get_embedding_cache
+from app.services.llm_service import close_llm_clients
+from app.services.llm_scheduler import get_llm_scheduler
+from app.services.llm_cache import get_llm_cache
+from app.services.semantic_cache import get_semantic_cache
+from app.services.reranker import get_reranker, close_reranker
+from app.services.gazetteer import get_gazetteer
+from app.services.chat_persistence import get_chat_persistence, close_chat_persistence
+from app.services.intent_service import get_intent_service
+from app.api.v1 import chat, knowledge, chapters, search, sessions, graph, upload, documents, story, verification, jobs
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -34,15 +43,21 @@ async def lifespan(app: FastAPI):
     await init_qdrant()
     logger.info("✅ Qdrant connected")
     
+    get_chat_persistence().start()
+    
     logger.info("🎉 Novel RAG Chatbot is ready!")
     
     yield
     
     # Cleanup
     logger.info("🛑 Shutting down Novel RAG Chatbot...")
+    await close_chat_persistence()
     await close_db()
     await close_redis()
     await close_neo4j()
+    await close_embedding_engine()
+    await close_llm_clients()
+    close_reranker()
     logger.info("👋 Goodbye!")
 
 
@@ -74,6 +89,7 @@ app.include_router(upload.router, prefix=settings.API_V1_PREFIX, tags=["Upload"]
 app.include_router(documents.router, prefix=settings.API_V1_PREFIX, tags=["Documents"])
 app.include_router(story.router, prefix=settings.API_V1_PREFIX, tags=["Story Management"])
 app.include_router(verification.router, prefix=settings.API_V1_PREFIX, tags=["Verification Hub"])
+app.include_router(jobs.router, prefix=settings.API_V1_PREFIX, tags=["Background Jobs"])
 
 
 @app.get("/")
@@ -91,3 +107,17 @@ async def health_check():
     """Health check endpoint."""
     return {"status": "healthy", "service": settings.APP_NAME}
 
+
+@app.get("/metrics")
+async def metrics():
+    """Runtime cache and performance counters."""
+    return {
+        "embedding_cache": get_embedding_cache().get_stats(),
+        "intent_router": get_intent_service().get_stats(),
+        "llm_cache": get_llm_cache().get_stats(),
+        "semantic_cache": get_semantic_cache().get_stats(),
+        "llm_scheduler": get_llm_scheduler().get_stats(),
+        "reranker": get_reranker().get_stats(),
+        "gazetteer": get_gazetteer().get_stats(),
+        "chat_persistence": get_chat_persistence().get_stats()
+    }
@@ -12,9 +12,10 @@ All auto-extracted items are created with verification_status='pending'
 and must be approved in the Verification Hub before being used in RAG.
 """
 
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable, Awaitable
 from app.services.llm_service import get_llm_service
-from app.services.embeddings import generate_embedding
+from app.services.document_extraction import extracted_item_exists
+from app.config import settings
 from app.database.postgres import AsyncSessionLocal
 from sqlalchemy import text
 import json
@@ -36,34 +37,59 @@ class AutoAnalysisService:
         chapter_content: str,
         book_id: int,
         series_id: int,
-        chapter_number: int
+        chapter_number: int,
+        changed_blocks: Optional[List[str]] = None,
+        refresh_summary: bool = True,
+        on_window_done: Optional[Callable[[List[str]], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
         """
         Triggered automatically when a chapter is saved.
         Runs multiple analyses in parallel.
         All extracted items are created with verification_status='pending'.
-        """
-        results = {}
         
-        # Run analyses in parallel
-        tasks = [
-            self._auto_consistency_check(chapter_content, series_id),
-            self._auto_detect_foreshadowing(chapter_content, series_id, chapter_number),
-            self._auto_extract_facts(chapter_content, series_id, chapter_number),
-            self._auto_generate_summary(chapter_content, chapter_id),
-            self._auto_extract_story_elements(chapter_content, series_id, book_id, chapter_number)
-        ]
+        With `changed_blocks`, consistency, foreshadowing, fact and story
+        element analysis run only on those blocks, packed into windows of
+        CHAPTER_ANALYSIS_WINDOW characters; otherwise on the whole chapter.
+        The summary always covers the whole chapter and is skipped when
+        `refresh_summary` is False. `on_window_done` is awaited with the
+        blocks of each window whose analyses all succeeded.
+        """
+        results = {"windows": []}
+        windows = [[chapter_content]] if changed_blocks is None else self._pack_windows(changed_blocks)
         
         try:
-            consistency, foreshadowing, facts, summary, extractions = await asyncio.gather(
-                *tasks, return_exceptions=True
-            )
+            if refresh_summary:
+                summary_task = asyncio.create_task(
+                    self._auto_generate_summary(chapter_content, chapter_id)
+                )
             
-            results['consistency'] = consistency if not isinstance(consistency, Exception) else {"error": str(consistency)}
-            results['foreshadowing'] = foreshadowing if not isinstance(foreshadowing, Exception) else {"error": str(foreshadowing)}
-            results['extracted_facts'] = facts if not isinstance(facts, Exception) else {"error": str(facts)}
-            results['summary'] = summary if not isinstance(summary, Exception) else {"error": str(summary)}
-            results['auto_extractions'] = extractions if not isinstance(extractions, Exception) else {"error": str(extractions)}
+            # Windows run one after another; analyses within a window in parallel
+            for window_blocks in windows:
+                window = "\n\n".join(window_blocks)
+                tasks = [
+                    self._auto_consistency_check(window, series_id),
+                    self._auto_detect_foreshadowing(window, series_id, chapter_number),
+                    self._auto_extract_facts(window, series_id, chapter_number),
+                    self._auto_extract_story_elements(window, series_id, book_id, chapter_number)
+                ]
+                consistency, foreshadowing, facts, extractions = await asyncio.gather(
+                    *tasks, return_exceptions=True
+                )
+                window_result = {
+                    'characters': len(window),
+                    'consistency': consistency if not isinstance(consistency, Exception) else {"error": str(consistency)},
+                    'foreshadowing': foreshadowing if not isinstance(foreshadowing, Exception) else {"error": str(foreshadowing)},
+                    'extracted_facts': facts if not isinstance(facts, Exception) else {"error": str(facts)},
+                    'auto_extractions': extractions if not isinstance(extractions, Exception) else {"error": str(extractions)}
+                }
+                results['windows'].append(window_result)
+                failed = any(isinstance(v, dict) and "error" in v for v in window_result.values())
+                if on_window_done and not failed:
+                    await on_window_done(window_blocks)
+            
+            if refresh_summary:
+                summary = (await asyncio.gather(summary_task, return_exceptions=True))[0]
+                results['summary'] = summary if not isinstance(summary, Exception) else {"error": str(summary)}
             
         except Exception as e:
             logger.error(f"Auto-analysis failed: {e}")
@@ -71,6 +97,21 @@ class AutoAnalysisService:
         
         return results
     
+    def _pack_windows(self, blocks: List[str]) -> List[List[str]]:
+        """Group consecutive blocks into windows of about CHAPTER_ANALYSIS_WINDOW characters."""
+        windows: List[List[str]] = []
+        current: List[str] = []
+        size = 0
+        for block in blocks:
+            if current and size + len(block) > settings.CHAPTER_ANALYSIS_WINDOW:
+                windows.append(current)
+                current, size = [], 0
+            current.append(block)
+            size += len(block)
+        if current:
+            windows.append(current)
+        return windows
+    
     async def _auto_extract_story_elements(
         self,
         content: str,
@@ -139,7 +180,9 @@ If no violations, respond: {{"violations": [], "clean": true}}
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.1
+            temperature=0.1,
+            cache=True,
+            validate=self._extract_json
         )
         
         try:
@@ -190,7 +233,9 @@ JSON response:
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
+            temperature=0.3,
+            cache=True,
+            validate=self._extract_json
         )
         
         try:
@@ -223,7 +268,9 @@ Only include NOTABLE facts, not every detail.
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.2
+            temperature=0.2,
+            cache=True,
+            validate=self._extract_json
         )
         
         try:
@@ -252,6 +299,9 @@ Only include NOTABLE facts, not every detail.
             for fact in facts:
                 if fact.get("importance") in ["major", "critical"]:
                     try:
+                        description = fact.get("description", "")[:500]
+                        if await extracted_item_exists(db, "story_facts", series_id, description):
+                            continue
                         # Insert the fact with pending status for verification
                         result = await db.execute(
                             text("""
@@ -265,7 +315,7 @@ Only include NOTABLE facts, not every detail.
                             """),
                             {
                                 "series_id": series_id,
-                                "description": fact.get("description", "")[:500],
+                                "description": description,
                                 "chapter": chapter_number,
                                 "is_secret": fact.get("is_secret", False),
                                 "importance": fact.get("importance", "normal")
@@ -312,7 +362,8 @@ Be concise and focus on plot-relevant events only.
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
+            temperature=0.3,
+            cache=True
         )
         
         # Save summary to chapter
@@ -342,25 +393,3 @@ def get_auto_analysis_service(provider: str = None) -> AutoAnalysisService:
     if _auto_service is None:
         _auto_service = AutoAnalysisService(provider)
     return _auto_service
-
-
-async def trigger_chapter_analysis(
-    chapter_id: int,
-    chapter_content: str,
-    book_id: int,
-    series_id: int,
-    chapter_number: int
-) -> Dict[str, Any]:
-    """
-    Call this after saving a chapter to trigger background analysis.
-    Can be called as a background task.
-    """
-    service = get_auto_analysis_service()
-    return await service.on_chapter_save(
-        chapter_id=chapter_id,
-        chapter_content=chapter_content,
-        book_id=book_id,
-        series_id=series_id,
-        chapter_number=chapter_number
-    )
-
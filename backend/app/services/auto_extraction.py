@@ -13,7 +13,8 @@ and will NOT be used in RAG until approved in the Verification Hub.
 
 from typing import Dict, Any, List, Optional
 from app.services.llm_service import get_llm_service
-from app.services.embeddings import generate_embedding
+from app.services.embeddings import embed
+from app.services.document_extraction import extracted_item_exists
 from app.database.postgres import AsyncSessionLocal
 from sqlalchemy import text
 import json
@@ -141,7 +142,9 @@ JSON response:
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.2
+            temperature=0.2,
+            cache=True,
+            validate=self._extract_json
         )
         
         created = []
@@ -160,7 +163,7 @@ JSON response:
                         continue
                     
                     # Create with pending status
-                    embedding = generate_embedding(
+                    embedding = await embed(
                         f"{char.get('name', '')} {char.get('description', '')} {char.get('personality', '')}"
                     )
                     
@@ -244,7 +247,9 @@ If no clear rules found: {{"rules": []}}
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.2
+            temperature=0.2,
+            cache=True,
+            validate=self._extract_json
         )
         
         created = []
@@ -256,6 +261,8 @@ If no clear rules found: {{"rules": []}}
                 for rule in rules:
                     if not rule.get("name") or not rule.get("description"):
                         continue
+                    if await extracted_item_exists(db, "world_rules", series_id, rule["name"]):
+                        continue
                     
                     result = await db.execute(
                         text("""
@@ -336,7 +343,9 @@ If nothing found: {{"seeds": []}}
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
+            temperature=0.3,
+            cache=True,
+            validate=self._extract_json
         )
         
         created = []
@@ -348,6 +357,8 @@ If nothing found: {{"seeds": []}}
                 for seed in seeds:
                     if not seed.get("title") or not seed.get("planted_text"):
                         continue
+                    if await extracted_item_exists(db, "foreshadowing", series_id, seed["title"]):
+                        continue
                     
                     result = await db.execute(
                         text("""
@@ -444,7 +455,9 @@ If no payoffs detected: {{"payoffs": []}}
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.2
+            temperature=0.2,
+            cache=True,
+            validate=self._extract_json
         )
         
         detected = []
@@ -457,6 +470,19 @@ If no payoffs detected: {{"payoffs": []}}
                     if not payoff.get("seed_id"):
                         continue
                     
+                    # A re-run analysis of the chapter finds the same payoff
+                    existing = await db.execute(
+                        text("""
+                            SELECT 1 FROM story_analyses
+                            WHERE series_id = :series_id AND analysis_type = 'pending_payoff'
+                            AND metadata->>'seed_id' = :seed_id AND metadata->>'payoff_chapter' = :chapter
+                            LIMIT 1
+                        """),
+                        {"series_id": series_id, "seed_id": str(payoff["seed_id"]), "chapter": str(chapter_number)}
+                    )
+                    if existing.fetchone():
+                        continue
+                    
                     # Create a pending payoff record (doesn't update the seed yet)
                     # User needs to approve in verification hub
                     result = await db.execute(
@@ -0,0 +1,285 @@
+"""Content-hashed paragraph blocks for incremental chapter processing."""
+import difflib
+import hashlib
+import json
+import logging
+import re
+import uuid
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from app.config import settings
+from app.database.postgres import AsyncSessionLocal
+from app.database.qdrant_client import get_vector_manager
+from app.services.document_service import get_document_processor
+from app.services.embeddings import embed_many
+from app.services.ingestion import CHUNK_NAMESPACE
+from app.services.lexical_index import get_lexical_index
+
+logger = logging.getLogger(__name__)
+
+# Lines such as "***", "* * *", "---" or "#" that separate scenes
+SCENE_BREAK = re.compile(r"^\s*(?:(?:\*\s*){3,}|(?:-\s*){3,}|(?:~\s*){3,}|#)\s*$")
+
+# A block may end after a paragraph whose hash is divisible by this, so
+# boundaries depend on local content and re-synchronize right after an edit
+BLOCK_ANCHOR_MODULUS = 4
+
+
+def block_hash(content: str) -> str:
+    """Hash of a block's normalized text."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def split_blocks(content: str, min_chars: int = None, max_chars: int = None) -> List[str]:
+    """
+    Split chapter text into paragraph blocks.
+
+    Paragraphs (non-empty lines) are grouped until a scene break, until
+    `max_chars` is reached, or once `min_chars` is reached at an anchor
+    paragraph. Whitespace-only edits do not change any block.
+    """
+    min_chars = min_chars or settings.CHAPTER_BLOCK_MIN_CHARS
+    max_chars = max_chars or settings.CHAPTER_BLOCK_MAX_CHARS
+
+    blocks: List[str] = []
+    current: List[str] = []
+    size = 0
+
+    def close():
+        nonlocal current, size
+        if current:
+            blocks.append("\n".join(current))
+        current, size = [], 0
+
+    for line in content.splitlines():
+        paragraph = line.strip()
+        if not paragraph:
+            continue
+        if SCENE_BREAK.match(paragraph):
+            close()
+            continue
+        current.append(paragraph)
+        size += len(paragraph)
+        anchored = int(block_hash(paragraph)[:8], 16) % BLOCK_ANCHOR_MODULUS == 0
+        if size >= max_chars or (size >= min_chars and anchored):
+            close()
+    close()
+    return blocks
+
+
+def passage_id(chapter_id: int, block_index: int, content_hash: str, start_token: int) -> str:
+    """Stable Qdrant point ID for a passage of a block, in the chunk point ID namespace."""
+    return str(uuid.uuid5(
+        CHUNK_NAMESPACE, f"chapter_passage:{chapter_id}:{block_index}:{content_hash}:{start_token}"
+    ))
+
+
+def pool_embeddings(vectors: List[List[float]], weights: List[int]) -> List[float]:
+    """Length-weighted mean of block embeddings, L2-normalized."""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    pooled = np.average(matrix, axis=0, weights=np.asarray(weights, dtype=np.float32))
+    norm = np.linalg.norm(pooled)
+    return (pooled / norm if norm else pooled).tolist()
+
+
+class ChapterBlockService:
+    """
+    Tracks chapters as content-hashed blocks in `chapter_blocks`.
+
+    On save, blocks whose hash already exists keep their embedding and
+    analysis state; only new blocks are embedded. A new block that is a
+    minor edit of the block it replaced (similarity at or above
+    `minor_edit_ratio`, e.g. a typo fix) is re-embedded but keeps its
+    analyzed state, so it is not sent back to the LLM.
+    """
+
+    def __init__(self):
+        self.minor_edit_ratio = settings.CHAPTER_MINOR_EDIT_RATIO
+
+    async def get_blocks(self, db, chapter_id: int) -> List[Dict[str, Any]]:
+        """Stored blocks of a chapter, in order."""
+        result = await db.execute(
+            text("""
+                SELECT block_index, content_hash, content, embedding::text AS embedding,
+                       analyzed_at IS NOT NULL AS analyzed
+                FROM chapter_blocks
+                WHERE chapter_id = :chapter_id
+                ORDER BY block_index
+            """),
+            {"chapter_id": chapter_id}
+        )
+        return [
+            {
+                "index": row.block_index,
+                "hash": row.content_hash,
+                "content": row.content,
+                "embedding": json.loads(row.embedding) if row.embedding else None,
+                "analyzed": row.analyzed
+            }
+            for row in result.fetchall()
+        ]
+
+    def _minor_edits(self, old: List[Dict[str, Any]], new_hashes: List[str],
+                     new_blocks: List[str]) -> set:
+        """Indexes of new blocks that only slightly change the block they replace."""
+        minor = set()
+        matcher = difflib.SequenceMatcher(None, [b["hash"] for b in old], new_hashes, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag != "replace":
+                continue
+            for old_block, j in zip(old[i1:i2], range(j1, j2)):
+                if not old_block["analyzed"]:
+                    continue
+                similarity = difflib.SequenceMatcher(None, old_block["content"], new_blocks[j], autojunk=False)
+                if (similarity.quick_ratio() >= self.minor_edit_ratio
+                        and similarity.ratio() >= self.minor_edit_ratio):
+                    minor.add(j)
+        return minor
+
+    async def sync(self, db, chapter_id: int, content: str) -> Dict[str, Any]:
+        """
+        Replace a chapter's blocks with those of `content`.
+
+        Runs in the caller's transaction. Returns the pooled chapter
+        embedding and counts of reused, re-embedded and pending blocks.
+        """
+        old = await self.get_blocks(db, chapter_id)
+        old_by_hash = {b["hash"]: b for b in old if b["embedding"] is not None}
+
+        new_blocks = split_blocks(content)
+        new_hashes = [block_hash(b) for b in new_blocks]
+        minor = self._minor_edits(old, new_hashes, new_blocks)
+
+        to_embed = sorted({i for i, h in enumerate(new_hashes) if h not in old_by_hash})
+        vectors = await embed_many([new_blocks[i] for i in to_embed]) if to_embed else []
+        embedded = dict(zip(to_embed, vectors))
+
+        rows = []
+        for i, (block, h) in enumerate(zip(new_blocks, new_hashes)):
+            previous = old_by_hash.get(h)
+            rows.append({
+                "chapter_id": chapter_id,
+                "block_index": i,
+                "content_hash": h,
+                "content": block,
+                "embedding": str(embedded[i] if i in embedded else previous["embedding"]),
+                "analyzed": bool(previous and previous["analyzed"]) or i in minor
+            })
+
+        await db.execute(
+            text("DELETE FROM chapter_blocks WHERE chapter_id = :chapter_id"),
+            {"chapter_id": chapter_id}
+        )
+        if rows:
+            await db.execute(
+                text("""
+                    INSERT INTO chapter_blocks
+                        (chapter_id, block_index, content_hash, content, embedding, analyzed_at)
+                    VALUES (:chapter_id, :block_index, :content_hash, :content, :embedding,
+                            CASE WHEN :analyzed THEN NOW() ELSE NULL END)
+                """),
+                rows
+            )
+
+        if new_blocks:
+            block_vectors = [embedded[i] if i in embedded else old_by_hash[h]["embedding"]
+                             for i, h in enumerate(new_hashes)]
+            embedding = pool_embeddings(block_vectors, [len(b) for b in new_blocks])
+        else:
+            embedding = None
+
+        stats = {
+            "embedding": embedding,
+            "blocks": len(new_blocks),
+            "reused": len(new_blocks) - len(to_embed),
+            "embedded": len(to_embed),
+            "minor_edits": len(minor),
+            "pending": sum(1 for r in rows if not r["analyzed"]),
+            "changed": new_hashes != [b["hash"] for b in old],
+            "texts": new_blocks
+        }
+        logger.info(
+            f"Chapter {chapter_id}: {stats['blocks']} blocks, {stats['embedded']} embedded, "
+            f"{stats['pending']} pending analysis"
+        )
+        return stats
+
+    async def index_passages(self, chapter: Dict[str, Any], blocks: List[str]) -> int:
+        """
+        Index a chapter's blocks in Qdrant as overlapping passages.
+
+        Each block is split with DocumentProcessor.chunk_text into passages
+        of CHAPTER_PASSAGE_TOKENS, short enough for the embedding model to
+        see in full. Passage IDs derive from the block's index and hash, so
+        repeated blocks get distinct points, passages of unchanged blocks
+        are overwritten in place (their embeddings come from the embedding
+        cache) and all other passages of the chapter are deleted. The
+        blocks are also written to the BM25 lexical index.
+        `chapter` needs id, title, chapter_number and book_id.
+        """
+        processor = get_document_processor()
+        passages = []
+        for block_index, block in enumerate(blocks):
+            content_hash = block_hash(block)
+            for chunk in processor.chunk_text(block, settings.CHAPTER_PASSAGE_TOKENS,
+                                              settings.CHAPTER_PASSAGE_OVERLAP):
+                passages.append((block_index, content_hash, chunk))
+
+        vectors = await embed_many([chunk["text"] for _, _, chunk in passages]) if passages else []
+        points = [
+            {
+                "id": passage_id(chapter["id"], block_index, content_hash, chunk["start_token"]),
+                "vector": vector,
+                "payload": {
+                    "chapter_id": chapter["id"],
+                    "book_id": chapter.get("book_id"),
+                    "chapter_number": chapter.get("chapter_number"),
+                    "title": chapter.get("title"),
+                    "block_index": block_index,
+                    "start_token": chunk["start_token"],
+                    "end_token": chunk["end_token"],
+                    "content": chunk["text"]
+                }
+            }
+            for (block_index, content_hash, chunk), vector in zip(passages, vectors)
+        ]
+
+        vector_manager = get_vector_manager()
+        if points:
+            vector_manager.upsert_vectors(collection="chapter_passages", points=points)
+        vector_manager.delete_by_filter(
+            "chapter_passages",
+            {"chapter_id": chapter["id"]},
+            keep_ids=[p["id"] for p in points]
+        )
+        await get_lexical_index().index_chapter(chapter, blocks)
+        return len(points)
+
+    async def mark_analyzed(self, chapter_id: int, hashes: List[str]):
+        """Mark blocks as analyzed, if they still exist."""
+        if not hashes:
+            return
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                text("""
+                    UPDATE chapter_blocks SET analyzed_at = NOW()
+                    WHERE chapter_id = :chapter_id AND content_hash = ANY(:hashes)
+                """),
+                {"chapter_id": chapter_id, "hashes": hashes}
+            )
+            await db.commit()
+
+
+# Service singleton
+_chapter_block_service: Optional[ChapterBlockService] = None
+
+
+def get_chapter_block_service() -> ChapterBlockService:
+    """Get or create the chapter block service singleton."""
+    global _chapter_block_service
+    if _chapter_block_service is None:
+        _chapter_block_service = ChapterBlockService()
+    return _chapter_block_service
@@ -0,0 +1,272 @@
+"""Write-behind persistence of chat turns."""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis.exceptions import ResponseError
+from sqlalchemy import text
+
+from app.config import settings
+from app.database.postgres import AsyncSessionLocal
+from app.database.redis_client import ConversationCache, get_redis
+from app.services.embeddings import embed_many
+from app.services.knowledge_sync import get_knowledge_sync_service
+
+logger = logging.getLogger(__name__)
+
+STREAM = "chat:persist"
+GROUP = "chat-writers"
+
+
+class ChatPersistence:
+    """
+    Persists chat turns to PostgreSQL behind the response.
+
+    A turn is cached and appended to the `chat:persist` Redis stream in
+    one MULTI, and the request returns. A writer task in each API process
+    reads the stream through a consumer group every
+    CHAT_PERSIST_INTERVAL seconds and writes up to CHAT_PERSIST_BATCH_SIZE
+    turns at a time: one embed_many call, one bulk INSERT of the messages
+    and one UPDATE of their sessions. Entries are acknowledged only after
+    the commit, and entries left unacknowledged by a crashed writer are
+    claimed by another after CHAT_PERSIST_CLAIM_IDLE seconds, so every
+    turn is written at least once; each message carries a unique
+    `message_key`, so a redelivered turn is not inserted twice.
+    """
+
+    def __init__(self):
+        self.batch_size = settings.CHAT_PERSIST_BATCH_SIZE
+        self.interval = settings.CHAT_PERSIST_INTERVAL
+        self.claim_idle_ms = settings.CHAT_PERSIST_CLAIM_IDLE * 1000
+        self.consumer = f"{socket.gethostname()}:{os.getpid()}"
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self.turns_written = 0
+        self.messages_written = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_batch_ms: Optional[float] = None
+
+    @staticmethod
+    def build_turn(session_id, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        A turn record for {role, content, metadata} messages. Messages are
+        timestamped now, one microsecond apart, so they keep their order.
+        """
+        turn_id = uuid.uuid4().hex
+        now = datetime.now(timezone.utc)
+        return {
+            "turn_id": turn_id,
+            "session_id": str(session_id),
+            "messages": [
+                {
+                    "key": f"{turn_id}:{i}",
+                    "role": m["role"],
+                    "content": m["content"],
+                    "metadata": m.get("metadata") or {},
+                    "created_at": (now + timedelta(microseconds=i)).isoformat()
+                }
+                for i, m in enumerate(messages)
+            ]
+        }
+
+    async def save_turn(self, cache: ConversationCache, session_id, messages: List[Dict[str, Any]],
+                        context: Dict[str, Any] = None):
+        """
+        Cache a turn's {role, content, metadata} messages and queue them
+        for persistence. With CHAT_WRITE_BEHIND off they are written
+        before returning.
+        """
+        turn = self.build_turn(session_id, messages)
+        cached = [{"role": m["role"], "content": m["content"]} for m in messages]
+        if settings.CHAT_WRITE_BEHIND:
+            outbox = (STREAM, {"turn": json.dumps(turn, ensure_ascii=False, default=str)})
+            await cache.append_messages(str(session_id), cached, context=context, outbox=outbox)
+        else:
+            await self.write_turns([turn])
+            await cache.append_messages(str(session_id), cached, context=context)
+
+    async def write_turns(self, turns: List[Dict[str, Any]]):
+        """Embed and insert the messages of `turns` in one transaction."""
+        messages = [(turn["session_id"], m) for turn in turns for m in turn["messages"]]
+        if not messages:
+            return
+        vectors = await embed_many([m["content"] for _, m in messages])
+
+        touched: Dict[str, datetime] = {}
+        for session_id, m in messages:
+            created_at = datetime.fromisoformat(m["created_at"])
+            touched[session_id] = max(created_at, touched.get(session_id, created_at))
+
+        async with AsyncSessionLocal() as db:
+            # Messages of sessions deleted in the meantime are dropped by the join
+            await db.execute(
+                text("""
+                    INSERT INTO chat_messages (session_id, role, content, embedding, metadata, message_key, created_at)
+                    SELECT m.session_id, m.role, m.content, CAST(m.embedding AS vector),
+                           CAST(m.metadata AS jsonb), m.message_key, m.created_at
+                    FROM unnest(
+                        CAST(:session_ids AS uuid[]),
+                        CAST(:roles AS varchar[]),
+                        CAST(:contents AS text[]),
+                        CAST(:embeddings AS text[]),
+                        CAST(:metadata AS text[]),
+                        CAST(:keys AS varchar[]),
+                        CAST(:created_at AS timestamptz[])
+                    ) WITH ORDINALITY AS m(session_id, role, content, embedding, metadata, message_key, created_at, ord)
+                    JOIN chat_sessions s ON s.id = m.session_id
+                    ORDER BY m.ord
+                    ON CONFLICT (message_key) DO NOTHING
+                """),
+                {
+                    "session_ids": [session_id for session_id, _ in messages],
+                    "roles": [m["role"] for _, m in messages],
+                    "contents": [m["content"] for _, m in messages],
+                    "embeddings": [str(v) for v in vectors],
+                    "metadata": [json.dumps(m["metadata"]) for _, m in messages],
+                    "keys": [m["key"] for _, m in messages],
+                    "created_at": [datetime.fromisoformat(m["created_at"]) for _, m in messages]
+                }
+            )
+            await db.execute(
+                text("""
+                    UPDATE chat_sessions s SET updated_at = GREATEST(s.updated_at, t.updated_at)
+                    FROM unnest(CAST(:ids AS uuid[]), CAST(:updated_at AS timestamptz[])) AS t(id, updated_at)
+                    WHERE s.id = t.id
+                """),
+                {"ids": list(touched), "updated_at": list(touched.values())}
+            )
+            await db.commit()
+
+        self.turns_written += len(turns)
+        self.messages_written += len(messages)
+        await get_knowledge_sync_service().sync_sessions(list(touched))
+
+    async def _process(self, entries: List[Tuple[str, Optional[Dict[str, str]]]]):
+        """Write a batch of stream entries and acknowledge the ones written."""
+        if not entries:
+            return
+        # Entries deleted from the stream come back without fields; just acknowledge them
+        turns = {entry_id: json.loads(fields["turn"]) for entry_id, fields in entries if fields}
+        done = [entry_id for entry_id, fields in entries if not fields]
+        started = time.perf_counter()
+        try:
+            await self.write_turns(list(turns.values()))
+            done.extend(turns)
+        except Exception as e:
+            # Write one turn at a time so a bad turn does not hold back the batch
+            logger.warning(f"Chat persistence batch of {len(turns)} failed, retrying per turn: {e}")
+            for entry_id, turn in turns.items():
+                try:
+                    await self.write_turns([turn])
+                    done.append(entry_id)
+                except Exception as turn_error:
+                    self.failures += 1
+                    logger.error(f"Chat turn {turn.get('turn_id')} not persisted, will retry: {turn_error}")
+        self.batches += 1
+        self.last_batch_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        if done:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                pipe.xack(STREAM, GROUP, *done)
+                pipe.xdel(STREAM, *done)
+                await pipe.execute()
+
+    async def _read(self, stream_id: str) -> List[Tuple[str, Optional[Dict[str, str]]]]:
+        response = await get_redis().xreadgroup(
+            GROUP, self.consumer, {STREAM: stream_id}, count=self.batch_size
+        )
+        return response[0][1] if response else []
+
+    async def drain(self):
+        """Write everything queued, including idle entries of other writers."""
+        client = get_redis()
+        cursor = "0-0"
+        while True:
+            claimed = await client.xautoclaim(
+                STREAM, GROUP, self.consumer, self.claim_idle_ms, start_id=cursor, count=self.batch_size
+            )
+            await self._process(claimed[1])
+            cursor = claimed[0]
+            if cursor == "0-0":
+                break
+        while True:
+            entries = await self._read(">")
+            if not entries:
+                break
+            await self._process(entries)
+
+    async def run(self):
+        """Drain the stream every interval until stopped, then once more."""
+        client = get_redis()
+        try:
+            await client.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        # Entries this consumer read before a restart but never acknowledged
+        await self._process(await self._read("0"))
+
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.drain()
+            except Exception as e:
+                logger.error(f"Chat persistence drain failed: {e}")
+
+    def start(self):
+        """Start the writer task."""
+        if settings.CHAT_WRITE_BEHIND and self._task is None:
+            self._task = asyncio.create_task(self.run())
+            logger.info(f"Chat write-behind writer {self.consumer} started")
+
+    async def stop(self):
+        """Write what is queued and stop the writer task."""
+        if self._task is None:
+            return
+        self._stopping.set()
+        try:
+            await self._task
+        except Exception as e:
+            logger.error(f"Chat persistence writer stopped with error: {e}")
+        self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Write counters."""
+        return {
+            "write_behind": settings.CHAT_WRITE_BEHIND,
+            "turns_written": self.turns_written,
+            "messages_written": self.messages_written,
+            "batches": self.batches,
+            "failures": self.failures,
+            "last_batch_ms": self.last_batch_ms
+        }
+
+
+# Persistence singleton
+_chat_persistence: Optional[ChatPersistence] = None
+
+
+def get_chat_persistence() -> ChatPersistence:
+    """Get or create the chat persistence singleton."""
+    global _chat_persistence
+    if _chat_persistence is None:
+        _chat_persistence = ChatPersistence()
+    return _chat_persistence
+
+
+async def close_chat_persistence():
+    """Flush queued turns and stop the writer."""
+    global _chat_persistence
+    if _chat_persistence is not None:
+        await _chat_persistence.stop()
+        _chat_persistence = None
@@ -13,24 +13,108 @@ All extracted items are created with verification_status='pending'
 for user review in the Verification Hub.
 """
 
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable, Tuple
+from app.config import settings
 from app.services.llm_service import get_llm_service
-from app.services.embeddings import generate_embedding
+from app.services.embeddings import embed
 from app.database.postgres import AsyncSessionLocal
 from sqlalchemy import text
+import hashlib
 import json
 import logging
 import re
+import time
 import asyncio
 
 logger = logging.getLogger(__name__)
 
+# Column naming an extracted item of each table; a series holds one item per name
+EXTRACTED_ITEM_KEYS = {
+    "world_rules": "rule_name",
+    "foreshadowing": "title",
+    "story_facts": "fact_description"
+}
+
+
+async def extracted_item_exists(db, table: str, series_id: Optional[int], name: str) -> bool:
+    """
+    Whether the series already has an item of `table` with this name
+    (case-insensitive), so a re-run extraction does not insert it twice.
+    """
+    column = EXTRACTED_ITEM_KEYS[table]
+    result = await db.execute(
+        text(f"""
+            SELECT 1 FROM {table}
+            WHERE series_id IS NOT DISTINCT FROM :series_id AND lower({column}) = lower(:name)
+            LIMIT 1
+        """),
+        {"series_id": series_id, "name": name}
+    )
+    return result.fetchone() is not None
+
+
+class ExtractionCheckpoint:
+    """
+    Per-chunk extraction results persisted while a document is processed.
+    
+    The key is derived from the document content and target series, so a
+    retried or restarted extraction of the same document picks up the
+    chunks that already finished instead of calling the LLM again.
+    """
+    
+    def __init__(self, content: str, series_id: Optional[int], chunk_size: int):
+        digest = hashlib.sha256(f"{series_id}:{chunk_size}:{content}".encode("utf-8"))
+        self.key = digest.hexdigest()
+    
+    async def load(self, kind: str) -> Dict[int, List[Dict]]:
+        """Results of chunks already processed for an extraction kind."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text("""
+                    SELECT chunk_index, items FROM extraction_checkpoints
+                    WHERE checkpoint_key = :key AND kind = :kind
+                """),
+                {"key": self.key, "kind": kind}
+            )
+            rows = result.fetchall()
+        return {
+            row.chunk_index: row.items if isinstance(row.items, list) else json.loads(row.items or '[]')
+            for row in rows
+        }
+    
+    async def save(self, kind: str, chunk_index: int, items: List[Dict]):
+        """Record the result of one chunk."""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                text("""
+                    INSERT INTO extraction_checkpoints (checkpoint_key, kind, chunk_index, items)
+                    VALUES (:key, :kind, :chunk_index, CAST(:items AS jsonb))
+                    ON CONFLICT (checkpoint_key, kind, chunk_index) DO NOTHING
+                """),
+                {"key": self.key, "kind": kind, "chunk_index": chunk_index, "items": json.dumps(items)}
+            )
+            await db.commit()
+    
+    async def clear(self, kind: str):
+        """Drop checkpoints once the merged results are saved."""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                text("DELETE FROM extraction_checkpoints WHERE checkpoint_key = :key AND kind = :kind"),
+                {"key": self.key, "kind": kind}
+            )
+            await db.commit()
+
 
 class DocumentExtractionService:
     """Extract story elements from uploaded documents."""
     
     def __init__(self, provider: str = None):
         self.llm = get_llm_service(provider)
+        self.chunk_size = settings.EXTRACTION_CHUNK_SIZE
+        self.max_chunks = settings.EXTRACTION_MAX_CHUNKS
+        # Bounds concurrent LLM calls across all extraction kinds
+        self._llm_slots = asyncio.Semaphore(settings.EXTRACTION_CONCURRENCY)
+        self.throughput: Dict[str, Dict[str, Any]] = {}
     
     async def extract_from_document(
         self,
@@ -50,7 +134,11 @@ class DocumentExtractionService:
             book_id: Optional existing book to link to
         
         Returns:
-            Dict with extraction results and created item IDs
+            Dict with extraction results and created item IDs. Items of the
+            chunks that succeeded are saved even if others failed; the failed
+            chunk indexes are listed per kind under "incomplete". Running the
+            extraction again resumes those chunks from their checkpoints and
+            the same series, and skips items the series already has.
         """
         results = {
             "series": None,
@@ -60,7 +148,8 @@ class DocumentExtractionService:
             "foreshadowing": [],
             "locations": [],
             "facts": [],
-            "errors": []
+            "errors": [],
+            "incomplete": {}
         }
         
         # First, detect what kind of document this is
@@ -112,6 +201,12 @@ class DocumentExtractionService:
             logger.error(f"Document extraction failed: {e}")
             results["errors"].append(str(e))
         
+        results["throughput"] = self.throughput
+        # Chunks that failed, by kind; their checkpoints are kept for a retry
+        results["incomplete"] = {
+            kind: stats["failed_chunks"] for kind, stats in self.throughput.items() if stats["failed_chunks"]
+        }
+        
         # Calculate totals
         results["total_extracted"] = (
             len(results.get("characters", [])) +
@@ -158,7 +253,9 @@ Respond in JSON:
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.2
+            temperature=0.2,
+            cache=True,
+            validate=self._extract_json
         )
         
         try:
@@ -183,7 +280,20 @@ Respond in JSON:
         return None
     
     async def _create_series_from_document(self, content: str, filename: str) -> int:
-        """Create a new series from document content."""
+        """
+        Create a new series from document content. A series already created
+        from the same content (by an earlier attempt) is returned instead.
+        """
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text("SELECT id FROM series WHERE metadata->>'source_digest' = :digest LIMIT 1"),
+                {"digest": digest}
+            )
+            row = result.fetchone()
+            if row:
+                return row.id
+        
         prompt = f"""Based on this document, extract series information.
 
 DOCUMENT (sample):
@@ -207,7 +317,9 @@ If you can't determine a title, use the filename: {filename}
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
+            temperature=0.3,
+            cache=True,
+            validate=self._extract_json
         )
         
         try:
@@ -227,7 +339,7 @@ If you can't determine a title, use the filename: {filename}
                     "premise": data.get("premise", ""),
                     "themes": data.get("themes", []),
                     "total_planned_books": data.get("planned_books", 1),
-                    "metadata": json.dumps({"auto_extracted": True, "source_file": filename})
+                    "metadata": json.dumps({"auto_extracted": True, "source_file": filename, "source_digest": digest})
                 }
             )
             await db.commit()
@@ -250,12 +362,11 @@ If you can't determine a title, use the filename: {filename}
             )
             existing_names = [r.name.lower() for r in existing.fetchall()]
         
-        # Process in chunks if document is large
-        chunks = self._chunk_for_extraction(content, 4000)
-        all_characters = []
+        # Map every chunk, then merge characters found in several chunks
+        chunks = self._chunk_for_extraction(content, self.chunk_size)
         
-        for chunk in chunks[:3]:  # Process first 3 chunks
-            prompt = f"""Extract CHARACTER information from this text.
+        def build_prompt(chunk: str) -> str:
+            return f"""Extract CHARACTER information from this text.
 
 EXISTING CHARACTERS (don't duplicate): {', '.join(existing_names) if existing_names else 'None yet'}
 
@@ -289,27 +400,26 @@ JSON response:
   }}
 ]}}
 """
-            
-            response = await self.llm.generate(
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.2
+        
+        checkpoint = ExtractionCheckpoint(content, series_id, self.chunk_size)
+        items = await self._map_chunks("characters", chunks, build_prompt, "characters", 0.2, checkpoint)
+        all_characters = [
+            char for char in self._merge_items(
+                items,
+                key_field="name",
+                alias_field="aliases",
+                text_fields=("description", "personality", "appearance", "background", "goals", "speech_patterns"),
+                list_fields=("aliases",)
             )
-            
-            try:
-                data = self._extract_json(response)
-                for char in data.get("characters", []):
-                    if char.get("name") and char.get("name", "").lower() not in existing_names:
-                        all_characters.append(char)
-                        existing_names.append(char["name"].lower())
-            except Exception as e:
-                logger.warning(f"Character extraction chunk failed: {e}")
+            if str(char["name"]).lower() not in existing_names
+        ]
         
         # Save characters to database
         created = []
         async with AsyncSessionLocal() as db:
             for char in all_characters:
                 try:
-                    embedding = generate_embedding(
+                    embedding = await embed(
                         f"{char.get('name', '')} {char.get('description', '')} {char.get('personality', '')}"
                     )
                     
@@ -351,6 +461,8 @@ JSON response:
             
             await db.commit()
         
+        if not self.throughput["characters"]["failed_chunks"]:
+            await checkpoint.clear("characters")
         return created
     
     async def _extract_world_rules(
@@ -361,11 +473,10 @@ JSON response:
     ) -> List[Dict]:
         """Extract world-building rules from document."""
         
-        chunks = self._chunk_for_extraction(content, 4000)
-        all_rules = []
+        chunks = self._chunk_for_extraction(content, self.chunk_size)
         
-        for chunk in chunks[:3]:
-            prompt = f"""Extract WORLD-BUILDING RULES from this text.
+        def build_prompt(chunk: str) -> str:
+            return f"""Extract WORLD-BUILDING RULES from this text.
 
 Look for:
 - Magic system rules/limitations
@@ -395,17 +506,15 @@ JSON response:
 
 If nothing found: {{"rules": []}}
 """
-            
-            response = await self.llm.generate(
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.2
-            )
-            
-            try:
-                data = self._extract_json(response)
-                all_rules.extend(data.get("rules", []))
-            except Exception as e:
-                logger.warning(f"World rule extraction chunk failed: {e}")
+        
+        checkpoint = ExtractionCheckpoint(content, series_id, self.chunk_size)
+        items = await self._map_chunks("world_rules", chunks, build_prompt, "rules", 0.2, checkpoint)
+        all_rules = self._merge_items(
+            items,
+            key_field="name",
+            text_fields=("description", "source_text"),
+            list_fields=("exceptions",)
+        )
         
         # Save to database
         created = []
@@ -415,6 +524,8 @@ If nothing found: {{"rules": []}}
                     continue
                 
                 try:
+                    if await extracted_item_exists(db, "world_rules", series_id, rule["name"]):
+                        continue
                     result = await db.execute(
                         text("""
                             INSERT INTO world_rules 
@@ -449,6 +560,8 @@ If nothing found: {{"rules": []}}
             
             await db.commit()
         
+        if not self.throughput["world_rules"]["failed_chunks"]:
+            await checkpoint.clear("world_rules")
         return created
     
     async def _extract_foreshadowing(
@@ -459,11 +572,10 @@ If nothing found: {{"rules": []}}
     ) -> List[Dict]:
         """Extract foreshadowing elements from document."""
         
-        chunks = self._chunk_for_extraction(content, 4000)
-        all_seeds = []
+        chunks = self._chunk_for_extraction(content, self.chunk_size)
         
-        for chunk in chunks[:3]:
-            prompt = f"""Analyze this text for FORESHADOWING elements.
+        def build_prompt(chunk: str) -> str:
+            return f"""Analyze this text for FORESHADOWING elements.
 
 Look for:
 - Mysterious hints about future events
@@ -489,17 +601,14 @@ JSON response:
 
 If nothing found: {{"seeds": []}}
 """
-            
-            response = await self.llm.generate(
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3
-            )
-            
-            try:
-                data = self._extract_json(response)
-                all_seeds.extend(data.get("seeds", []))
-            except Exception as e:
-                logger.warning(f"Foreshadowing extraction chunk failed: {e}")
+        
+        checkpoint = ExtractionCheckpoint(content, series_id, self.chunk_size)
+        items = await self._map_chunks("foreshadowing", chunks, build_prompt, "seeds", 0.3, checkpoint)
+        all_seeds = self._merge_items(
+            items,
+            key_field="title",
+            text_fields=("intended_payoff",)
+        )
         
         # Save to database
         created = []
@@ -509,6 +618,8 @@ If nothing found: {{"seeds": []}}
                     continue
                 
                 try:
+                    if await extracted_item_exists(db, "foreshadowing", series_id, seed["title"]):
+                        continue
                     result = await db.execute(
                         text("""
                             INSERT INTO foreshadowing 
@@ -543,6 +654,8 @@ If nothing found: {{"seeds": []}}
             
             await db.commit()
         
+        if not self.throughput["foreshadowing"]["failed_chunks"]:
+            await checkpoint.clear("foreshadowing")
         return created
     
     async def _extract_locations(
@@ -576,7 +689,9 @@ JSON response:
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
+            temperature=0.3,
+            cache=True,
+            validate=self._extract_json
         )
         
         # Note: We'd save these to a locations table if we had one
@@ -591,6 +706,10 @@ JSON response:
                     if not loc.get("name"):
                         continue
                     
+                    description = f"Location: {loc.get('name')} - {loc.get('description', '')} ({loc.get('type', 'place')})"
+                    if await extracted_item_exists(db, "story_facts", series_id, description):
+                        continue
+                    
                     result = await db.execute(
                         text("""
                             INSERT INTO story_facts 
@@ -602,7 +721,7 @@ JSON response:
                         """),
                         {
                             "series_id": series_id,
-                            "description": f"Location: {loc.get('name')} - {loc.get('description', '')} ({loc.get('type', 'place')})"
+                            "description": description
                         }
                     )
                     row = result.fetchone()
@@ -657,7 +776,9 @@ Only include NOTABLE facts, not every detail.
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
+            temperature=0.3,
+            cache=True,
+            validate=self._extract_json
         )
         
         created = []
@@ -673,6 +794,8 @@ Only include NOTABLE facts, not every detail.
                     # Only save major/critical facts
                     if fact.get("importance") not in ["major", "critical"]:
                         continue
+                    if await extracted_item_exists(db, "story_facts", series_id, fact["description"][:500]):
+                        continue
                     
                     result = await db.execute(
                         text("""
@@ -706,6 +829,124 @@ Only include NOTABLE facts, not every detail.
         
         return created
     
+    async def _map_chunks(
+        self,
+        kind: str,
+        chunks: List[str],
+        build_prompt: Callable[[str], str],
+        result_key: str,
+        temperature: float,
+        checkpoint: ExtractionCheckpoint
+    ) -> List[Dict]:
+        """
+        Run an extraction prompt over every chunk with bounded parallelism.
+        
+        Chunks already in the checkpoint are skipped; each finished chunk is
+        checkpointed as it completes. Returns the items of the chunks that
+        succeeded, in chunk order, and records throughput (including the
+        indexes of failed chunks) under self.throughput[kind].
+        """
+        if self.max_chunks:
+            chunks = chunks[:self.max_chunks]
+        
+        done = await checkpoint.load(kind)
+        pending = [(i, chunk) for i, chunk in enumerate(chunks) if i not in done]
+        
+        async def process(index: int, chunk: str) -> List[Dict]:
+            async with self._llm_slots:
+                response = await self.llm.generate(
+                    messages=[{"role": "user", "content": build_prompt(chunk)}],
+                    temperature=temperature,
+                    cache=True,
+                    validate=self._extract_json
+                )
+            items = [item for item in self._extract_json(response).get(result_key, []) if isinstance(item, dict)]
+            await checkpoint.save(kind, index, items)
+            return items
+        
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(
+            *(process(i, chunk) for i, chunk in pending),
+            return_exceptions=True
+        )
+        elapsed = time.perf_counter() - start
+        
+        results = dict(done)
+        failed_chunks = []
+        for (index, _), outcome in zip(pending, outcomes):
+            if isinstance(outcome, Exception):
+                failed_chunks.append(index)
+                logger.warning(f"{kind} extraction chunk {index} failed: {outcome}")
+            else:
+                results[index] = outcome
+        
+        processed = len(pending) - len(failed_chunks)
+        self.throughput[kind] = {
+            "chunks": len(chunks),
+            "resumed": len(done),
+            "processed": processed,
+            "failed": len(failed_chunks),
+            "failed_chunks": failed_chunks,
+            "seconds": round(elapsed, 2),
+            "chunks_per_sec": round(processed / elapsed, 2) if elapsed > 0 else 0.0
+        }
+        logger.info(f"{kind} extraction: {self.throughput[kind]}")
+        
+        return [item for index in sorted(results) for item in results[index]]
+    
+    def _merge_items(
+        self,
+        items: List[Dict],
+        key_field: str,
+        alias_field: Optional[str] = None,
+        text_fields: Tuple[str, ...] = (),
+        list_fields: Tuple[str, ...] = ()
+    ) -> List[Dict]:
+        """
+        Deduplicate items extracted from different chunks.
+        
+        Items match on the normalized key (or any alias). Merged items keep
+        the longest value of each text field, the union of list fields and
+        the highest confidence.
+        """
+        def normalize(value: Any) -> str:
+            return " ".join(str(value).lower().split()) if value else ""
+        
+        merged: List[Dict] = []
+        index: Dict[str, int] = {}
+        
+        for item in items:
+            key = normalize(item.get(key_field))
+            if not key:
+                continue
+            
+            names = [key]
+            if alias_field:
+                names += [normalize(a) for a in item.get(alias_field) or [] if normalize(a)]
+            
+            position = next((index[n] for n in names if n in index), None)
+            if position is None:
+                position = len(merged)
+                merged.append(dict(item))
+            else:
+                target = merged[position]
+                for field in text_fields:
+                    if len(str(item.get(field) or "")) > len(str(target.get(field) or "")):
+                        target[field] = item[field]
+                for field in list_fields:
+                    values = list(target.get(field) or [])
+                    values += [v for v in item.get(field) or [] if v not in values]
+                    target[field] = values
+                try:
+                    target["confidence"] = max(float(target.get("confidence") or 0), float(item.get("confidence") or 0))
+                except (TypeError, ValueError):
+                    pass
+            
+            for name in names:
+                index.setdefault(name, position)
+        
+        return merged
+    
     def _chunk_for_extraction(self, content: str, chunk_size: int = 4000) -> List[str]:
         """Split content into chunks for processing."""
         chunks = []
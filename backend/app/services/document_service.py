@@ -1,6 +1,9 @@
 """Document processing service for DOCX, PDF, and TXT files."""
+import hashlib
 import io
 import logging
+from collections import OrderedDict
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 import tiktoken
@@ -108,6 +111,11 @@ class DocumentProcessor:
     def chunk_text(self, text: str, chunk_size: int = 1000, 
                    overlap: int = 200) -> List[Dict[str, Any]]:
         """Split text into overlapping chunks."""
+        return self.tokenize_and_chunk(text, chunk_size, overlap)[1]
+    
+    def tokenize_and_chunk(self, text: str, chunk_size: int = 1000,
+                           overlap: int = 200) -> tuple:
+        """Tokenize text once, returning (total token count, overlapping chunks)."""
         tokens = self.encoding.encode(text)
         chunks = []
         
@@ -130,7 +138,7 @@ class DocumentProcessor:
             chunk_index += 1
             start = end - overlap if end < len(tokens) else end
         
-        return chunks
+        return len(tokens), chunks
     
     def auto_categorize(self, text: str, filename: str) -> str:
         """Auto-categorize content based on keywords and patterns."""
@@ -173,143 +181,127 @@ class DocumentProcessor:
         return 'notes'  # Default category
 
 
+@lru_cache(maxsize=1)
+def _get_encoding():
+    return tiktoken.get_encoding("cl100k_base")
+
+
+# Token counts by SHA-1 of the text, least recently used first
+_token_counts: "OrderedDict[bytes, int]" = OrderedDict()
+TOKEN_COUNT_CACHE_SIZE = 8192
+
+
+def count_tokens_cached(text: str) -> int:
+    """
+    Token count of a text, memoized so repeated context items are encoded
+    once. Entries are keyed by a digest, so the cache holds no texts.
+    """
+    key = hashlib.sha1(text.encode("utf-8")).digest()
+    count = _token_counts.get(key)
+    if count is not None:
+        _token_counts.move_to_end(key)
+        return count
+    count = len(_get_encoding().encode(text))
+    _token_counts[key] = count
+    if len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+        _token_counts.popitem(last=False)
+    return count
+
+
 class LongContextManager:
-    """Manage long context for LLM queries."""
+    """
+    Pack prompt context into a model's token window.
+    
+    Context arrives as units: dicts with `text`, a relevance `score` and
+    optionally `truncatable` and `pinned`. Each unit's tokens are counted
+    once (and memoized across requests). Units are visited pinned first,
+    then by score per token, and every one that fits is taken whole. A
+    unit that does not fit is skipped, unless it is truncatable and at
+    least `min_truncated_tokens` are left, in which case it is cut to the
+    space left; smaller units later in the order can still fill any gap.
+    Conversation history is packed separately, newest first, within its
+    own share of the budget, and whatever it leaves unused goes to the
+    retrieved context.
+    """
     
-    def __init__(self, max_tokens: int = 32000):
+    # Chat templates add a few tokens of framing per message
+    MESSAGE_OVERHEAD_TOKENS = 4
+    
+    def __init__(self, max_tokens: int = 32000, reserved_tokens: int = 4000,
+                 min_truncated_tokens: int = 100):
         self.max_tokens = max_tokens
-        self.encoding = tiktoken.get_encoding("cl100k_base")
         # Reserve tokens for system prompt and response
-        self.reserved_tokens = 4000
+        self.reserved_tokens = reserved_tokens
+        self.min_truncated_tokens = min_truncated_tokens
     
     def count_tokens(self, text: str) -> int:
         """Count tokens in text."""
-        return len(self.encoding.encode(text))
+        return count_tokens_cached(text)
     
-    def build_context(self, 
-                      user_query: str,
-                      chapters: List[Dict[str, Any]] = None,
-                      knowledge: List[Dict[str, Any]] = None,
-                      characters: List[Dict[str, Any]] = None,
-                      events: List[Dict[str, Any]] = None,
+    def build_context(self,
+                      units: List[Dict[str, Any]],
                       conversation_history: List[Dict[str, str]] = None,
-                      priority_order: List[str] = None) -> Dict[str, Any]:
+                      history_share: float = 0.3) -> Dict[str, Any]:
         """
-        Build context within token limits, prioritizing important information.
+        Select context units and history messages that fit the budget.
         
         Args:
-            user_query: The user's question
-            chapters: Retrieved chapter content
-            knowledge: Retrieved knowledge base entries
-            characters: Character information from graph
-            events: Timeline events from graph
-            conversation_history: Recent conversation history
-            priority_order: Order of priority for context types
+            units: Context units ({text, score, truncatable, ...})
+            conversation_history: Conversation messages, oldest first
+            history_share: Max share of the budget given to history
         
         Returns:
-            Dict with optimized context and metadata
+            Dict with the selected units (input order, with `text` possibly
+            truncated), the fitted history and token usage
         """
-        available_tokens = self.max_tokens - self.reserved_tokens
-        query_tokens = self.count_tokens(user_query)
-        available_tokens -= query_tokens
+        available = max(0, self.max_tokens - self.reserved_tokens)
         
-        if priority_order is None:
-            priority_order = ['characters', 'events', 'chapters', 'knowledge', 'history']
-        
-        context = {
-            'characters': [],
-            'events': [],
-            'chapters': [],
-            'knowledge': [],
-            'history': []
-        }
-        token_usage = {
-            'query': query_tokens,
-            'characters': 0,
-            'events': 0,
-            'chapters': 0,
-            'knowledge': 0,
-            'history': 0,
-            'total': query_tokens
-        }
-        
-        # Allocate tokens based on priority
-        allocations = {
-            'characters': 0.15,  # 15% for character info
-            'events': 0.10,     # 10% for timeline
-            'chapters': 0.35,   # 35% for chapter content
-            'knowledge': 0.25,  # 25% for knowledge base
-            'history': 0.15    # 15% for conversation history
-        }
-        
-        # Process each context type in priority order
-        for ctx_type in priority_order:
-            allocation = int(available_tokens * allocations.get(ctx_type, 0.1))
-            
-            if ctx_type == 'characters' and characters:
-                context['characters'], tokens = self._fit_items(
-                    characters, allocation, key='name'
-                )
-                token_usage['characters'] = tokens
-                
-            elif ctx_type == 'events' and events:
-                context['events'], tokens = self._fit_items(
-                    events, allocation, key='title'
-                )
-                token_usage['events'] = tokens
-                
-            elif ctx_type == 'chapters' and chapters:
-                context['chapters'], tokens = self._fit_items(
-                    chapters, allocation, key='title'
-                )
-                token_usage['chapters'] = tokens
-                
-            elif ctx_type == 'knowledge' and knowledge:
-                context['knowledge'], tokens = self._fit_items(
-                    knowledge, allocation, key='title'
-                )
-                token_usage['knowledge'] = tokens
-                
-            elif ctx_type == 'history' and conversation_history:
-                context['history'], tokens = self._fit_messages(
-                    conversation_history, allocation
-                )
-                token_usage['history'] = tokens
-        
-        token_usage['total'] = sum(v for k, v in token_usage.items() if k != 'total')
+        history, history_tokens = self._fit_messages(
+            conversation_history or [], int(available * history_share)
+        )
+        selected, context_tokens, truncated = self._fit_items(units, available - history_tokens)
         
+        used = history_tokens + context_tokens
         return {
-            'context': context,
-            'token_usage': token_usage,
-            'available_for_response': self.max_tokens - token_usage['total'] - self.reserved_tokens
+            'units': selected,
+            'history': history,
+            'token_usage': {
+                'budget': available,
+                'context': context_tokens,
+                'history': history_tokens,
+                'total': used,
+                'units_selected': len(selected),
+                'units_truncated': truncated,
+                'units_dropped': len(units) - len(selected),
+                'history_messages': len(history),
+                'utilization': round(used / available, 4) if available else 0.0
+            }
         }
     
-    def _fit_items(self, items: List[Dict], max_tokens: int, 
-                   key: str = 'content') -> tuple:
-        """Fit items within token limit."""
-        fitted = []
-        total_tokens = 0
+    def _fit_items(self, units: List[Dict[str, Any]], max_tokens: int) -> tuple:
+        """Greedy knapsack over relevance per token; returns (units, tokens, truncated count)."""
+        costs = [self.count_tokens(u['text']) for u in units]
+        order = sorted(
+            range(len(units)),
+            key=lambda i: (units[i].get('pinned', False), units[i].get('score', 0.0) / max(costs[i], 1)),
+            reverse=True
+        )
         
-        for item in items:
-            item_str = str(item)
-            item_tokens = self.count_tokens(item_str)
-            
-            if total_tokens + item_tokens <= max_tokens:
-                fitted.append(item)
-                total_tokens += item_tokens
-            else:
-                # Try to fit a truncated version
-                if 'content' in item:
-                    remaining = max_tokens - total_tokens
-                    if remaining > 100:  # Only if meaningful space left
-                        truncated = self._truncate_to_tokens(
-                            item['content'], remaining - 50
-                        )
-                        fitted.append({**item, 'content': truncated + '...'})
-                        total_tokens += remaining
-                break
+        chosen: Dict[int, Dict[str, Any]] = {}
+        total_tokens = 0
+        truncated_count = 0
+        for i in order:
+            remaining = max_tokens - total_tokens
+            if costs[i] <= remaining:
+                chosen[i] = units[i]
+                total_tokens += costs[i]
+            elif units[i].get('truncatable') and remaining >= self.min_truncated_tokens:
+                truncated = self._truncate_to_tokens(units[i]['text'], remaining - 2) + '…'
+                chosen[i] = {**units[i], 'text': truncated}
+                total_tokens += self.count_tokens(truncated)
+                truncated_count += 1
         
-        return fitted, total_tokens
+        return [chosen[i] for i in sorted(chosen)], total_tokens, truncated_count
     
     def _fit_messages(self, messages: List[Dict[str, str]], 
                       max_tokens: int) -> tuple:
@@ -319,8 +311,7 @@ class LongContextManager:
         total_tokens = 0
         
         for msg in reversed(messages):
-            msg_str = f"{msg['role']}: {msg['content']}"
-            msg_tokens = self.count_tokens(msg_str)
+            msg_tokens = self.count_tokens(msg['content']) + self.MESSAGE_OVERHEAD_TOKENS
             
             if total_tokens + msg_tokens <= max_tokens:
                 fitted.insert(0, msg)
@@ -332,10 +323,11 @@ class LongContextManager:
     
     def _truncate_to_tokens(self, text: str, max_tokens: int) -> str:
         """Truncate text to fit within token limit."""
-        tokens = self.encoding.encode(text)
+        encoding = _get_encoding()
+        tokens = encoding.encode(text)
         if len(tokens) <= max_tokens:
             return text
-        return self.encoding.decode(tokens[:max_tokens])
+        return encoding.decode(tokens[:max_tokens])
 
 
 def get_document_processor() -> DocumentProcessor:
@@ -343,9 +335,9 @@ def get_document_processor() -> DocumentProcessor:
     return DocumentProcessor()
 
 
-def get_long_context_manager(max_tokens: int = 32000) -> LongContextManager:
+def get_long_context_manager(max_tokens: int = 32000, reserved_tokens: int = 4000) -> LongContextManager:
     """Get long context manager instance."""
-    return LongContextManager(max_tokens)
+    return LongContextManager(max_tokens, reserved_tokens)
 
 
 # Aliases for compatibility
@@ -377,9 +369,13 @@ class TextChunker:
     
     def chunk_text(self, text: str) -> List[Dict[str, Any]]:
         """Chunk text into smaller pieces."""
-        chunks = self.processor.chunk_text(text, self.chunk_size, self.overlap)
+        return self.tokenize_and_chunk(text)[1]
+    
+    def tokenize_and_chunk(self, text: str) -> tuple:
+        """Tokenize once, returning (total token count, chunks)."""
+        token_count, chunks = self.processor.tokenize_and_chunk(text, self.chunk_size, self.overlap)
         # Rename fields for compatibility
-        return [
+        return token_count, [
             {
                 'chunk_index': c['index'],
                 'content': c['text'],
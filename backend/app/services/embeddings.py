@@ -1,8 +1,17 @@
 """Embedding service using sentence-transformers."""
-from typing import List, Union
+import asyncio
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 from sentence_transformers import SentenceTransformer
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
 # Global model instance
 _model = None
 
@@ -15,18 +24,170 @@ def get_embedding_model() -> SentenceTransformer:
     return _model
 
 
+def _encode(texts: List[str]) -> List[List[float]]:
+    """Run the model on a batch of texts, bypassing the cache."""
+    model = get_embedding_model()
+    embeddings = model.encode(texts, convert_to_numpy=True)
+    return embeddings.tolist()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache.
+
+    Vectors are keyed by a hash of (model name, normalized text). A bounded
+    in-process LRU sits in front of a shared Redis tier where vectors are
+    stored as packed float32 bytes.
+    """
+
+    REDIS_PREFIX = "emb:"
+
+    def __init__(self, max_size: int = None, ttl: int = None):
+        self.max_size = max_size or settings.EMBEDDING_CACHE_SIZE
+        self.ttl = ttl or settings.EMBEDDING_CACHE_TTL
+        self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        # Sync callers run on executor threads, so guard the LRU
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str) -> str:
+        """Build the cache key for a text."""
+        normalized = " ".join(text.split())
+        digest = hashlib.sha256(f"{settings.EMBEDDING_MODEL}\x00{normalized}".encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def pack(vector: List[float]) -> bytes:
+        """Pack a vector as float32 bytes."""
+        return array("f", vector).tobytes()
+
+    @staticmethod
+    def unpack(data: bytes) -> List[float]:
+        """Unpack float32 bytes into a vector."""
+        vector = array("f")
+        vector.frombytes(data)
+        return vector.tolist()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """Look up a vector in the in-process tier."""
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+            return vector
+
+    def put(self, key: str, vector: List[float]):
+        """Store a vector in the in-process tier."""
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+
+    def record_misses(self, count: int):
+        """Count texts that had to be encoded."""
+        with self._lock:
+            self.misses += count
+
+    async def get_remote(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Fetch vectors from the Redis tier in one round trip."""
+        if not keys:
+            return {}
+        try:
+            from app.database.redis_client import get_binary_redis
+            values = await get_binary_redis().mget([self.REDIS_PREFIX + k for k in keys])
+        except Exception as e:
+            logger.debug(f"Embedding cache Redis lookup skipped: {e}")
+            return {}
+
+        found = {}
+        for key, value in zip(keys, values):
+            if value:
+                vector = self.unpack(value)
+                found[key] = vector
+                self.put(key, vector)
+        with self._lock:
+            self.redis_hits += len(found)
+        return found
+
+    async def put_remote(self, items: Dict[str, List[float]]):
+        """Write vectors to the Redis tier in one pipelined round trip."""
+        if not items:
+            return
+        try:
+            from app.database.redis_client import get_binary_redis
+            pipe = get_binary_redis().pipeline(transaction=False)
+            for key, vector in items.items():
+                pipe.set(self.REDIS_PREFIX + key, self.pack(vector), ex=self.ttl)
+            await pipe.execute()
+        except Exception as e:
+            logger.debug(f"Embedding cache Redis write skipped: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters."""
+        with self._lock:
+            hits = self.memory_hits + self.redis_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "memory_size": len(self._lru),
+                "memory_max_size": self.max_size
+            }
+
+
+# Cache singleton
+_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Get or create the embedding cache singleton."""
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache()
+    return _cache
+
+
 def generate_embedding(text: str) -> List[float]:
     """Generate embedding for a single text."""
-    model = get_embedding_model()
-    embedding = model.encode(text, convert_to_numpy=True)
-    return embedding.tolist()
+    return generate_embeddings([text])[0]
 
 
 def generate_embeddings(texts: List[str]) -> List[List[float]]:
-    """Generate embeddings for multiple texts."""
-    model = get_embedding_model()
-    embeddings = model.encode(texts, convert_to_numpy=True)
-    return embeddings.tolist()
+    """Generate embeddings for multiple texts, encoding only cache misses."""
+    cache = get_embedding_cache()
+    keys = [cache.key(t) for t in texts]
+    vectors: Dict[str, List[float]] = {}
+    for key in keys:
+        if key not in vectors:
+            cached = cache.get(key)
+            if cached is not None:
+                vectors[key] = cached
+
+    missing = _unique_missing(texts, keys, vectors)
+    if missing:
+        cache.record_misses(len(missing))
+        for (key, _), vector in zip(missing, _encode([t for _, t in missing])):
+            vectors[key] = vector
+            cache.put(key, vector)
+
+    return [vectors[k] for k in keys]
+
+
+def _unique_missing(texts: List[str], keys: List[str],
+                    found: Dict[str, List[float]]) -> List[Tuple[str, str]]:
+    """List (key, text) pairs not yet resolved, without duplicates."""
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    return list(missing.items())
 
 
 def compute_similarity(embedding1: List[float], embedding2: List[float]) -> float:
@@ -36,3 +197,158 @@ def compute_similarity(embedding1: List[float], embedding2: List[float]) -> floa
     vec2 = np.array(embedding2)
     return float(np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2)))
 
+
+class EmbeddingEngine:
+    """
+    Async embedding engine that keeps model inference off the event loop.
+
+    Single-text requests are queued and coalesced into micro-batches: the
+    batcher waits at most `max_wait_ms` after the first request (or until
+    `max_batch_size` texts are queued) and encodes the whole batch in one
+    call on a dedicated thread pool.
+    """
+
+    def __init__(self, max_batch_size: int = None, max_wait_ms: float = None,
+                 workers: int = None):
+        self.max_batch_size = max_batch_size or settings.EMBEDDING_BATCH_SIZE
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else settings.EMBEDDING_MAX_WAIT_MS) / 1000
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or settings.EMBEDDING_WORKERS,
+            thread_name_prefix="embedding"
+        )
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_batcher(self):
+        """Start the batching task on the running event loop if needed."""
+        loop = asyncio.get_running_loop()
+        if self._batcher is None or self._batcher.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._batcher = loop.create_task(self._run_batcher())
+
+    async def _run_batcher(self):
+        """Collect queued requests into micro-batches and encode them."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Tuple[str, asyncio.Future]] = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Drop requests whose callers have gone away
+            batch = [(t, f) for t, f in batch if not f.done()]
+            if not batch:
+                continue
+
+            try:
+                vectors = await self._resolve([t for t, _ in batch])
+                for (_, future), vector in zip(batch, vectors):
+                    if not future.done():
+                        future.set_result(vector)
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _resolve(self, texts: List[str]) -> List[List[float]]:
+        """Resolve texts through the memory and Redis tiers, encoding the rest."""
+        cache = get_embedding_cache()
+        keys = [cache.key(t) for t in texts]
+        vectors: Dict[str, List[float]] = {}
+        for key in keys:
+            if key not in vectors:
+                cached = cache.get(key)
+                if cached is not None:
+                    vectors[key] = cached
+
+        pending = _unique_missing(texts, keys, vectors)
+        vectors.update(await cache.get_remote([k for k, _ in pending]))
+
+        missing = _unique_missing(texts, keys, vectors)
+        if missing:
+            cache.record_misses(len(missing))
+            loop = asyncio.get_running_loop()
+            encoded = await loop.run_in_executor(
+                self.executor, _encode, [t for _, t in missing]
+            )
+            new_items = {}
+            for (key, _), vector in zip(missing, encoded):
+                vectors[key] = vector
+                new_items[key] = vector
+                cache.put(key, vector)
+            await cache.put_remote(new_items)
+
+        return [vectors[k] for k in keys]
+
+    async def embed(self, text: str) -> List[float]:
+        """Embed a single text, coalescing with concurrent callers."""
+        cache = get_embedding_cache()
+        cached = cache.get(cache.key(text))
+        if cached is not None:
+            return cached
+
+        self._ensure_batcher()
+        future = self._loop.create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def embed_many(self, texts: List[str], batch_size: int = None) -> List[List[float]]:
+        """Embed a list of texts in batches (default `max_batch_size`) on the pool."""
+        if not texts:
+            return []
+        batch_size = batch_size or self.max_batch_size
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), batch_size):
+            vectors.extend(await self._resolve(texts[start:start + batch_size]))
+        return vectors
+
+    async def close(self):
+        """Stop the batcher and release the worker threads."""
+        if self._batcher and not self._batcher.done():
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+        self._batcher = None
+        self.executor.shutdown(wait=False)
+
+
+# Engine singleton
+_engine: Optional[EmbeddingEngine] = None
+
+
+def get_embedding_engine() -> EmbeddingEngine:
+    """Get or create the embedding engine singleton."""
+    global _engine
+    if _engine is None:
+        _engine = EmbeddingEngine()
+    return _engine
+
+
+async def close_embedding_engine():
+    """Shut down the embedding engine."""
+    global _engine
+    if _engine is not None:
+        await _engine.close()
+        _engine = None
+
+
+async def embed(text: str) -> List[float]:
+    """Generate an embedding without blocking the event loop."""
+    return await get_embedding_engine().embed(text)
+
+
+async def embed_many(texts: List[str], batch_size: int = None) -> List[List[float]]:
+    """Generate embeddings for multiple texts without blocking the event loop."""
+    return await get_embedding_engine().embed_many(texts, batch_size)
@@ -0,0 +1,174 @@
+"""Indexed lookup of story entities mentioned in free text."""
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.services.gazetteer import get_gazetteer
+from app.services.lexical_index import CJK_CHAR, STOPWORDS, TOKEN_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# Capitalized word sequences ("Harry", "Hermione Granger") and quoted spans
+NAME_PATTERN = re.compile(r"\b[A-Z][\w'’-]*(?:\s+[A-Z][\w'’-]*)*")
+QUOTED_PATTERN = re.compile(r'"([^"]{2,60})"|“([^”]{2,60})”|「([^」]{2,60})」|『([^』]{2,60})』')
+
+MAX_NAME_WORDS = 3
+MAX_CJK_NAME_LENGTH = 6
+MAX_CJK_RUN_LENGTH = 64
+MAX_MENTIONS = 300
+
+
+def extract_mentions(query: str) -> Dict[str, List[str]]:
+    """
+    Candidate entity mentions in a query, all lowercased.
+
+    - phrases: every 1-3 word sequence and every 2-6 character CJK
+      substring, matched exactly against names and aliases
+    - names: capitalized or quoted spans, matched by trigram similarity
+      to tolerate typos and partial names
+    - terms: content words, matched against descriptions by full-text search
+    """
+    phrases: Dict[str, None] = {}
+    words: List[str] = []
+    for match in TOKEN_PATTERN.finditer(query):
+        token = match.group()
+        if CJK_CHAR.match(token):
+            run = token[:MAX_CJK_RUN_LENGTH]
+            for size in range(2, MAX_CJK_NAME_LENGTH + 1):
+                for i in range(len(run) - size + 1):
+                    phrases[run[i:i + size]] = None
+            if len(run) == 1:
+                phrases[run] = None
+            words = []
+        else:
+            words.append(token.lower())
+            for size in range(1, min(MAX_NAME_WORDS, len(words)) + 1):
+                gram = words[-size:]
+                if not all(w in STOPWORDS for w in gram):
+                    phrases[" ".join(gram)] = None
+
+    names: Dict[str, None] = {}
+    for match in NAME_PATTERN.finditer(query):
+        name = match.group().lower()
+        if name not in STOPWORDS and len(name) > 1:
+            names[name] = None
+    for match in QUOTED_PATTERN.finditer(query):
+        name = next(g for g in match.groups() if g).strip().lower()
+        names[name] = None
+        phrases[name] = None
+
+    terms = [
+        t.lower() for t in TOKEN_PATTERN.findall(query)
+        if not CJK_CHAR.match(t) and len(t) > 2 and t.lower() not in STOPWORDS
+    ]
+    return {
+        "phrases": list(phrases)[:MAX_MENTIONS],
+        "names": list(names)[:MAX_MENTIONS],
+        "terms": list(dict.fromkeys(terms))[:MAX_MENTIONS]
+    }
+
+
+class EntityLookupService:
+    """
+    Finds character profiles mentioned in a query through indexes only.
+
+    Names and aliases of approved profiles are first looked up in the
+    in-memory gazetteer, which resolves them to profile IDs. Otherwise,
+    exact name and alias matches use the lower(name) btree and aliases
+    GIN indexes, fuzzy name matches the pg_trgm GIN index, and description
+    and personality matches the tsvector GIN index. Matches are scored by
+    kind (exact > fuzzy > description) and summed per character.
+    """
+
+    async def find_characters(self, db: AsyncSession, query: str, limit: int = 5,
+                              approved_only: bool = True) -> List[Dict[str, Any]]:
+        """Character profiles mentioned in `query`, best match first."""
+        params: Dict[str, Any] = {"limit": limit}
+        parts = []
+        profile_ids = (await get_gazetteer().detect(query))["profile_ids"] if approved_only else []
+        if profile_ids:
+            # Gazetteer hits are exact; rank by order of first mention
+            parts.append("""
+                SELECT id, 10.0 - array_position(CAST(:ids AS integer[]), id) * 0.01 AS score
+                FROM character_profiles WHERE id = ANY(CAST(:ids AS integer[]))
+            """)
+            params["ids"] = profile_ids
+            mentions = {"phrases": [], "names": [], "terms": []}
+        else:
+            mentions = extract_mentions(query)
+        if mentions["phrases"]:
+            parts.append("""
+                SELECT id, 3.0 AS score FROM character_profiles
+                WHERE lower(name) = ANY(CAST(:phrases AS text[]))
+                   OR lower_aliases(aliases) && CAST(:phrases AS text[])
+            """)
+            params["phrases"] = mentions["phrases"]
+        if mentions["names"]:
+            parts.append("""
+                SELECT cp.id, 2.0 * similarity(lower(cp.name), m.name) AS score
+                FROM unnest(CAST(:names AS text[])) AS m(name)
+                JOIN character_profiles cp ON lower(cp.name) % m.name
+            """)
+            params["names"] = mentions["names"]
+        if mentions["terms"]:
+            parts.append("""
+                SELECT id, ts_rank(profile_tsvector(description, personality), q) AS score
+                FROM character_profiles, to_tsquery('simple', :terms) AS q
+                WHERE profile_tsvector(description, personality) @@ q
+            """)
+            params["terms"] = " | ".join(mentions["terms"])
+        if not parts:
+            return []
+
+        approved = (
+            "AND (cp.verification_status = 'approved' OR cp.verification_status IS NULL)"
+            if approved_only else ""
+        )
+        result = await db.execute(
+            text(f"""
+                WITH matches AS ({" UNION ALL ".join(parts)})
+                SELECT cp.id, cp.name, cp.aliases, cp.description, cp.personality, cp.appearance,
+                       cp.background, cp.goals, cp.relationships_summary,
+                       cp.first_appearance_book, cp.first_appearance_chapter,
+                       SUM(m.score) AS score
+                FROM matches m
+                JOIN character_profiles cp ON cp.id = m.id
+                WHERE TRUE {approved}
+                GROUP BY cp.id
+                ORDER BY score DESC, cp.name
+                LIMIT :limit
+            """),
+            params
+        )
+        return [
+            {
+                "id": row.id,
+                "name": row.name,
+                "aliases": row.aliases or [],
+                "description": row.description,
+                "personality": row.personality,
+                "appearance": row.appearance,
+                "background": row.background,
+                "goals": row.goals,
+                "relationships_summary": row.relationships_summary,
+                "first_appearance_book": row.first_appearance_book,
+                "first_appearance_chapter": row.first_appearance_chapter,
+                "score": float(row.score)
+            }
+            for row in result.fetchall()
+        ]
+
+
+# Service singleton
+_entity_lookup_service: Optional[EntityLookupService] = None
+
+
+def get_entity_lookup_service() -> EntityLookupService:
+    """Get or create the entity lookup service singleton."""
+    global _entity_lookup_service
+    if _entity_lookup_service is None:
+        _entity_lookup_service = EntityLookupService()
+    return _entity_lookup_service
@@ -0,0 +1,254 @@
+"""In-memory gazetteer of character and location names."""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database.postgres import AsyncSessionLocal
+from app.services.lexical_index import CJK_CHAR
+
+logger = logging.getLogger(__name__)
+
+MIN_SURFACE_LENGTH = 2
+
+
+class AhoCorasick:
+    """Multi-pattern matcher; finds every occurrence of every pattern in one pass."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = list(patterns)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[int]] = [[]]
+
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(index)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find(self, content: str) -> Iterator[Tuple[int, int, int]]:
+        """Yield (start, end, pattern index) for every match."""
+        state = 0
+        for position, char in enumerate(content):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for index in self.output[state]:
+                yield position + 1 - len(self.patterns[index]), position + 1, index
+
+
+def _is_word_char(char: str) -> bool:
+    """Letters and digits of space-delimited scripts, where names need word boundaries."""
+    return char.isalnum() and not CJK_CHAR.match(char)
+
+
+class EntityGazetteer:
+    """
+    Character and location names compiled into an Aho-Corasick automaton.
+
+    Names come from approved character profiles (with their aliases) and
+    from Character and Location nodes in Neo4j. Entries are keyed by
+    their source ("profile:12", "character:Harry", "location:Hogwarts")
+    and updated in place when profiles are verified or graph nodes are
+    created; the automaton is recompiled lazily on the next lookup. A
+    full reload every GAZETTEER_REFRESH_INTERVAL seconds picks up changes
+    made by other processes.
+    """
+
+    def __init__(self):
+        self.refresh_interval = settings.GAZETTEER_REFRESH_INTERVAL
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._automaton: Optional[AhoCorasick] = None
+        self._targets: List[List[Dict[str, Any]]] = []
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _entry(entity_type: str, name: str, surfaces: Iterable[str] = (),
+               profile_id: int = None) -> Dict[str, Any]:
+        forms = {s.strip().lower() for s in [name, *surfaces] if s and s.strip()}
+        return {
+            "type": entity_type,
+            "name": name,
+            "profile_id": profile_id,
+            "surfaces": {s for s in forms if len(s) >= MIN_SURFACE_LENGTH or CJK_CHAR.match(s)}
+        }
+
+    def _set(self, key: str, entry: Dict[str, Any]):
+        self._entries[key] = entry
+        self._automaton = None
+
+    def _discard(self, key: str):
+        if self._entries.pop(key, None) is not None:
+            self._automaton = None
+
+    def add_graph_entity(self, entity_type: str, name: str):
+        """Add a Character or Location node name ('character' or 'location')."""
+        if name and self._loaded_at is not None:
+            self._set(f"{entity_type}:{name}", self._entry(entity_type, name))
+
+    async def refresh_profiles(self, profile_ids: List[int]):
+        """Re-read the given character profiles; approved ones are added, others removed."""
+        if not profile_ids or self._loaded_at is None:
+            return
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text("""
+                    SELECT id, name, aliases FROM character_profiles
+                    WHERE id = ANY(:ids)
+                      AND (verification_status = 'approved' OR verification_status IS NULL)
+                """),
+                {"ids": list(profile_ids)}
+            )
+            approved = {row.id: row for row in result.fetchall()}
+        for profile_id in profile_ids:
+            row = approved.get(profile_id)
+            if row:
+                self._set(f"profile:{row.id}", self._entry("character", row.name, row.aliases or [], row.id))
+            else:
+                self._discard(f"profile:{profile_id}")
+
+    async def reload(self):
+        """Rebuild all entries from PostgreSQL and Neo4j, then swap them in."""
+        entries: Dict[str, Dict[str, Any]] = {}
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text("""
+                    SELECT id, name, aliases FROM character_profiles
+                    WHERE verification_status = 'approved' OR verification_status IS NULL
+                """)
+            )
+            for row in result.fetchall():
+                entries[f"profile:{row.id}"] = self._entry("character", row.name, row.aliases or [], row.id)
+
+        try:
+            from app.database.neo4j_client import get_neo4j
+            async with get_neo4j().session() as session:
+                result = await session.run("""
+                    MATCH (n) WHERE n:Character OR n:Location
+                    RETURN n.name AS name, CASE WHEN n:Character THEN 'character' ELSE 'location' END AS type
+                """)
+                async for record in result:
+                    if record["name"]:
+                        entries[f"{record['type']}:{record['name']}"] = self._entry(record["type"], record["name"])
+        except Exception as e:
+            logger.warning(f"Gazetteer loaded without graph names: {e}")
+
+        self._entries = entries
+        self._automaton = None
+        self._loaded_at = time.monotonic()
+        logger.info(f"Gazetteer loaded {len(entries)} entities")
+
+    async def ensure_loaded(self):
+        """
+        Load on first use and reload once the refresh interval has passed.
+        If a reload fails, the previous entries stay in use until the next
+        interval.
+        """
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_interval:
+            return
+        async with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_interval:
+                return
+            try:
+                await self.reload()
+            except Exception as e:
+                if self._loaded_at is None:
+                    raise
+                self._loaded_at = time.monotonic()
+                logger.warning(f"Gazetteer reload failed; keeping {len(self._entries)} entities: {e}")
+
+    def _compile(self) -> AhoCorasick:
+        targets: Dict[str, List[Dict[str, Any]]] = {}
+        for entry in self._entries.values():
+            for surface in entry["surfaces"]:
+                targets.setdefault(surface, []).append(entry)
+        self._automaton = AhoCorasick(targets)
+        self._targets = [targets[p] for p in self._automaton.patterns]
+        return self._automaton
+
+    def match(self, content: str) -> List[Tuple[int, int, List[Dict[str, Any]]]]:
+        """
+        Non-overlapping mentions in `content`, as (start, end, entries).
+
+        Matching is case-insensitive; longer mentions win over the shorter
+        ones they contain, and names in space-delimited scripts must sit on
+        word boundaries ("Ron" does not match in "Ronald").
+        """
+        automaton = self._automaton or self._compile()
+        lowered = content.lower()
+        found = []
+        for start, end, index in automaton.find(lowered):
+            pattern = automaton.patterns[index]
+            if _is_word_char(pattern[0]) and start > 0 and _is_word_char(lowered[start - 1]):
+                continue
+            if _is_word_char(pattern[-1]) and end < len(lowered) and _is_word_char(lowered[end]):
+                continue
+            found.append((start, end, index))
+
+        found.sort(key=lambda m: (m[0], m[0] - m[1]))
+        mentions = []
+        covered = 0
+        for start, end, index in found:
+            if start >= covered:
+                mentions.append((start, end, self._targets[index]))
+                covered = end
+        return mentions
+
+    async def detect(self, content: str) -> Dict[str, List[Any]]:
+        """
+        Characters and locations mentioned in `content`, in order of first
+        mention, plus the matched character profile IDs.
+        """
+        await self.ensure_loaded()
+        detected: Dict[str, Dict[Any, None]] = {"characters": {}, "locations": {}, "profile_ids": {}}
+        for _, _, entries in self.match(content):
+            for entry in entries:
+                detected["characters" if entry["type"] == "character" else "locations"][entry["name"]] = None
+                if entry["profile_id"] is not None:
+                    detected["profile_ids"][entry["profile_id"]] = None
+        return {kind: list(values) for kind, values in detected.items()}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Entity and pattern counts."""
+        return {
+            "entities": len(self._entries),
+            "patterns": len(self._automaton.patterns) if self._automaton else None,
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None
+        }
+
+
+# Gazetteer singleton
+_gazetteer: Optional[EntityGazetteer] = None
+
+
+def get_gazetteer() -> EntityGazetteer:
+    """Get or create the gazetteer singleton."""
+    global _gazetteer
+    if _gazetteer is None:
+        _gazetteer = EntityGazetteer()
+    return _gazetteer
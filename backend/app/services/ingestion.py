@@ -0,0 +1,147 @@
+"""Bulk ingestion of document chunks into PostgreSQL and Qdrant."""
+import json
+import logging
+import uuid
+from typing import List, Dict, Any
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database.qdrant_client import get_vector_manager
+from app.services.embeddings import embed_many
+from app.services.lexical_index import get_lexical_index
+
+logger = logging.getLogger(__name__)
+
+# Namespace for deterministic chunk point IDs
+CHUNK_NAMESPACE = uuid.UUID("6f1c2a3e-8b4d-4e2f-9a7c-5d3e1b0f4a21")
+
+
+def chunk_point_id(source: str, doc_id: int, chunk_index: int) -> str:
+    """Stable Qdrant point ID for a document chunk."""
+    return str(uuid.uuid5(CHUNK_NAMESPACE, f"{source}:{doc_id}:{chunk_index}"))
+
+
+class IngestionService:
+    """Embed chunks in batches and write them with bulk statements."""
+
+    def __init__(self):
+        self.embed_batch_size = settings.INGEST_EMBED_BATCH_SIZE
+        self.db_batch_size = settings.INGEST_DB_BATCH_SIZE
+        self.qdrant_batch_size = settings.INGEST_QDRANT_BATCH_SIZE
+
+    async def embed_chunks(self, texts: List[str]) -> List[List[float]]:
+        """Embed all chunk texts in tuned batches."""
+        return await embed_many(texts, batch_size=self.embed_batch_size)
+
+    def upsert_points(self, collection: str, points: List[Dict[str, Any]]):
+        """Push points to Qdrant in paged upserts."""
+        if points:
+            get_vector_manager().upsert_vectors(
+                collection=collection,
+                points=points,
+                batch_size=self.qdrant_batch_size
+            )
+
+    async def index_knowledge_chunks(self, doc_id: int, title: str, category: str,
+                                     chunks: List[Dict[str, Any]]) -> int:
+        """Embed knowledge-base document chunks and index them in Qdrant and the lexical index."""
+        embeddings = await self.embed_chunks([c['text'] for c in chunks])
+        points = [
+            {
+                "id": chunk_point_id("knowledge", doc_id, chunk['index']),
+                "vector": embedding,
+                "payload": {
+                    "doc_id": doc_id,
+                    "chunk_index": chunk['index'],
+                    "content": chunk['text'],
+                    "title": title,
+                    "category": category,
+                    "token_count": chunk['token_count']
+                }
+            }
+            for chunk, embedding in zip(chunks, embeddings)
+        ]
+        self.upsert_points("knowledge", points)
+        await get_lexical_index().index_knowledge(
+            doc_id, title, "", category=category, source_type=category, chunks=chunks
+        )
+        return len(points)
+
+    async def store_document_chunks(self, db: AsyncSession, document_id: int,
+                                    chunks: List[Dict[str, Any]],
+                                    filename: str, category: str, language: str) -> int:
+        """
+        Embed document chunks, write them to `document_chunks` with multi-row
+        inserts, and index them in Qdrant and the lexical index.
+        """
+        embeddings = await self.embed_chunks([c["content"] for c in chunks])
+        metadata = json.dumps({"category": category, "language": language})
+        chunk_ids: Dict[int, int] = {}
+
+        for start in range(0, len(chunks), self.db_batch_size):
+            page = chunks[start:start + self.db_batch_size]
+            page_embeddings = embeddings[start:start + self.db_batch_size]
+            result = await db.execute(
+                text("""
+                    INSERT INTO document_chunks (document_id, chunk_index, content, token_count, embedding, metadata)
+                    SELECT :doc_id, c.chunk_index, c.content, c.token_count,
+                           CAST(c.embedding AS vector), CAST(:metadata AS jsonb)
+                    FROM unnest(
+                        CAST(:chunk_indexes AS integer[]),
+                        CAST(:contents AS text[]),
+                        CAST(:token_counts AS integer[]),
+                        CAST(:embeddings AS text[])
+                    ) AS c(chunk_index, content, token_count, embedding)
+                    RETURNING id, chunk_index
+                """),
+                {
+                    "doc_id": document_id,
+                    "metadata": metadata,
+                    "chunk_indexes": [c["chunk_index"] for c in page],
+                    "contents": [c["content"] for c in page],
+                    "token_counts": [c["token_count"] for c in page],
+                    "embeddings": [str(e) for e in page_embeddings]
+                }
+            )
+            chunk_ids.update({row.chunk_index: row.id for row in result.fetchall()})
+
+        await db.commit()
+
+        points = [
+            {
+                "id": chunk_point_id("document", document_id, chunk["chunk_index"]),
+                "vector": embedding,
+                "payload": {
+                    "document_id": document_id,
+                    "chunk_id": chunk_ids.get(chunk["chunk_index"]),
+                    "chunk_index": chunk["chunk_index"],
+                    "content": chunk["content"][:500],
+                    "category": category,
+                    "language": language,
+                    "filename": filename
+                }
+            }
+            for chunk, embedding in zip(chunks, embeddings)
+        ]
+        try:
+            self.upsert_points("knowledge", points)
+        except Exception as e:
+            logger.error(f"Qdrant error: {e}")
+
+        await get_lexical_index().index_document_chunks(
+            document_id,
+            [
+                {"chunk_id": chunk_ids.get(c["chunk_index"]), "chunk_index": c["chunk_index"], "content": c["content"]}
+                for c in chunks
+            ],
+            filename=filename,
+            category=category
+        )
+        return len(chunks)
+
+
+def get_ingestion_service() -> IngestionService:
+    """Get ingestion service instance."""
+    return IngestionService()
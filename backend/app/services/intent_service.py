@@ -1,12 +1,17 @@
 """Intent Detection Service using Ollama Qwen3 for intelligent function routing."""
 import json
 import logging
-from typing import Dict, Any, List, Optional, Callable, Awaitable
+import re
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
+import numpy as np
+
 from app.config import settings
+from app.services.embeddings import embed, embed_many
 from app.services.llm_service import OllamaProvider
+from app.services.llm_scheduler import Priority, get_llm_scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +52,73 @@ class IntentType(str, Enum):
     UNKNOWN = "unknown"
 
 
+# Intent descriptions and trigger phrases, shared by the keyword pre-filter,
+# the embedding classifier and the LLM prompt. "X" stands for any name.
+INTENT_DEFINITIONS: List[Tuple[IntentType, str, List[str]]] = [
+    (IntentType.CHAT, "General conversation, questions, or discussion about the story", []),
+    (IntentType.WRITE_CHAPTER, "User wants to write a new chapter",
+     ["write chapter", "new chapter", "create chapter"]),
+    (IntentType.WRITE_SCENE, "User wants to write a specific scene",
+     ["write scene", "scene where", "write a scene"]),
+    (IntentType.CONTINUE_STORY, "User wants to continue the story from where it left off",
+     ["continue", "what happens next", "keep writing"]),
+    (IntentType.WRITE_DIALOGUE, "User wants dialogue written",
+     ["dialogue between", "conversation between", "what would X say"]),
+    (IntentType.CREATE_CHARACTER, "User wants to create a new character",
+     ["create character", "new character", "add character"]),
+    (IntentType.UPDATE_CHARACTER, "User wants to modify an existing character",
+     ["update character", "change character", "modify character"]),
+    (IntentType.CREATE_WORLD_RULE, "User wants to add a world-building rule",
+     ["world rule", "add rule", "establish rule", "world setting"]),
+    (IntentType.CREATE_FORESHADOWING, "User wants to plant foreshadowing",
+     ["foreshadow", "hint at", "plant seed", "setup for later"]),
+    (IntentType.ANALYZE_CONSISTENCY, "User wants to check for plot holes or inconsistencies",
+     ["check consistency", "plot holes", "inconsistencies"]),
+    (IntentType.QUERY_CHARACTER, "User is asking about a character's traits, history, or behavior",
+     ["who is", "what does X think", "X's personality"]),
+    (IntentType.QUERY_PLOT, "User is asking about plot structure or story arc",
+     ["what's the plot", "story structure", "what happens in"]),
+    (IntentType.QUERY_TIMELINE, "User is asking about events or timeline",
+     ["when did", "timeline", "order of events"]),
+    (IntentType.ANALYZE_FORESHADOWING, "User wants to analyze foreshadowing payoffs",
+     ["foreshadowing status", "payoff", "unresolved hints"]),
+    (IntentType.SAVE_TO_KNOWLEDGE, "User wants to save something to knowledge base",
+     ["save this", "remember this", "add to knowledge"]),
+    (IntentType.SEARCH_KNOWLEDGE, "User wants to search the knowledge base",
+     ["search for", "find", "look up"]),
+    (IntentType.SUMMARIZE, "User wants content summarized",
+     ["summarize", "summary of", "brief overview"]),
+    (IntentType.EXTRACT_ELEMENTS, "User wants to extract story elements from text",
+     ["extract", "identify elements", "find characters/rules/etc"]),
+]
+
+# Extra examples so ordinary discussion has a centroid to land on
+CHAT_EXAMPLES = [
+    "What do you think about this idea?",
+    "How can I make this part more exciting?",
+    "Help me brainstorm some ideas for the story",
+    "Why did the protagonist make that choice?",
+    "Is this a good direction for the story?",
+]
+
+# Intents whose handlers need parameters that only the LLM extracts
+PARAMETER_INTENTS = {
+    IntentType.CREATE_CHARACTER,
+    IntentType.UPDATE_CHARACTER,
+    IntentType.CREATE_WORLD_RULE,
+    IntentType.CREATE_FORESHADOWING,
+    IntentType.SAVE_TO_KNOWLEDGE,
+}
+
+
+def _trigger_pattern(phrase: str) -> re.Pattern:
+    """Compile a trigger phrase; one-word triggers only match at the start."""
+    pattern = r"\S+".join(re.escape(part.lower()) for part in phrase.split("X"))
+    if " " not in phrase:
+        return re.compile(rf"^\W*{pattern}\b")
+    return re.compile(rf"\b{pattern}\b")
+
+
 @dataclass
 class DetectedIntent:
     """Result of intent detection."""
@@ -55,6 +127,7 @@ class DetectedIntent:
     parameters: Dict[str, Any]
     original_message: str
     explanation: str
+    source: str = "llm"  # Which tier decided: keyword, classifier or llm
 
 
 @dataclass  
@@ -72,6 +145,14 @@ class IntentService:
     def __init__(self):
         self.llm = OllamaProvider(model=settings.OLLAMA_INTENT_MODEL)
         self.function_handlers: Dict[IntentType, Callable[[DetectedIntent], Awaitable[FunctionResult]]] = {}
+        self.triggers: List[Tuple[IntentType, str, re.Pattern]] = [
+            (intent, phrase, _trigger_pattern(phrase))
+            for intent, _, phrases in INTENT_DEFINITIONS
+            for phrase in phrases
+        ]
+        self._centroid_intents: List[IntentType] = []
+        self._centroids: Optional[np.ndarray] = None
+        self.stats = {"keyword": 0, "classifier": 0, "llm": 0}
         self._register_default_handlers()
     
     def register_handler(
@@ -91,17 +172,102 @@ class IntentService:
     async def detect_intent(self, message: str, context: Dict[str, Any] = None) -> DetectedIntent:
         """
         Detect the user's intent from their message.
-        Uses Ollama Qwen3 for intelligent intent classification.
+        
+        Tiered: a keyword pre-filter over the trigger phrases, then a
+        nearest-centroid classifier over message embeddings. Ollama Qwen3
+        is only consulted when neither tier is confident, or when the
+        intent needs parameters extracted for its handler.
         """
+        if settings.INTENT_FAST_PATH_ENABLED:
+            detected = self._match_keywords(message)
+            if detected is None:
+                try:
+                    detected = await self._classify(message)
+                except Exception as e:
+                    logger.warning(f"Intent classifier unavailable: {e}")
+            if detected is not None and detected.intent not in PARAMETER_INTENTS:
+                self.stats[detected.source] += 1
+                return detected
+        
+        self.stats["llm"] += 1
+        return await self._detect_with_llm(message, context)
+    
+    def _match_keywords(self, message: str) -> Optional[DetectedIntent]:
+        """Match trigger phrases; only an unambiguous hit is returned."""
+        lowered = message.lower()
+        matches = {}
+        for intent, phrase, pattern in self.triggers:
+            if pattern.search(lowered):
+                matches.setdefault(intent, phrase)
+        if len(matches) != 1:
+            return None
+        
+        intent, phrase = next(iter(matches.items()))
+        return DetectedIntent(
+            intent=intent,
+            confidence=settings.INTENT_KEYWORD_CONFIDENCE,
+            parameters={},
+            original_message=message,
+            explanation=f"Matched trigger phrase '{phrase}'",
+            source="keyword"
+        )
+    
+    async def _ensure_centroids(self):
+        """Embed the intent examples once and average them per intent."""
+        if self._centroids is not None:
+            return
+        
+        intents, texts = [], []
+        for intent, description, phrases in INTENT_DEFINITIONS:
+            examples = [description] + [p.replace("X", "someone") for p in phrases]
+            if intent == IntentType.CHAT:
+                examples += CHAT_EXAMPLES
+            intents.extend([intent] * len(examples))
+            texts.extend(examples)
+        
+        vectors = np.array(await embed_many(texts))
+        centroid_intents = [intent for intent, _, _ in INTENT_DEFINITIONS]
+        centroids = np.stack([
+            vectors[[i for i, it in enumerate(intents) if it == intent]].mean(axis=0)
+            for intent in centroid_intents
+        ])
+        self._centroids = centroids / np.linalg.norm(centroids, axis=1, keepdims=True)
+        self._centroid_intents = centroid_intents
+    
+    async def _classify(self, message: str) -> Optional[DetectedIntent]:
+        """Nearest-centroid classification; None when not confident enough."""
+        await self._ensure_centroids()
+        
+        vector = np.array(await embed(message))
+        scores = self._centroids @ (vector / np.linalg.norm(vector))
+        ranked = np.argsort(scores)[::-1]
+        best, runner_up = float(scores[ranked[0]]), float(scores[ranked[1]])
+        
+        if best < settings.INTENT_CLASSIFIER_THRESHOLD or best - runner_up < settings.INTENT_CLASSIFIER_MARGIN:
+            return None
+        
+        intent = self._centroid_intents[ranked[0]]
+        return DetectedIntent(
+            intent=intent,
+            confidence=round(best, 3),
+            parameters={},
+            original_message=message,
+            explanation=f"Nearest intent centroid (similarity {best:.2f}, margin {best - runner_up:.2f})",
+            source="classifier"
+        )
+    
+    async def _detect_with_llm(self, message: str, context: Dict[str, Any] = None) -> DetectedIntent:
+        """Classify the message and extract parameters with Ollama Qwen3."""
         # Build the intent detection prompt
         prompt = self._build_intent_prompt(message, context)
         
         try:
-            response = await self.llm.generate(
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1,  # Low temperature for consistent classification
-                max_tokens=1024
-            )
+            async with get_llm_scheduler().slot("ollama", Priority.INTENT):
+                response = await self.llm.generate(
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.1,  # Low temperature for consistent classification
+                    max_tokens=1024
+                )
             
             # Parse the response
             return self._parse_intent_response(response, message)
@@ -117,31 +283,24 @@ class IntentService:
                 explanation="Intent detection failed, defaulting to chat"
             )
     
+    def get_stats(self) -> Dict[str, Any]:
+        """Get how many messages each tier decided."""
+        total = sum(self.stats.values())
+        return {
+            **self.stats,
+            "fast_path_rate": round((total - self.stats["llm"]) / total, 4) if total else 0.0
+        }
+    
     def _build_intent_prompt(self, message: str, context: Dict[str, Any] = None) -> str:
         """Build the prompt for intent detection."""
         
-        intent_descriptions = """
-AVAILABLE INTENTS:
-
-1. chat - General conversation, questions, or discussion about the story
-2. write_chapter - User wants to write a new chapter (keywords: "write chapter", "new chapter", "create chapter")
-3. write_scene - User wants to write a specific scene (keywords: "write scene", "scene where", "write a scene")
-4. continue_story - User wants to continue the story from where it left off (keywords: "continue", "what happens next", "keep writing")
-5. write_dialogue - User wants dialogue written (keywords: "dialogue between", "conversation between", "what would X say")
-6. create_character - User wants to create a new character (keywords: "create character", "new character", "add character")
-7. update_character - User wants to modify an existing character (keywords: "update character", "change character", "modify character")
-8. create_world_rule - User wants to add a world-building rule (keywords: "world rule", "add rule", "establish rule", "world setting")
-9. create_foreshadowing - User wants to plant foreshadowing (keywords: "foreshadow", "hint at", "plant seed", "setup for later")
-10. analyze_consistency - User wants to check for plot holes or inconsistencies (keywords: "check consistency", "plot holes", "inconsistencies")
-11. query_character - User is asking about a character's traits, history, or behavior (keywords: "who is", "what does X think", "X's personality")
-12. query_plot - User is asking about plot structure or story arc (keywords: "what's the plot", "story structure", "what happens in")
-13. query_timeline - User is asking about events or timeline (keywords: "when did", "timeline", "order of events")
-14. analyze_foreshadowing - User wants to analyze foreshadowing payoffs (keywords: "foreshadowing status", "payoff", "unresolved hints")
-15. save_to_knowledge - User wants to save something to knowledge base (keywords: "save this", "remember this", "add to knowledge")
-16. search_knowledge - User wants to search the knowledge base (keywords: "search for", "find", "look up")
-17. summarize - User wants content summarized (keywords: "summarize", "summary of", "brief overview")
-18. extract_elements - User wants to extract story elements from text (keywords: "extract", "identify elements", "find characters/rules/etc")
-"""
+        lines = []
+        for i, (intent, description, phrases) in enumerate(INTENT_DEFINITIONS, 1):
+            line = f"{i}. {intent.value} - {description}"
+            if phrases:
+                line += " (keywords: " + ", ".join(f'"{p}"' for p in phrases) + ")"
+            lines.append(line)
+        intent_descriptions = "\nAVAILABLE INTENTS:\n\n" + "\n".join(lines) + "\n"
 
         context_info = ""
         if context:
@@ -0,0 +1,295 @@
+"""Durable background job queue backed by PostgreSQL."""
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database.postgres import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+JOB_COLUMNS = """
+    id, job_type, provider, payload, status, attempts, max_attempts, run_after,
+    locked_by, result, error, created_at, updated_at, finished_at
+"""
+
+
+def _json_value(value: Any) -> Any:
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def _row_to_job(row) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "job_type": row.job_type,
+        "provider": row.provider,
+        "payload": _json_value(row.payload) or {},
+        "status": row.status,
+        "attempts": row.attempts,
+        "max_attempts": row.max_attempts,
+        "run_after": row.run_after.isoformat() if row.run_after else None,
+        "locked_by": row.locked_by,
+        "result": _json_value(row.result),
+        "error": row.error,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+        "finished_at": row.finished_at.isoformat() if row.finished_at else None
+    }
+
+
+class JobQueue:
+    """
+    Postgres-backed job queue.
+
+    Jobs are claimed with FOR UPDATE SKIP LOCKED so any number of worker
+    processes can share the table. Each provider has a global cap on
+    running jobs; claims for one provider are serialized with an advisory
+    lock so the cap holds across workers. Failed jobs are retried with
+    exponential backoff until `max_attempts` is reached. Jobs sharing a
+    `concurrency_key` never run at once, and a new one is not queued
+    while another is still waiting.
+    """
+
+    def __init__(self):
+        self.max_attempts = settings.JOB_MAX_ATTEMPTS
+        self.retry_backoff = settings.JOB_RETRY_BACKOFF
+        self.lock_timeout = settings.JOB_LOCK_TIMEOUT
+
+    def provider_limit(self, provider: str) -> int:
+        """Max concurrently running jobs for a provider."""
+        return settings.job_provider_concurrency.get(provider, settings.JOB_DEFAULT_CONCURRENCY)
+
+    async def enqueue(self, job_type: str, payload: Dict[str, Any],
+                      provider: str = None, max_attempts: int = None,
+                      concurrency_key: str = None) -> int:
+        """
+        Add a job to the queue and return its ID. With `concurrency_key`,
+        the ID of a job with that key still waiting to run is returned
+        instead of queuing another.
+        """
+        async with AsyncSessionLocal() as db:
+            if concurrency_key:
+                result = await db.execute(
+                    text("""
+                        SELECT id FROM background_jobs
+                        WHERE concurrency_key = :key AND status = 'queued'
+                        ORDER BY id
+                        LIMIT 1
+                    """),
+                    {"key": concurrency_key}
+                )
+                waiting = result.fetchone()
+                if waiting:
+                    logger.info(f"{job_type} job {waiting.id} already queued for {concurrency_key}")
+                    return waiting.id
+            result = await db.execute(
+                text("""
+                    INSERT INTO background_jobs (job_type, provider, payload, max_attempts, concurrency_key)
+                    VALUES (:job_type, :provider, CAST(:payload AS jsonb), :max_attempts, :key)
+                    RETURNING id
+                """),
+                {
+                    "job_type": job_type,
+                    "provider": provider or settings.DEFAULT_LLM_PROVIDER,
+                    "payload": json.dumps(payload),
+                    "max_attempts": max_attempts or self.max_attempts,
+                    "key": concurrency_key
+                }
+            )
+            await db.commit()
+            job_id = result.fetchone().id
+        logger.info(f"Queued {job_type} job {job_id}")
+        return job_id
+
+    async def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Get a job by ID."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text(f"SELECT {JOB_COLUMNS} FROM background_jobs WHERE id = :id"),
+                {"id": job_id}
+            )
+            row = result.fetchone()
+        return _row_to_job(row) if row else None
+
+    async def list_jobs(self, status: str = None, job_type: str = None,
+                        limit: int = 50) -> List[Dict[str, Any]]:
+        """List recent jobs, newest first."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text(f"""
+                    SELECT {JOB_COLUMNS} FROM background_jobs
+                    WHERE (CAST(:status AS varchar) IS NULL OR status = :status)
+                      AND (CAST(:job_type AS varchar) IS NULL OR job_type = :job_type)
+                    ORDER BY created_at DESC
+                    LIMIT :limit
+                """),
+                {"status": status, "job_type": job_type, "limit": limit}
+            )
+            rows = result.fetchall()
+        return [_row_to_job(row) for row in rows]
+
+    async def claim(self, provider: str, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Claim the next ready job for a provider, if under its running cap."""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                text("SELECT pg_advisory_xact_lock(hashtext(:key))"),
+                {"key": f"background_jobs:{provider}"}
+            )
+            result = await db.execute(
+                text(f"""
+                    UPDATE background_jobs
+                    SET status = 'running', attempts = attempts + 1,
+                        locked_by = :worker_id, locked_at = NOW(), updated_at = NOW()
+                    WHERE id = (
+                        SELECT id FROM background_jobs j
+                        WHERE provider = :provider AND status = 'queued' AND run_after <= NOW()
+                        AND (j.concurrency_key IS NULL OR NOT EXISTS (
+                            SELECT 1 FROM background_jobs r
+                            WHERE r.concurrency_key = j.concurrency_key AND r.status = 'running'
+                        ))
+                        ORDER BY id
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    AND (
+                        SELECT COUNT(*) FROM background_jobs
+                        WHERE provider = :provider AND status = 'running'
+                    ) < :limit
+                    RETURNING {JOB_COLUMNS}
+                """),
+                {"provider": provider, "worker_id": worker_id, "limit": self.provider_limit(provider)}
+            )
+            row = result.fetchone()
+            await db.commit()
+        return _row_to_job(row) if row else None
+
+    async def heartbeat(self, job_id: int, worker_id: str) -> bool:
+        """Refresh a running job's lock; False if the worker no longer holds it."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text("""
+                    UPDATE background_jobs
+                    SET locked_at = NOW(), updated_at = NOW()
+                    WHERE id = :id AND status = 'running' AND locked_by = :worker_id
+                    RETURNING id
+                """),
+                {"id": job_id, "worker_id": worker_id}
+            )
+            await db.commit()
+            return result.fetchone() is not None
+
+    async def complete(self, job_id: int, result: Any, worker_id: str) -> bool:
+        """
+        Mark a job as succeeded. Only the worker holding the job's lock can
+        complete it; returns False if the job was taken over.
+        """
+        async with AsyncSessionLocal() as db:
+            updated = await db.execute(
+                text("""
+                    UPDATE background_jobs
+                    SET status = 'succeeded', result = CAST(:result AS jsonb), error = NULL,
+                        locked_by = NULL, updated_at = NOW(), finished_at = NOW()
+                    WHERE id = :id AND locked_by = :worker_id
+                    RETURNING id
+                """),
+                {"id": job_id, "result": json.dumps(result, default=str), "worker_id": worker_id}
+            )
+            await db.commit()
+            return updated.fetchone() is not None
+
+    async def fail(self, job: Dict[str, Any], error: str, worker_id: str) -> bool:
+        """
+        Schedule a retry with backoff, or mark the job failed for good.
+        Like complete(), a no-op returning False if the job was taken over.
+        """
+        retry = job["attempts"] < job["max_attempts"]
+        delay = self.retry_backoff * (2 ** (job["attempts"] - 1))
+        async with AsyncSessionLocal() as db:
+            updated = await db.execute(
+                text("""
+                    UPDATE background_jobs
+                    SET status = :status, error = :error, locked_by = NULL, updated_at = NOW(),
+                        run_after = NOW() + make_interval(secs => :delay),
+                        finished_at = CASE WHEN :status = 'failed' THEN NOW() ELSE NULL END
+                    WHERE id = :id AND locked_by = :worker_id
+                    RETURNING id
+                """),
+                {
+                    "id": job["id"], "status": "queued" if retry else "failed", "error": error,
+                    "delay": delay, "worker_id": worker_id
+                }
+            )
+            await db.commit()
+            if updated.fetchone() is None:
+                logger.warning(f"Job {job['id']} was taken over; not recording its failure")
+                return False
+        if retry:
+            logger.warning(f"Job {job['id']} failed (attempt {job['attempts']}), retrying in {delay:.0f}s: {error}")
+        else:
+            logger.error(f"Job {job['id']} failed permanently: {error}")
+        return True
+
+    async def retry(self, job_id: int) -> bool:
+        """Re-queue a failed job with a fresh attempt budget."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text("""
+                    UPDATE background_jobs
+                    SET status = 'queued', attempts = 0, run_after = NOW(),
+                        error = NULL, finished_at = NULL, updated_at = NOW()
+                    WHERE id = :id AND status = 'failed'
+                    RETURNING id
+                """),
+                {"id": job_id}
+            )
+            await db.commit()
+            return result.fetchone() is not None
+
+    async def requeue_stale(self) -> int:
+        """Return jobs whose worker stopped heartbeating (died mid-run) to the queue."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text("""
+                    UPDATE background_jobs
+                    SET status = 'queued', locked_by = NULL, updated_at = NOW()
+                    WHERE status = 'running'
+                      AND locked_at < NOW() - make_interval(secs => :timeout)
+                    RETURNING id
+                """),
+                {"timeout": self.lock_timeout}
+            )
+            await db.commit()
+            count = len(result.fetchall())
+        if count:
+            logger.warning(f"Re-queued {count} stale job(s)")
+        return count
+
+    async def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Job counts per provider and status."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text("""
+                    SELECT provider, status, COUNT(*) AS count
+                    FROM background_jobs
+                    GROUP BY provider, status
+                """)
+            )
+            rows = result.fetchall()
+        stats: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            stats.setdefault(row.provider, {})[row.status] = row.count
+        return stats
+
+
+# Queue singleton
+_job_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """Get or create the job queue singleton."""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue()
+    return _job_queue
@@ -0,0 +1,217 @@
+"""Incremental sync of chat sessions into the knowledge base."""
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database.postgres import AsyncSessionLocal
+from app.services.document_service import get_document_processor
+from app.services.ingestion import chunk_point_id, get_ingestion_service
+from app.services.lexical_index import get_lexical_index
+
+logger = logging.getLogger(__name__)
+
+SYNC_CATEGORY = "chat-synced"
+SYNC_TAGS = ["chat-synced", "auto-updated"]
+
+
+def format_messages(messages) -> str:
+    """Render chat messages as a transcript."""
+    return "\n\n".join(
+        f"**{'User' if m.role == 'user' else 'Assistant'}**: {m.content}"
+        for m in messages
+    )
+
+
+class KnowledgeSyncService:
+    """
+    Appends new chat messages of sync-enabled sessions to the knowledge base.
+
+    Each synced session has one parent `knowledge_base` entry, created on
+    the first sync. Messages newer than `last_synced_message_id` are
+    rendered as a transcript, split into windows of
+    KNOWLEDGE_SYNC_CHUNK_TOKENS and indexed as new chunks of the parent in
+    Qdrant and the lexical index, numbered on from `synced_chunk_count`.
+    The parent row is never rewritten, so a sync costs the same whatever
+    the length of the session and does not retire semantically cached
+    answers. Syncs of one session are serialized by locking its
+    `chat_sessions` row.
+    """
+
+    def __init__(self):
+        self.chunk_tokens = settings.KNOWLEDGE_SYNC_CHUNK_TOKENS
+        self.chunk_overlap = settings.KNOWLEDGE_SYNC_CHUNK_OVERLAP
+        self.max_messages = settings.KNOWLEDGE_SYNC_MAX_MESSAGES
+
+    async def _create_entry(self, db, session_id, title: str) -> int:
+        result = await db.execute(
+            text("""
+                INSERT INTO knowledge_base (source_type, category, title, content, tags,
+                                            chat_session_id, is_synced_session, metadata)
+                VALUES ('chat', :category, :title, :content, :tags, :session_id, TRUE, :metadata)
+                RETURNING id
+            """),
+            {
+                "category": SYNC_CATEGORY,
+                "title": title,
+                "content": f"Synced chat session: {title}",
+                "tags": SYNC_TAGS,
+                "session_id": session_id,
+                "metadata": json.dumps({"source_session_id": str(session_id)})
+            }
+        )
+        return result.fetchone().id
+
+    async def _sync_batch(self, session_id) -> Optional[Dict[str, Any]]:
+        """Sync up to KNOWLEDGE_SYNC_MAX_MESSAGES new messages; None if sync is off."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text("""
+                    SELECT s.title, s.knowledge_sync_enabled, s.synced_knowledge_id,
+                           s.last_synced_message_id, s.synced_chunk_count, kb.id IS NOT NULL AS has_entry
+                    FROM chat_sessions s
+                    LEFT JOIN knowledge_base kb ON kb.id = s.synced_knowledge_id
+                    WHERE s.id = :session_id
+                    FOR UPDATE OF s
+                """),
+                {"session_id": session_id}
+            )
+            session = result.fetchone()
+            if not session or not session.knowledge_sync_enabled:
+                return None
+
+            # If the parent entry was deleted, start a new one from the first message
+            knowledge_id = session.synced_knowledge_id if session.has_entry else None
+            last_message_id = (session.last_synced_message_id or 0) if knowledge_id else 0
+            chunk_count = (session.synced_chunk_count or 0) if knowledge_id else 0
+
+            result = await db.execute(
+                text("""
+                    SELECT id, role, content FROM chat_messages
+                    WHERE session_id = :session_id AND id > :last_id
+                    ORDER BY id
+                    LIMIT :limit
+                """),
+                {"session_id": session_id, "last_id": last_message_id, "limit": self.max_messages}
+            )
+            messages = result.fetchall()
+            if not messages:
+                return {"knowledge_id": knowledge_id, "messages": 0, "chunks": 0}
+
+            title = session.title or "Synced Chat"
+            if knowledge_id is None:
+                knowledge_id = await self._create_entry(db, session_id, title)
+
+            chunks = get_document_processor().chunk_text(
+                format_messages(messages), self.chunk_tokens, self.chunk_overlap
+            )
+            for chunk in chunks:
+                chunk["index"] += chunk_count
+
+            ingestion = get_ingestion_service()
+            embeddings = await ingestion.embed_chunks([c["text"] for c in chunks])
+            ingestion.upsert_points("knowledge", [
+                {
+                    "id": chunk_point_id("knowledge", knowledge_id, chunk["index"]),
+                    "vector": embedding,
+                    "payload": {
+                        "id": knowledge_id,
+                        "doc_id": knowledge_id,
+                        "chunk_index": chunk["index"],
+                        "content": chunk["text"],
+                        "title": title,
+                        "category": SYNC_CATEGORY,
+                        "source_type": "chat",
+                        "tags": SYNC_TAGS,
+                        "token_count": chunk["token_count"]
+                    }
+                }
+                for chunk, embedding in zip(chunks, embeddings)
+            ])
+            await get_lexical_index().index_knowledge(
+                knowledge_id, title, "", category=SYNC_CATEGORY, source_type="chat",
+                chunks=chunks, replace=False
+            )
+
+            await db.execute(
+                text("""
+                    UPDATE chat_sessions
+                    SET synced_knowledge_id = :knowledge_id,
+                        last_synced_message_id = :last_id,
+                        synced_chunk_count = :chunk_count
+                    WHERE id = :session_id
+                """),
+                {
+                    "knowledge_id": knowledge_id,
+                    "last_id": messages[-1].id,
+                    "chunk_count": chunk_count + len(chunks),
+                    "session_id": session_id
+                }
+            )
+            await db.commit()
+        return {"knowledge_id": knowledge_id, "messages": len(messages), "chunks": len(chunks)}
+
+    async def sync_session(self, session_id) -> Optional[Dict[str, Any]]:
+        """
+        Sync all unsynced messages of a session. Returns the knowledge ID
+        and the number of messages and chunks added, or None if sync is
+        not enabled for the session.
+        """
+        total = None
+        while True:
+            synced = await self._sync_batch(session_id)
+            if synced is None:
+                return total
+            if total is None:
+                total = synced
+            else:
+                total = {
+                    "knowledge_id": synced["knowledge_id"],
+                    "messages": total["messages"] + synced["messages"],
+                    "chunks": total["chunks"] + synced["chunks"]
+                }
+            if synced["messages"] < self.max_messages:
+                break
+        if total["messages"]:
+            logger.info(
+                f"Synced {total['messages']} messages of session {session_id} "
+                f"to knowledge {total['knowledge_id']} ({total['chunks']} chunks)"
+            )
+        return total
+
+    async def sync_sessions(self, session_ids: List[str]):
+        """Sync those of the given sessions that have sync enabled; errors are logged."""
+        if not session_ids:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    text("""
+                        SELECT id FROM chat_sessions
+                        WHERE id = ANY(CAST(:ids AS uuid[])) AND knowledge_sync_enabled
+                    """),
+                    {"ids": [str(s) for s in session_ids]}
+                )
+                enabled = [row.id for row in result.fetchall()]
+        except Exception as e:
+            logger.error(f"Knowledge sync lookup failed: {e}")
+            return
+        for session_id in enabled:
+            try:
+                await self.sync_session(session_id)
+            except Exception as e:
+                logger.error(f"Knowledge sync failed for session {session_id}: {e}")
+
+
+# Service singleton
+_knowledge_sync_service: Optional[KnowledgeSyncService] = None
+
+
+def get_knowledge_sync_service() -> KnowledgeSyncService:
+    """Get or create the knowledge sync service singleton."""
+    global _knowledge_sync_service
+    if _knowledge_sync_service is None:
+        _knowledge_sync_service = KnowledgeSyncService()
+    return _knowledge_sync_service
@@ -0,0 +1,342 @@
+"""BM25 lexical index over chapters, knowledge and document chunks."""
+import json
+import logging
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database.postgres import AsyncSessionLocal
+from app.services.document_service import get_document_processor
+
+logger = logging.getLogger(__name__)
+
+# Han, kana and hangul; runs of these are indexed as overlapping bigrams
+CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+CJK_CHAR = re.compile(f"[{CJK_RANGES}]")
+TOKEN_PATTERN = re.compile(f"[{CJK_RANGES}]+|[^\\W_{CJK_RANGES}]+")
+
+MAX_TERM_LENGTH = 100
+
+# English function words carry no lexical signal and would match every document
+STOPWORDS = frozenset("""
+    an and are as at be but by do does did for from had has have he her his how i if in into is it its
+    me my no not of on or our she so that the their them then there they this to was we were what when
+    where which who why will with you your
+""".split())
+
+# Knowledge entries are indexed in chunks of this many tokens
+KNOWLEDGE_CHUNK_TOKENS = 1000
+KNOWLEDGE_CHUNK_OVERLAP = 200
+
+
+def tokenize(content: str) -> List[str]:
+    """
+    Split text into index terms.
+
+    Latin, Cyrillic and other alphabetic words are lowercased whole
+    (single letters and English stopwords are dropped). CJK runs become
+    overlapping character bigrams, so zh-TW/zh-CN names and terms match
+    without a segmenter.
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(content):
+        token = match.group()
+        if CJK_CHAR.match(token):
+            if len(token) == 1:
+                terms.append(token)
+            else:
+                terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+        elif len(token) > 1 or token.isdigit():
+            token = token.lower()[:MAX_TERM_LENGTH]
+            if token not in STOPWORDS:
+                terms.append(token)
+    return terms
+
+
+# Removes the documents matched by {where} and subtracts them from lexical_stats
+DELETE_SQL = """
+    WITH removed AS (
+        DELETE FROM lexical_documents WHERE {where} RETURNING source, length
+    )
+    INSERT INTO lexical_stats (source, doc_count, total_length)
+    SELECT source, -COUNT(*), -SUM(length) FROM removed GROUP BY source
+    ON CONFLICT (source) DO UPDATE
+    SET doc_count = lexical_stats.doc_count + EXCLUDED.doc_count,
+        total_length = lexical_stats.total_length + EXCLUDED.total_length
+"""
+
+
+class LexicalIndex:
+    """
+    Inverted index persisted in PostgreSQL and scored with BM25.
+
+    Each indexed unit (a chapter block, a knowledge chunk, a document
+    chunk) is a row in `lexical_documents` with its term postings in
+    `lexical_postings`. Documents are keyed like "chapter:12:3" so all
+    units of one source record can be replaced or deleted by key prefix.
+    Tokenization happens in-process; scoring runs in a single SQL query
+    over the postings of the query terms. The document count and total
+    length used for BM25 are kept per source in `lexical_stats`, updated
+    with every insert and delete, so a search reads only postings.
+    """
+
+    def __init__(self):
+        self.k1 = settings.LEXICAL_BM25_K1
+        self.b = settings.LEXICAL_BM25_B
+
+    async def index_documents(self, documents: List[Dict[str, Any]], replace_prefix: str = None):
+        """
+        Add or replace documents.
+
+        Each document is {key, source, content, payload}. With
+        `replace_prefix`, every existing document whose key starts with it
+        is removed first, so stale units of a re-saved record disappear.
+        """
+        keys, sources, lengths, payloads = [], [], [], []
+        post_terms, post_keys, post_tfs = [], [], []
+        for doc in documents:
+            counts = Counter(tokenize(doc["content"]))
+            keys.append(doc["key"])
+            sources.append(doc["source"])
+            lengths.append(sum(counts.values()))
+            payloads.append(json.dumps(doc.get("payload", {}), default=str))
+            for term, tf in counts.items():
+                post_terms.append(term)
+                post_keys.append(doc["key"])
+                post_tfs.append(tf)
+
+        async with AsyncSessionLocal() as db:
+            if replace_prefix:
+                await db.execute(
+                    text(DELETE_SQL.format(where="left(doc_key, length(:prefix)) = :prefix")),
+                    {"prefix": replace_prefix}
+                )
+            if keys:
+                await db.execute(
+                    text(DELETE_SQL.format(where="doc_key = ANY(CAST(:keys AS varchar[]))")),
+                    {"keys": keys}
+                )
+                await db.execute(
+                    text("""
+                        WITH added AS (
+                            INSERT INTO lexical_documents (doc_key, source, length, payload)
+                            SELECT d.doc_key, d.source, d.length, CAST(d.payload AS jsonb)
+                            FROM unnest(
+                                CAST(:keys AS varchar[]),
+                                CAST(:sources AS varchar[]),
+                                CAST(:lengths AS integer[]),
+                                CAST(:payloads AS text[])
+                            ) AS d(doc_key, source, length, payload)
+                            RETURNING source, length
+                        )
+                        INSERT INTO lexical_stats (source, doc_count, total_length)
+                        SELECT source, COUNT(*), SUM(length) FROM added GROUP BY source
+                        ON CONFLICT (source) DO UPDATE
+                        SET doc_count = lexical_stats.doc_count + EXCLUDED.doc_count,
+                            total_length = lexical_stats.total_length + EXCLUDED.total_length
+                    """),
+                    {"keys": keys, "sources": sources, "lengths": lengths, "payloads": payloads}
+                )
+            if post_terms:
+                await db.execute(
+                    text("""
+                        INSERT INTO lexical_postings (term, doc_key, tf)
+                        SELECT * FROM unnest(
+                            CAST(:terms AS varchar[]),
+                            CAST(:keys AS varchar[]),
+                            CAST(:tfs AS integer[])
+                        )
+                    """),
+                    {"terms": post_terms, "keys": post_keys, "tfs": post_tfs}
+                )
+            await db.commit()
+
+    async def delete(self, prefix: str):
+        """
+        Delete all documents whose key starts with `prefix`, e.g.
+        "chapter:12:", "knowledge:7:" or "document_chunk:3:".
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    text(DELETE_SQL.format(where="left(doc_key, length(:prefix)) = :prefix")),
+                    {"prefix": prefix}
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Lexical index delete failed for '{prefix}': {e}")
+
+    async def index_chapter(self, chapter: Dict[str, Any], blocks: List[str]):
+        """Index a chapter's blocks; `chapter` needs id, title, chapter_number and book_id."""
+        if not settings.LEXICAL_ENABLED:
+            return
+        documents = [
+            {
+                "key": f"chapter:{chapter['id']}:{block_index}",
+                "source": "chapters",
+                "content": f"{chapter.get('title') or ''}\n{block}",
+                "payload": {
+                    "chapter_id": chapter["id"],
+                    "book_id": chapter.get("book_id"),
+                    "chapter_number": chapter.get("chapter_number"),
+                    "title": chapter.get("title"),
+                    "block_index": block_index,
+                    "start_token": 0,
+                    "content": block
+                }
+            }
+            for block_index, block in enumerate(blocks)
+        ]
+        try:
+            await self.index_documents(documents, replace_prefix=f"chapter:{chapter['id']}:")
+        except Exception as e:
+            logger.error(f"Lexical index error for chapter {chapter['id']}: {e}")
+
+    async def index_knowledge(self, knowledge_id: int, title: str, content: str,
+                              category: str = None, source_type: str = None,
+                              chunks: List[Dict[str, Any]] = None, replace: bool = True):
+        """
+        Index a knowledge base entry.
+
+        Pass the {index, text} chunks already indexed in Qdrant so lexical
+        and vector hits on the same chunk share a chunk_index; otherwise the
+        content is chunked here. With `replace` off, the chunks are added to
+        those already indexed for the entry.
+        """
+        if not settings.LEXICAL_ENABLED:
+            return
+        if chunks is None:
+            chunks = get_document_processor().chunk_text(
+                content, KNOWLEDGE_CHUNK_TOKENS, KNOWLEDGE_CHUNK_OVERLAP
+            )
+        documents = [
+            {
+                "key": f"knowledge:{knowledge_id}:{chunk['index']}",
+                "source": "knowledge",
+                "content": f"{title or ''}\n{chunk['text']}",
+                "payload": {
+                    "id": knowledge_id,
+                    "doc_id": knowledge_id,
+                    "chunk_index": chunk["index"],
+                    "title": title,
+                    "content": chunk["text"],
+                    "category": category,
+                    "source_type": source_type
+                }
+            }
+            for chunk in chunks
+        ]
+        try:
+            await self.index_documents(
+                documents, replace_prefix=f"knowledge:{knowledge_id}:" if replace else None
+            )
+        except Exception as e:
+            logger.error(f"Lexical index error for knowledge {knowledge_id}: {e}")
+
+    async def index_document_chunks(self, document_id: int, chunks: List[Dict[str, Any]],
+                                    filename: str = None, category: str = None):
+        """Index an uploaded document's {chunk_id, chunk_index, content} chunks."""
+        if not settings.LEXICAL_ENABLED:
+            return
+        documents = [
+            {
+                "key": f"document_chunk:{document_id}:{chunk['chunk_index']}",
+                "source": "knowledge",
+                "content": chunk["content"],
+                "payload": {
+                    "document_id": document_id,
+                    "chunk_id": chunk.get("chunk_id"),
+                    "chunk_index": chunk["chunk_index"],
+                    "content": chunk["content"],
+                    "category": category,
+                    "filename": filename
+                }
+            }
+            for chunk in chunks
+        ]
+        try:
+            await self.index_documents(documents, replace_prefix=f"document_chunk:{document_id}:")
+        except Exception as e:
+            logger.error(f"Lexical index error for document {document_id}: {e}")
+
+    async def search(self, query: str, source: str = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """BM25 search; returns {id, score, payload} hits, best first."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text("""
+                    WITH stats AS (
+                        SELECT COALESCE(SUM(doc_count), 0)::float AS n,
+                               GREATEST(SUM(total_length)::float / NULLIF(SUM(doc_count), 0), 1) AS avgdl
+                        FROM lexical_stats
+                    ),
+                    df AS (
+                        SELECT term, COUNT(*)::float AS df
+                        FROM lexical_postings
+                        WHERE term = ANY(CAST(:terms AS varchar[]))
+                        GROUP BY term
+                    ),
+                    ranked AS (
+                        SELECT p.doc_key,
+                               SUM(
+                                   LN(1 + (s.n - df.df + 0.5) / (df.df + 0.5))
+                                   * p.tf * (:k1 + 1)
+                                   / (p.tf + :k1 * (1 - :b + :b * d.length / s.avgdl))
+                               ) AS score
+                        FROM lexical_postings p
+                        JOIN df ON df.term = p.term
+                        JOIN lexical_documents d ON d.doc_key = p.doc_key
+                        CROSS JOIN stats s
+                        WHERE CAST(:source AS varchar) IS NULL OR d.source = :source
+                        GROUP BY p.doc_key
+                        ORDER BY score DESC
+                        LIMIT :limit
+                    )
+                    SELECT r.doc_key, r.score, d.payload
+                    FROM ranked r JOIN lexical_documents d ON d.doc_key = r.doc_key
+                    ORDER BY r.score DESC
+                """),
+                {"terms": terms, "source": source, "limit": limit, "k1": self.k1, "b": self.b}
+            )
+            rows = result.fetchall()
+
+        return [
+            {
+                "id": row.doc_key,
+                "score": float(row.score),
+                "payload": row.payload if isinstance(row.payload, dict) else json.loads(row.payload or "{}")
+            }
+            for row in rows
+        ]
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Document and posting counts per source."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                text("""
+                    SELECT d.source, COUNT(DISTINCT d.doc_key) AS documents, COUNT(p.term) AS postings
+                    FROM lexical_documents d
+                    LEFT JOIN lexical_postings p ON p.doc_key = d.doc_key
+                    GROUP BY d.source
+                """)
+            )
+            rows = result.fetchall()
+        return {row.source: {"documents": row.documents, "postings": row.postings} for row in rows}
+
+
+# Index singleton
+_lexical_index: Optional[LexicalIndex] = None
+
+
+def get_lexical_index() -> LexicalIndex:
+    """Get or create the lexical index singleton."""
+    global _lexical_index
+    if _lexical_index is None:
+        _lexical_index = LexicalIndex()
+    return _lexical_index
@@ -0,0 +1,141 @@
+"""Persistent cache for deterministic LLM responses."""
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database.postgres import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class LLMResponseCache:
+    """
+    LLM responses stored in PostgreSQL, shared by the API and workers.
+
+    Entries are keyed by a hash of (provider, model, temperature,
+    max_tokens, messages). Expired entries are ignored on read; every
+    `prune_every` writes, expired rows are deleted and the table is
+    trimmed to `max_entries` by least recent use.
+    """
+
+    def __init__(self):
+        self.ttl = settings.LLM_CACHE_TTL
+        self.max_entries = settings.LLM_CACHE_MAX_ENTRIES
+        self.prune_every = settings.LLM_CACHE_PRUNE_EVERY
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    @staticmethod
+    def key(provider: str, model: str, temperature: float, max_tokens: int,
+            messages: List[Dict[str, str]]) -> str:
+        """Build the cache key for a generate call."""
+        payload = json.dumps(
+            {
+                "provider": provider,
+                "model": model,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "messages": messages
+            },
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """Return a cached response, or None on miss or error."""
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    text("""
+                        UPDATE llm_cache
+                        SET last_accessed_at = NOW(), hit_count = hit_count + 1
+                        WHERE cache_key = :key AND expires_at > NOW()
+                        RETURNING response
+                    """),
+                    {"key": key}
+                )
+                row = result.fetchone()
+                await db.commit()
+        except Exception as e:
+            self.errors += 1
+            logger.debug(f"LLM cache lookup skipped: {e}")
+            return None
+
+        if row:
+            self.hits += 1
+            return row.response
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, provider: str, model: str, response: str):
+        """Store a response, pruning the table periodically."""
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    text("""
+                        INSERT INTO llm_cache (cache_key, provider, model, response, expires_at)
+                        VALUES (:key, :provider, :model, :response, NOW() + make_interval(secs => :ttl))
+                        ON CONFLICT (cache_key) DO UPDATE
+                        SET response = EXCLUDED.response, expires_at = EXCLUDED.expires_at,
+                            last_accessed_at = NOW()
+                    """),
+                    {"key": key, "provider": provider, "model": model, "response": response, "ttl": self.ttl}
+                )
+                await db.commit()
+            self.writes += 1
+            if self.writes % self.prune_every == 0:
+                await self.prune()
+        except Exception as e:
+            self.errors += 1
+            logger.debug(f"LLM cache write skipped: {e}")
+
+    async def prune(self) -> int:
+        """Delete expired entries and trim to max_entries by least recent use."""
+        async with AsyncSessionLocal() as db:
+            expired = await db.execute(text("DELETE FROM llm_cache WHERE expires_at <= NOW()"))
+            overflow = await db.execute(
+                text("""
+                    DELETE FROM llm_cache
+                    WHERE cache_key IN (
+                        SELECT cache_key FROM llm_cache
+                        ORDER BY last_accessed_at DESC
+                        OFFSET :max_entries
+                    )
+                """),
+                {"max_entries": self.max_entries}
+            )
+            await db.commit()
+        removed = (expired.rowcount or 0) + (overflow.rowcount or 0)
+        if removed:
+            logger.info(f"Pruned {removed} LLM cache entries")
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters for this process."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# Cache singleton
+_llm_cache: Optional[LLMResponseCache] = None
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """Get or create the LLM response cache singleton."""
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMResponseCache()
+    return _llm_cache
@@ -0,0 +1,195 @@
+"""Per-provider admission control for LLM calls."""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Scheduling class of an LLM call; lower values are served first."""
+    INTERACTIVE = 0  # Chat replies a user is waiting on
+    INTENT = 1  # Intent classification ahead of a chat reply
+    BACKGROUND = 2  # Analysis and extraction
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token if one is available; otherwise return the seconds until one is."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ProviderScheduler:
+    """
+    Admits calls to one provider in priority order.
+
+    At most `concurrency` calls run at once, and with a rate limit calls
+    start no faster than `rate_per_minute` (bursts up to `concurrency`).
+    Waiting calls form a heap ordered by (priority, arrival), so queued
+    chat replies always start before queued background work.
+    """
+
+    def __init__(self, provider: str, concurrency: int, rate_per_minute: float = None):
+        self.provider = provider
+        self.concurrency = max(1, concurrency)
+        self.rate_per_minute = rate_per_minute
+        self.bucket = TokenBucket(rate_per_minute / 60.0, self.concurrency) if rate_per_minute else None
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._arrivals = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.throttled = 0
+        self._waits = {p: {"calls": 0, "total": 0.0, "max": 0.0} for p in Priority}
+
+    def _dispatch(self):
+        """Start as many waiting calls as the slots and the bucket allow."""
+        self._timer = None
+        while self._waiters and self.active < self.concurrency:
+            future = self._waiters[0][2]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.bucket:
+                delay = self.bucket.take()
+                if delay:
+                    self.throttled += 1
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                    return
+            heapq.heappop(self._waiters)
+            self.active += 1
+            future.set_result(None)
+
+    def _release(self):
+        self.active -= 1
+        if self._timer is None:
+            self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.BACKGROUND) -> AsyncIterator[None]:
+        """Hold a slot for the duration of one call."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._arrivals), future))
+        enqueued = time.monotonic()
+        if self._timer is None:
+            self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Granted just as the caller was cancelled: hand the slot on
+            if not future.cancelled():
+                self._release()
+            raise
+
+        waited = time.monotonic() - enqueued
+        waits = self._waits[priority]
+        waits["calls"] += 1
+        waits["total"] += waited
+        waits["max"] = max(waits["max"], waited)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Slot usage, queue depth and wait times per priority."""
+        queued = {p.name.lower(): 0 for p in Priority}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                queued[Priority(priority).name.lower()] += 1
+        return {
+            "concurrency": self.concurrency,
+            "rate_per_minute": self.rate_per_minute,
+            "active": self.active,
+            "queued": queued,
+            "throttled": self.throttled,
+            "waits": {
+                p.name.lower(): {
+                    "calls": w["calls"],
+                    "avg_wait_ms": round(w["total"] / w["calls"] * 1000, 1) if w["calls"] else 0.0,
+                    "max_wait_ms": round(w["max"] * 1000, 1)
+                }
+                for p, w in self._waits.items()
+            }
+        }
+
+
+class LLMScheduler:
+    """
+    Provider schedulers of this process, created on first use from the
+    given budget (by default LLM_PROVIDER_CONCURRENCY and
+    LLM_PROVIDER_RATE_LIMITS).
+
+    Slots are per process: calls are ordered by priority only against
+    other calls of the same process, so the API and worker processes each
+    need their own budget (see init_worker_llm_scheduler).
+    """
+
+    def __init__(self, concurrency: Dict[str, int] = None, default_concurrency: int = None,
+                 rate_limits: Dict[str, float] = None):
+        self.concurrency = settings.llm_provider_concurrency if concurrency is None else concurrency
+        self.default_concurrency = default_concurrency or settings.LLM_DEFAULT_CONCURRENCY
+        self.rate_limits = settings.llm_provider_rate_limits if rate_limits is None else rate_limits
+        self._providers: Dict[str, ProviderScheduler] = {}
+
+    def provider(self, name: str) -> ProviderScheduler:
+        """Get the scheduler of a provider."""
+        scheduler = self._providers.get(name)
+        if scheduler is None:
+            scheduler = ProviderScheduler(
+                name,
+                self.concurrency.get(name, self.default_concurrency),
+                self.rate_limits.get(name)
+            )
+            self._providers[name] = scheduler
+        return scheduler
+
+    def slot(self, provider: str, priority: Priority = Priority.BACKGROUND):
+        """Hold a slot of `provider` for one call; use with `async with`."""
+        return self.provider(provider).slot(priority)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Stats of every provider used so far."""
+        return {name: scheduler.get_stats() for name, scheduler in self._providers.items()}
+
+
+# Scheduler singleton
+_llm_scheduler: Optional[LLMScheduler] = None
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Get or create the LLM scheduler singleton."""
+    global _llm_scheduler
+    if _llm_scheduler is None:
+        _llm_scheduler = LLMScheduler()
+    return _llm_scheduler
+
+
+def init_worker_llm_scheduler():
+    """Give this process the background worker's LLM budget (WORKER_LLM_*)."""
+    global _llm_scheduler
+    _llm_scheduler = LLMScheduler(
+        settings.worker_llm_provider_concurrency,
+        settings.WORKER_LLM_DEFAULT_CONCURRENCY,
+        settings.worker_llm_provider_rate_limits
+    )
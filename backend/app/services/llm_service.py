@@ -1,12 +1,72 @@
 """LLM Service supporting LM Studio and DeepSeek API."""
 import httpx
-from typing import List, Dict, Any, Optional, AsyncGenerator
+from typing import List, Dict, Any, Optional, AsyncGenerator, Callable, Tuple
 from openai import AsyncOpenAI
 from app.config import settings
+from app.services.llm_cache import get_llm_cache
+from app.services.llm_scheduler import Priority, get_llm_scheduler
+from app.services.semantic_cache import get_semantic_cache
+from app.services.document_service import get_long_context_manager
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Process-wide pooled HTTP clients
+_http_client: Optional[httpx.AsyncClient] = None
+_openai_clients: Dict[Tuple[str, str], AsyncOpenAI] = {}
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    """Create an HTTP client with the configured pool limits."""
+    http2 = settings.LLM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            http2 = False
+    return httpx.AsyncClient(
+        timeout=settings.LLM_HTTP_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY
+        ),
+        http2=http2
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the shared HTTP client used for raw provider calls."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = _build_http_client()
+    return _http_client
+
+
+def get_openai_client(base_url: str, api_key: str) -> AsyncOpenAI:
+    """Get a shared OpenAI-compatible client for a base URL and key."""
+    key = (base_url, api_key)
+    client = _openai_clients.get(key)
+    if client is None:
+        client = AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            http_client=_build_http_client()
+        )
+        _openai_clients[key] = client
+    return client
+
+
+async def close_llm_clients():
+    """Close all pooled LLM HTTP clients."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    for client in _openai_clients.values():
+        await client.close()
+    _openai_clients.clear()
+
 
 class LLMProvider:
     """Base LLM provider interface."""
@@ -28,7 +88,7 @@ class LMStudioProvider(LLMProvider):
     """LM Studio local LLM provider."""
     
     def __init__(self):
-        self.client = AsyncOpenAI(
+        self.client = get_openai_client(
             base_url=settings.LM_STUDIO_URL,
             api_key="lm-studio"  # LM Studio doesn't require a real API key
         )
@@ -76,7 +136,7 @@ class DeepSeekProvider(LLMProvider):
     def __init__(self):
         if not settings.DEEPSEEK_API_KEY:
             raise ValueError("DEEPSEEK_API_KEY not configured")
-        self.client = AsyncOpenAI(
+        self.client = get_openai_client(
             base_url=settings.DEEPSEEK_API_URL,
             api_key=settings.DEEPSEEK_API_KEY
         )
@@ -130,22 +190,23 @@ class OllamaProvider(LLMProvider):
                       max_tokens: int = 4096) -> str:
         """Generate a response from Ollama."""
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/api/chat",
-                    json={
-                        "model": self.model,
-                        "messages": messages,
-                        "options": {
-                            "temperature": temperature,
-                            "num_predict": max_tokens
-                        },
-                        "stream": False
-                    }
-                )
-                response.raise_for_status()
-                data = response.json()
-                return data.get("message", {}).get("content", "")
+            client = get_http_client()
+            response = await client.post(
+                f"{self.base_url}/api/chat",
+                json={
+                    "model": self.model,
+                    "messages": messages,
+                    "options": {
+                        "temperature": temperature,
+                        "num_predict": max_tokens,
+                        "num_ctx": settings.OLLAMA_CONTEXT_WINDOW
+                    },
+                    "stream": False
+                }
+            )
+            response.raise_for_status()
+            data = response.json()
+            return data.get("message", {}).get("content", "")
         except Exception as e:
             logger.error(f"Ollama error: {e}")
             raise
@@ -155,41 +216,106 @@ class OllamaProvider(LLMProvider):
                     max_tokens: int = 4096) -> AsyncGenerator[str, None]:
         """Stream a response from Ollama."""
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                async with client.stream(
-                    "POST",
-                    f"{self.base_url}/api/chat",
-                    json={
-                        "model": self.model,
-                        "messages": messages,
-                        "options": {
-                            "temperature": temperature,
-                            "num_predict": max_tokens
-                        },
-                        "stream": True
-                    }
-                ) as response:
-                    response.raise_for_status()
-                    async for line in response.aiter_lines():
-                        if line:
-                            try:
-                                import json
-                                data = json.loads(line)
-                                content = data.get("message", {}).get("content", "")
-                                if content:
-                                    yield content
-                            except json.JSONDecodeError:
-                                continue
+            client = get_http_client()
+            async with client.stream(
+                "POST",
+                f"{self.base_url}/api/chat",
+                json={
+                    "model": self.model,
+                    "messages": messages,
+                    "options": {
+                        "temperature": temperature,
+                        "num_predict": max_tokens,
+                        "num_ctx": settings.OLLAMA_CONTEXT_WINDOW
+                    },
+                    "stream": True
+                }
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line:
+                        try:
+                            import json
+                            data = json.loads(line)
+                            content = data.get("message", {}).get("content", "")
+                            if content:
+                                yield content
+                        except json.JSONDecodeError:
+                            continue
         except Exception as e:
             logger.error(f"Ollama streaming error: {e}")
             raise
 
 
+# Localized headers for the context section of the system prompt
+CONTEXT_HEADERS = {
+    "en": {
+        "retrieved": "## Retrieved Context:",
+        "upload": "## Uploaded Document Content:",
+        "chapters": "### Relevant Chapters:",
+        "characters": "### Characters (Personality & Behavior Reference):",
+        "events": "### Timeline Events:",
+        "knowledge": "### Knowledge Base:",
+        "web_search": "### Web Search Results:",
+        "relationships": "Relationships:",
+        "personality": "Personality:",
+        "behavior": "Typical behavior:",
+        "involved": "Involved:",
+        "no_context": "No additional context available."
+    },
+    "zh-TW": {
+        "retrieved": "## Retrieved Context:",
+        "upload": "## 上傳的文件內容：",
+        "chapters": "### 相關章節：",
+        "characters": "### 角色（性格與行為參考）：",
+        "events": "### 時間線事件：",
+        "knowledge": "### 知識庫：",
+        "web_search": "### 網路搜尋結果：",
+        "relationships": "關係：",
+        "personality": "性格：",
+        "behavior": "典型行為：",
+        "involved": "參與者：",
+        "no_context": "沒有可用的額外上下文。"
+    },
+    "zh-CN": {
+        "retrieved": "## Retrieved Context:",
+        "upload": "## 上传的文档内容：",
+        "chapters": "### 相关章节：",
+        "characters": "### 角色（性格与行为参考）：",
+        "events": "### 时间线事件：",
+        "knowledge": "### 知识库：",
+        "web_search": "### 网络搜索结果：",
+        "relationships": "关系：",
+        "personality": "性格：",
+        "behavior": "典型行为：",
+        "involved": "参与者：",
+        "no_context": "没有可用的额外上下文。"
+    }
+}
+
+# Relevance weight of each context section when packing the token budget
+CONTEXT_SECTION_WEIGHTS = {
+    "story_position": 1.0,
+    "upload": 1.0,
+    "characters": 1.0,
+    "events": 0.7,
+    "chapters": 1.0,
+    "knowledge": 0.9,
+    "web_search": 0.5
+}
+
+
 class LLMService:
-    """Unified LLM service that can switch between providers."""
+    """
+    Unified LLM service that can switch between providers.
+    
+    Provider calls wait for a slot of the provider's scheduler at the
+    service's `priority`, so background analysis queues behind chat.
+    """
     
-    def __init__(self, provider: str = None):
+    def __init__(self, provider: str = None, priority: Priority = Priority.BACKGROUND):
         self.provider_name = provider or settings.DEFAULT_LLM_PROVIDER
+        self.priority = priority
         self._provider: Optional[LLMProvider] = None
     
     @property
@@ -210,6 +336,15 @@ class LLMService:
         else:
             raise ValueError(f"Unknown LLM provider: {self.provider_name}")
     
+    @property
+    def context_window(self) -> int:
+        """Context window of the current provider's model, in tokens."""
+        return {
+            "lm_studio": settings.LM_STUDIO_CONTEXT_WINDOW,
+            "deepseek": settings.DEEPSEEK_CONTEXT_WINDOW,
+            "ollama": settings.OLLAMA_CONTEXT_WINDOW
+        }.get(self.provider_name, settings.OLLAMA_CONTEXT_WINDOW)
+    
     def switch_provider(self, provider: str):
         """Switch to a different LLM provider."""
         self.provider_name = provider
@@ -217,16 +352,124 @@ class LLMService:
     
     async def generate(self, messages: List[Dict[str, str]], 
                       temperature: float = 0.7,
-                      max_tokens: int = 4096) -> str:
-        """Generate a response."""
-        return await self.provider.generate(messages, temperature, max_tokens)
+                      max_tokens: int = 4096,
+                      cache: bool = False,
+                      validate: Callable[[str], Any] = None) -> str:
+        """
+        Generate a response.
+        
+        With `cache=True` the response is looked up in and stored to the
+        persistent LLM response cache. Only opt in for deterministic
+        prompts whose answer should not change between identical calls.
+        With `validate` (e.g. the caller's JSON parser), only responses it
+        accepts without raising are stored or served from the cache, so a
+        malformed reply is not replayed to every retry.
+        """
+        if not (cache and settings.LLM_CACHE_ENABLED):
+            return await self._generate(messages, temperature, max_tokens)
+        
+        def acceptable(response: str) -> bool:
+            if validate is None:
+                return True
+            try:
+                validate(response)
+                return True
+            except Exception:
+                return False
+        
+        llm_cache = get_llm_cache()
+        model = getattr(self.provider, "model", "")
+        key = llm_cache.key(self.provider_name, model, temperature, max_tokens, messages)
+        
+        cached = await llm_cache.get(key)
+        if cached is not None and acceptable(cached):
+            return cached
+        
+        response = await self._generate(messages, temperature, max_tokens)
+        if response and acceptable(response):
+            await llm_cache.put(key, self.provider_name, model, response)
+        return response
+    
+    async def _generate(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+        async with get_llm_scheduler().slot(self.provider_name, self.priority):
+            return await self.provider.generate(messages, temperature, max_tokens)
     
     async def stream(self, messages: List[Dict[str, str]],
                     temperature: float = 0.7,
                     max_tokens: int = 4096) -> AsyncGenerator[str, None]:
-        """Stream a response."""
-        async for chunk in self.provider.stream(messages, temperature, max_tokens):
+        """Stream a response; the provider slot is held until the stream ends."""
+        async with get_llm_scheduler().slot(self.provider_name, self.priority):
+            async for chunk in self.provider.stream(messages, temperature, max_tokens):
+                yield chunk
+    
+    async def _semantic_scope(self, user_message: str, context: Dict[str, Any],
+                              messages: List[Dict[str, str]], temperature: float,
+                              max_tokens: int, language: str, extra: tuple) -> Optional[Dict[str, Any]]:
+        if not settings.SEMANTIC_CACHE_ENABLED:
+            return None
+        # The packed conversation history (everything between the system
+        # prompt and the new question) is part of the key, so follow-ups
+        # only match within an identical conversation
+        history = [m for m in messages[:-1] if m.get("role") != "system"]
+        try:
+            return await get_semantic_cache().scope(
+                user_message, context, self.provider_name,
+                getattr(self.provider, "model", ""), language,
+                (*extra, history, temperature, max_tokens)
+            )
+        except Exception as e:
+            logger.debug(f"Semantic cache skipped: {e}")
+            return None
+    
+    async def generate_semantic(self, user_message: str, context: Dict[str, Any],
+                                messages: List[Dict[str, str]],
+                                temperature: float = 0.7,
+                                max_tokens: int = 4096,
+                                language: str = "en",
+                                extra: tuple = ()) -> str:
+        """
+        Generate an answer to `user_message`, reusing a cached answer to a
+        near-identical question over the same context and story data.
+        `messages` are the prompt built from them; `extra` holds any other
+        inputs the answer depends on (uploads, custom system prompts).
+        """
+        semantic_cache = get_semantic_cache()
+        scope = await self._semantic_scope(
+            user_message, context, messages, temperature, max_tokens, language, extra
+        )
+        if scope:
+            cached = await semantic_cache.get(scope)
+            if cached is not None:
+                return cached
+        
+        response = await self.generate(messages, temperature, max_tokens)
+        if scope and response:
+            await semantic_cache.put(scope, user_message, response)
+        return response
+    
+    async def stream_semantic(self, user_message: str, context: Dict[str, Any],
+                              messages: List[Dict[str, str]],
+                              temperature: float = 0.7,
+                              max_tokens: int = 4096,
+                              language: str = "en",
+                              extra: tuple = ()) -> AsyncGenerator[str, None]:
+        """Streaming counterpart of generate_semantic; a cached answer arrives as one chunk."""
+        semantic_cache = get_semantic_cache()
+        scope = await self._semantic_scope(
+            user_message, context, messages, temperature, max_tokens, language, extra
+        )
+        if scope:
+            cached = await semantic_cache.get(scope)
+            if cached is not None:
+                yield cached
+                return
+        
+        response = ""
+        async for chunk in self.stream(messages, temperature, max_tokens):
+            response += chunk
             yield chunk
+        if scope and response:
+            await semantic_cache.put(scope, user_message, response)
     
     async def generate_with_context(self, user_message: str,
                                     context: Dict[str, Any],
@@ -234,7 +477,7 @@ class LLMService:
                                     conversation_history: List[Dict[str, str]] = None,
                                     temperature: float = 0.7,
                                     language: str = "en",
-                                    max_context_tokens: int = 32000,
+                                    max_context_tokens: int = None,
                                     max_tokens: int = 8192,
                                     categories: List[str] = None,
                                     uploaded_content: str = None) -> str:
@@ -249,35 +492,25 @@ class LLMService:
             conversation_history: Previous conversation messages
             temperature: LLM temperature setting
             language: Response language (en, zh-TW, zh-CN)
-            max_context_tokens: Maximum tokens for context
+            max_context_tokens: Context window to pack into (default: the provider's)
             categories: Knowledge categories to prioritize
         """
-        # Build system prompt with context
-        if system_prompt is None:
-            system_prompt = self._build_novel_system_prompt(language)
-        
-        # Add context to system prompt
-        if context:
-            context_text = self._format_context(context, language, categories)
-            system_prompt += f"\n\n## Retrieved Context:\n{context_text}"
-        
-        # Add uploaded content if provided
-        if uploaded_content:
-            system_prompt += f"\n\n## Uploaded Document Content:\n{uploaded_content[:10000]}"
-        
-        # Build messages
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # Add conversation history (more for long context support)
-        if conversation_history:
-            # For long context models, include more history
-            history_limit = 30 if max_context_tokens >= 32000 else 10
-            messages.extend(conversation_history[-history_limit:])
-        
-        # Add user message
-        messages.append({"role": "user", "content": user_message})
+        messages, max_tokens, _ = self.build_messages(
+            user_message=user_message,
+            context=context,
+            conversation_history=conversation_history,
+            language=language,
+            max_tokens=max_tokens,
+            categories=categories,
+            uploaded_content=uploaded_content,
+            system_prompt=system_prompt,
+            context_window=max_context_tokens
+        )
         
-        return await self.generate(messages, temperature, max_tokens)
+        return await self.generate_semantic(
+            user_message, context, messages, temperature, max_tokens, language,
+            extra=(system_prompt, categories, uploaded_content)
+        )
     
     def _build_novel_system_prompt(self, language: str = "en") -> str:
         """Build the default system prompt for novel writing with full character awareness."""
@@ -427,10 +660,29 @@ Your context includes information categorized as:
         
         return prompts.get(language, prompts["en"])
     
-    def _format_context(self, context: Dict[str, Any], language: str = "en",
-                       priority_categories: List[str] = None) -> str:
-        """Format context dictionary into readable text with language support."""
-        parts = []
+    def _context_units(self, context: Dict[str, Any], language: str = "en",
+                       uploaded_content: str = None) -> List[Dict[str, Any]]:
+        """
+        Split context into packable units, one per item, with localized text.
+        
+        Each unit carries its `section`, the text it renders to, and a
+        relevance `score`: the item's retrieval score where it has one,
+        otherwise a rank-based prior, weighted per section. Story position
+        and uploaded content are pinned ahead of retrieved context.
+        """
+        units: List[Dict[str, Any]] = []
+        h = CONTEXT_HEADERS.get(language, CONTEXT_HEADERS["en"])
+        
+        def add(section: str, text: str, item: Any = None, rank: int = 0, **extra):
+            score = item.get("score") if isinstance(item, dict) else None
+            if not isinstance(score, (int, float)):
+                score = 1.0 / (1 + 0.1 * rank)
+            units.append({
+                "section": section,
+                "text": text,
+                "score": CONTEXT_SECTION_WEIGHTS[section] * score,
+                **extra
+            })
         
         # Story position context FIRST - helps LLM understand where we are
         if context.get("story_position"):
@@ -444,7 +696,7 @@ Your context includes information categorized as:
                 "zh-CN": "### 📍 故事位置："
             }.get(language, "### 📍 Story Position:")
             
-            parts.append(position_header)
+            parts = [position_header]
             parts.append(f"**Series:** {series.get('title', 'Unknown')} ({series.get('progress_percent', 0)}% complete)")
             parts.append(f"**Current:** Book {series.get('current_book', '?')}/{series.get('total_books', '?')}, Chapter {book.get('chapter_number', '?')}")
             parts.append(f"**Book Theme:** {book.get('theme', 'Not defined')}")
@@ -468,119 +720,175 @@ Your context includes information categorized as:
                 parts.append(f"{themes_label} {', '.join(series['themes'])}")
             
             parts.append("")  # Empty line for separation
+            add("story_position", "\n".join(parts), pinned=True)
         
-        # Localized headers
-        headers = {
-            "en": {
-                "chapters": "### Relevant Chapters:",
-                "characters": "### Characters (Personality & Behavior Reference):",
-                "events": "### Timeline Events:",
-                "knowledge": "### Knowledge Base:",
-                "web_search": "### Web Search Results:",
-                "relationships": "Relationships:",
-                "personality": "Personality:",
-                "behavior": "Typical behavior:",
-                "involved": "Involved:",
-                "no_context": "No additional context available."
-            },
-            "zh-TW": {
-                "chapters": "### 相關章節：",
-                "characters": "### 角色（性格與行為參考）：",
-                "events": "### 時間線事件：",
-                "knowledge": "### 知識庫：",
-                "web_search": "### 網路搜尋結果：",
-                "relationships": "關係：",
-                "personality": "性格：",
-                "behavior": "典型行為：",
-                "involved": "參與者：",
-                "no_context": "沒有可用的額外上下文。"
-            },
-            "zh-CN": {
-                "chapters": "### 相关章节：",
-                "characters": "### 角色（性格与行为参考）：",
-                "events": "### 时间线事件：",
-                "knowledge": "### 知识库：",
-                "web_search": "### 网络搜索结果：",
-                "relationships": "关系：",
-                "personality": "性格：",
-                "behavior": "典型行为：",
-                "involved": "参与者：",
-                "no_context": "没有可用的额外上下文。"
-            }
-        }
-        h = headers.get(language, headers["en"])
+        # Characters - most important for behavior awareness
+        for rank, char in enumerate(context.get("characters") or []):
+            parts = [f"\n**{char.get('name', 'Unknown')}**"]
+            if char.get("description"):
+                parts.append(f"  {char['description']}")
+            if char.get("attributes"):
+                attrs = char.get("attributes", {})
+                if attrs.get("personality"):
+                    parts.append(f"  {h['personality']} {attrs['personality']}")
+                if attrs.get("behavior"):
+                    parts.append(f"  {h['behavior']} {attrs['behavior']}")
+                if attrs.get("speech_pattern"):
+                    parts.append(f"  Speech: {attrs['speech_pattern']}")
+            if char.get("relationships"):
+                rels = ", ".join([f"{r['type']} → {r['target']}" for r in char["relationships"]])
+                parts.append(f"  {h['relationships']} {rels}")
+            add("characters", "\n".join(parts), char, rank, truncatable=True)
+        
+        # Timeline events
+        for rank, event in enumerate(context.get("events") or []):
+            chapter_info = f"(Ch.{event.get('chapter')})" if event.get('chapter') else ""
+            timestamp = f"[{event.get('story_timestamp')}]" if event.get('story_timestamp') else ""
+            parts = [f"- {timestamp} {event.get('title', 'Event')} {chapter_info}"]
+            parts.append(f"  {event.get('description', '')}")
+            if event.get("characters"):
+                parts.append(f"  {h['involved']} {', '.join(event['characters'])}")
+            add("events", "\n".join(parts), event, rank)
         
-        # Characters first - most important for behavior awareness
-        if context.get("characters"):
+        # Chapters - matched passages, cut to fit if needed
+        for rank, ch in enumerate(context.get("chapters") or []):
+            parts = [f"\n**Chapter {ch.get('chapter_number', 'N/A')}: {ch.get('title', 'Untitled')}**"]
+            if ch.get("content"):
+                parts.append(ch["content"])
+            add("chapters", "\n".join(parts), ch, rank, truncatable=True)
+        
+        # Knowledge base - grouped by category when rendered
+        for rank, kb in enumerate(context.get("knowledge") or []):
+            text = f"  - {kb.get('title', 'Note')}\n    {kb.get('content', '')}"
+            add("knowledge", text, kb, rank, truncatable=True,
+                group=kb.get("category") or kb.get("source_type") or "notes")
+        
+        # Web search results
+        for rank, result in enumerate(context.get("web_search") or []):
+            text = f"- [{result.get('title', 'Result')}]({result.get('url', '')})\n  {result.get('snippet', '')}"
+            add("web_search", text, result, rank)
+        
+        if uploaded_content:
+            add("upload", uploaded_content, pinned=True, truncatable=True)
+        
+        return units
+    
+    def _render_units(self, units: List[Dict[str, Any]], language: str = "en",
+                      priority_categories: List[str] = None) -> Tuple[str, str]:
+        """Render selected units as (retrieved context text, uploaded content text)."""
+        h = CONTEXT_HEADERS.get(language, CONTEXT_HEADERS["en"])
+        by_section: Dict[str, List[Dict[str, Any]]] = {}
+        for unit in units:
+            by_section.setdefault(unit["section"], []).append(unit)
+        
+        parts = [u["text"] for u in by_section.get("story_position", [])]
+        
+        if by_section.get("characters"):
             parts.append(h["characters"])
-            for char in context["characters"]:
-                parts.append(f"\n**{char.get('name', 'Unknown')}**")
-                if char.get("description"):
-                    parts.append(f"  {char['description']}")
-                if char.get("attributes"):
-                    attrs = char.get("attributes", {})
-                    if attrs.get("personality"):
-                        parts.append(f"  {h['personality']} {attrs['personality']}")
-                    if attrs.get("behavior"):
-                        parts.append(f"  {h['behavior']} {attrs['behavior']}")
-                    if attrs.get("speech_pattern"):
-                        parts.append(f"  Speech: {attrs['speech_pattern']}")
-                if char.get("relationships"):
-                    rels = ", ".join([f"{r['type']} → {r['target']}" for r in char["relationships"]])
-                    parts.append(f"  {h['relationships']} {rels}")
+            parts.extend(u["text"] for u in by_section["characters"])
         
-        # Timeline events
-        if context.get("events"):
-            parts.append(f"\n{h['events']}")
-            for event in context["events"]:
-                chapter_info = f"(Ch.{event.get('chapter')})" if event.get('chapter') else ""
-                timestamp = f"[{event.get('story_timestamp')}]" if event.get('story_timestamp') else ""
-                parts.append(f"- {timestamp} {event.get('title', 'Event')} {chapter_info}")
-                parts.append(f"  {event.get('description', '')}")
-                if event.get("characters"):
-                    parts.append(f"  {h['involved']} {', '.join(event['characters'])}")
-        
-        # Chapters
-        if context.get("chapters"):
-            parts.append(f"\n{h['chapters']}")
-            for ch in context["chapters"]:
-                parts.append(f"\n**Chapter {ch.get('chapter_number', 'N/A')}: {ch.get('title', 'Untitled')}**")
-                if ch.get("content"):
-                    # Include more content for long context
-                    parts.append(f"{ch['content'][:3000]}...")
-        
-        # Knowledge base - grouped by category
-        if context.get("knowledge"):
+        for section in ("events", "chapters"):
+            if by_section.get(section):
+                parts.append(f"\n{h[section]}")
+                parts.extend(u["text"] for u in by_section[section])
+        
+        if by_section.get("knowledge"):
             parts.append(f"\n{h['knowledge']}")
-            by_category = {}
-            for kb in context["knowledge"]:
-                cat = kb.get("category") or kb.get("source_type") or "notes"
-                if cat not in by_category:
-                    by_category[cat] = []
-                by_category[cat].append(kb)
+            by_category: Dict[str, List[str]] = {}
+            for unit in by_section["knowledge"]:
+                by_category.setdefault(unit["group"], []).append(unit["text"])
             
             # Prioritize certain categories if specified
             category_order = priority_categories or ['character', 'settings', 'plot', 'chapter', 'dialogue', 'concept', 'draft', 'research', 'notes']
             sorted_cats = sorted(by_category.keys(), 
                                 key=lambda x: category_order.index(x) if x in category_order else 99)
-            
             for cat in sorted_cats:
-                items = by_category[cat]
                 parts.append(f"\n  **[{cat.upper()}]**")
-                for kb in items:
-                    parts.append(f"  - {kb.get('title', 'Note')}")
-                    parts.append(f"    {kb.get('content', '')[:800]}")
+                parts.extend(by_category[cat])
         
-        # Web search results
-        if context.get("web_search"):
+        if by_section.get("web_search"):
             parts.append(f"\n{h['web_search']}")
-            for result in context["web_search"]:
-                parts.append(f"- [{result.get('title', 'Result')}]({result.get('url', '')})")
-                parts.append(f"  {result.get('snippet', '')}")
+            parts.extend(u["text"] for u in by_section["web_search"])
+        
+        context_text = "\n".join(parts) if parts else h["no_context"]
+        upload_text = "\n".join(u["text"] for u in by_section.get("upload", []))
+        return context_text, upload_text
+    
+    def _format_context(self, context: Dict[str, Any], language: str = "en",
+                       priority_categories: List[str] = None) -> str:
+        """Format the whole context dictionary, without a token budget."""
+        return self._render_units(self._context_units(context, language), language, priority_categories)[0]
+    
+    def build_messages(self, user_message: str,
+                       context: Dict[str, Any] = None,
+                       conversation_history: List[Dict[str, str]] = None,
+                       language: str = "en",
+                       max_tokens: int = 8192,
+                       categories: List[str] = None,
+                       uploaded_content: str = None,
+                       system_prompt: str = None,
+                       context_window: int = None) -> Tuple[List[Dict[str, str]], int, Dict[str, Any]]:
+        """
+        Assemble chat messages that fit the provider's context window.
+        
+        The response gets up to CONTEXT_RESPONSE_SHARE of the window; the
+        system prompt and user message are always kept; history and
+        retrieved context are packed into the rest by LongContextManager.
+        Token counts are cl100k estimates, so windows should be configured
+        with some headroom for models with other tokenizers.
+        
+        Returns (messages, max_tokens clamped to the space left for the
+        response, token usage report).
+        """
+        window = context_window or self.context_window
+        if system_prompt is None:
+            system_prompt = self._build_novel_system_prompt(language)
+        
+        manager = get_long_context_manager(window)
+        h = CONTEXT_HEADERS.get(language, CONTEXT_HEADERS["en"])
+        fixed_tokens = (
+            manager.count_tokens(system_prompt)
+            + manager.count_tokens(user_message)
+            + manager.count_tokens(h["retrieved"] + h["upload"])
+            + 2 * manager.MESSAGE_OVERHEAD_TOKENS
+        )
+        response_reserve = min(max_tokens, int(window * settings.CONTEXT_RESPONSE_SHARE))
+        manager.reserved_tokens = fixed_tokens + response_reserve
+        
+        # An upload is always included, but may take at most half the budget
+        if uploaded_content:
+            uploaded_content = manager._truncate_to_tokens(
+                uploaded_content, max(0, window - manager.reserved_tokens) // 2
+            )
+        
+        packed = manager.build_context(
+            self._context_units(context or {}, language, uploaded_content),
+            conversation_history,
+            settings.CONTEXT_HISTORY_SHARE
+        )
+        context_text, upload_text = self._render_units(packed["units"], language, categories)
+        
+        if context:
+            system_prompt += f"\n\n{h['retrieved']}\n{context_text}"
+        if upload_text:
+            system_prompt += f"\n\n{h['upload']}\n{upload_text}"
+        
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.extend(packed["history"])
+        messages.append({"role": "user", "content": user_message})
         
-        return "\n".join(parts) if parts else h["no_context"]
+        token_usage = packed["token_usage"]
+        prompt_tokens = fixed_tokens + token_usage["total"]
+        response_tokens = max(1, min(max_tokens, window - prompt_tokens))
+        token_usage.update({
+            "window": window,
+            "fixed": fixed_tokens,
+            "prompt": prompt_tokens,
+            "response": response_tokens
+        })
+        return messages, response_tokens, token_usage
 
 
-def get_llm_service(provider: str = None) -> LLMService:
+def get_llm_service(provider: str = None, priority: Priority = Priority.BACKGROUND) -> LLMService:
     """Get LLM service instance."""
-    return LLMService(provider)
+    return LLMService(provider, priority)
@@ -1,6 +1,10 @@
 """RAG (Retrieval-Augmented Generation) service."""
-from typing import List, Dict, Any, Optional
-from app.services.embeddings import generate_embedding
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple, Awaitable
+from app.services.embeddings import embed
+from app.services.reranker import get_reranker
+from app.services.lexical_index import get_lexical_index
+from app.services.gazetteer import get_gazetteer
 from app.database.qdrant_client import get_vector_manager
 from app.database.neo4j_client import get_graph_manager
 from app.database.postgres import AsyncSessionLocal
@@ -10,6 +14,70 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Searches that also have a BM25 side in the lexical index
+LEXICAL_SOURCES = ("chapters", "knowledge")
+
+
+def fusion_key(name: str, hit: Dict[str, Any]) -> str:
+    """Identity shared by the vector and lexical hits on the same unit of content."""
+    payload = hit["payload"] or {}
+    if name == "chapters":
+        return f"chapter:{payload.get('chapter_id')}:{payload.get('block_index')}"
+    if payload.get("document_id") is not None:
+        return f"document:{payload['document_id']}:{payload.get('chunk_index')}"
+    return f"knowledge:{payload.get('id', payload.get('doc_id'))}:{payload.get('chunk_index') or 0}"
+
+
+def matches_filter(payload: Dict[str, Any], filter_conditions: Optional[Dict[str, Any]]) -> bool:
+    """
+    Whether a lexical hit passes a vector search's filter conditions. A
+    field the lexical payload does not carry (such as language) is not
+    held against it.
+    """
+    for key, value in (filter_conditions or {}).items():
+        if payload.get(key) is None:
+            continue
+        allowed = value if isinstance(value, list) else [value]
+        if payload[key] not in allowed:
+            return False
+    return True
+
+
+def reciprocal_rank_fusion(name: str, rankings: Dict[str, List[Dict[str, Any]]],
+                           k: int = None) -> List[Dict[str, Any]]:
+    """
+    Merge ranked {id, score, payload} hit lists by reciprocal rank.
+    
+    Hits on the same unit (see fusion_key; chapter passages fuse per
+    block) count once per list at their best rank. A unit scores the sum
+    of 1 / (k + rank), scaled so that first place in every list is 1.0,
+    and keeps the payload of its best-ranked hit. The original scores are
+    kept as `<list>_score`, e.g. `vector_score` and `lexical_score`.
+    """
+    k = k or settings.RRF_K
+    fused: Dict[str, Dict[str, Any]] = {}
+    for label, hits in rankings.items():
+        rank = 0
+        for hit in hits:
+            key = fusion_key(name, hit)
+            entry = fused.get(key)
+            if entry is not None and f"{label}_score" in entry:
+                continue
+            rank += 1
+            if entry is None:
+                entry = fused[key] = {"id": hit["id"], "payload": hit["payload"], "score": 0.0, "rank": rank}
+            elif rank < entry["rank"]:
+                entry.update({"id": hit["id"], "payload": hit["payload"], "rank": rank})
+            entry["score"] += 1.0 / (k + rank)
+            entry[f"{label}_score"] = hit["score"]
+    
+    scale = len(rankings) / (k + 1)
+    ranked = sorted(fused.values(), key=lambda e: e["score"], reverse=True)
+    for entry in ranked:
+        entry["score"] = round(entry["score"] / scale, 6)
+        del entry["rank"]
+    return ranked
+
 
 class RAGService:
     """Service for retrieval-augmented generation."""
@@ -17,88 +85,331 @@ class RAGService:
     def __init__(self):
         self.top_k = settings.RAG_TOP_K
         self.threshold = settings.RAG_SIMILARITY_THRESHOLD
+        self.vector_timeout = settings.RAG_VECTOR_TIMEOUT
+        self.graph_timeout = settings.RAG_GRAPH_TIMEOUT
+        self.rerank_timeout = settings.RERANK_TIMEOUT
     
     async def retrieve_context(self, query: str, 
                                include_chapters: bool = True,
                                include_knowledge: bool = True,
                                include_ideas: bool = True,
                                include_graph: bool = True,
-                               chapter_filter: int = None) -> Dict[str, Any]:
-        """Retrieve relevant context for a query."""
+                               chapter_filter: int = None,
+                               extra_searches: Dict[str, Dict[str, Any]] = None,
+                               rerank: bool = None,
+                               lexical: bool = None) -> Dict[str, Any]:
+        """
+        Retrieve relevant context for a query.
+        
+        All sources are queried concurrently, each under its own timeout.
+        Vector searches are grouped by collection and each group is sent
+        as a single batched request. `extra_searches` maps a context key
+        to an additional search spec ({collection, limit, score_threshold,
+        filter_conditions}) that rides along in the same batch; its raw
+        {id, score, payload} results are returned under that key.
+        
+        A source that fails or times out is left out of the result and
+        reported under context["retrieval"]; the other sources still return.
+        
+        With `lexical` (default LEXICAL_ENABLED), chapters and knowledge are
+        also searched in the BM25 index, and each is fused with its vector
+        hits by reciprocal rank, so exact names and terms the embedding
+        misses are still found. Extra searches on those collections are
+        fused the same way, keeping the lexical hits that pass their
+        filter conditions.
+        
+        With `rerank` (default RERANK_ENABLED), chapters, knowledge and
+        ideas are over-fetched below the usual similarity threshold and
+        scored together by the cross-encoder; only the best RERANK_TOP_N
+        across all three are kept. If reranking fails or times out the
+        vector ranking is used.
+        """
+        if rerank is None:
+            rerank = settings.RERANK_ENABLED
+        if lexical is None:
+            lexical = settings.LEXICAL_ENABLED
         context = {}
-        query_embedding = generate_embedding(query)
+        sources = {}
         
-        # Search vector databases
-        vector_manager = get_vector_manager()
+        # Graph lookup does not need the query embedding, so start it first
+        if include_graph:
+            sources["graph"] = (self._retrieve_graph(query, chapter_filter), self.graph_timeout)
         
+        searches: Dict[str, Dict[str, Any]] = {}
         if include_chapters:
-            chapter_results = vector_manager.search(
-                collection="chapters",
-                query_vector=query_embedding,
-                limit=self.top_k,
-                score_threshold=self.threshold
-            )
-            context["chapters"] = [r["payload"] for r in chapter_results]
-        
-        if include_knowledge:
-            knowledge_results = vector_manager.search(
-                collection="knowledge",
-                query_vector=query_embedding,
-                limit=self.top_k,
-                score_threshold=self.threshold
-            )
-            context["knowledge"] = [r["payload"] for r in knowledge_results]
-        
-        if include_ideas:
-            idea_results = vector_manager.search(
-                collection="ideas",
-                query_vector=query_embedding,
-                limit=self.top_k,
-                score_threshold=self.threshold
+            searches["chapters"] = self._passage_search()
+        for name, enabled in (("knowledge", include_knowledge),
+                              ("ideas", include_ideas)):
+            if enabled:
+                searches[name] = {
+                    "collection": name,
+                    "limit": self.top_k,
+                    "score_threshold": self.threshold
+                }
+        if rerank:
+            for spec in searches.values():
+                spec["limit"] = self.top_k * settings.RERANK_CANDIDATES
+                spec["score_threshold"] = settings.RERANK_CANDIDATE_THRESHOLD
+        searches.update(extra_searches or {})
+        lexical_searches = {
+            name: spec for name, spec in searches.items() if spec["collection"] in LEXICAL_SOURCES
+        } if lexical else {}
+        if lexical_searches:
+            sources["lexical"] = (self._lexical_search(query, lexical_searches), settings.LEXICAL_TIMEOUT)
+        
+        groups: Dict[str, List[str]] = {}
+        for name, spec in searches.items():
+            groups.setdefault(spec["collection"], []).append(name)
+        
+        if groups:
+            embedding_task = asyncio.ensure_future(embed(query))
+            vector_manager = get_vector_manager()
+            
+            async def vector_source(names: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+                # Shield the shared embedding so one source timing out doesn't cancel it
+                query_embedding = await asyncio.shield(embedding_task)
+                batch = await vector_manager.asearch_batch([
+                    {**searches[name], "query_vector": query_embedding} for name in names
+                ])
+                return dict(zip(names, batch))
+            
+            for collection, names in groups.items():
+                sources[collection] = (vector_source(names), self.vector_timeout)
+        
+        results, stats = await self._fan_out(sources)
+        
+        search_results: Dict[str, List[Dict[str, Any]]] = {}
+        for collection in groups:
+            search_results.update(results.get(collection, {}))
+        
+        for name, hits in results.get("lexical", {}).items():
+            fused = reciprocal_rank_fusion(
+                searches[name]["collection"], {"vector": search_results.get(name, []), "lexical": hits}
             )
-            context["ideas"] = [r["payload"] for r in idea_results]
+            search_results[name] = fused[:searches[name]["limit"]]
         
-        # Search graph database for characters, relationships, events
-        if include_graph:
+        if rerank and search_results:
+            start = asyncio.get_running_loop().time()
             try:
-                graph_manager = await get_graph_manager()
-                graph_results = await graph_manager.search_graph(query)
-                context["graph"] = graph_results
-                
-                # Extract character names for detailed lookup
-                character_names = [c.get("name") for c in graph_results.get("characters", [])]
-                if character_names:
-                    graph_context = await graph_manager.get_context_for_response(
-                        characters=character_names[:3],  # Limit to top 3
-                        chapter=chapter_filter
-                    )
-                    context["characters"] = graph_context.get("characters", [])
-                    context["events"] = graph_context.get("events", [])
-                    context["locations"] = graph_context.get("locations", [])
+                search_results = await asyncio.wait_for(
+                    self._rerank(query, search_results), self.rerank_timeout
+                )
+            except asyncio.TimeoutError:
+                stats["timed_out"].append("rerank")
+                logger.warning("Reranking timed out; using vector ranking")
             except Exception as e:
-                logger.warning(f"Graph search failed: {e}")
+                stats["failed"].append("rerank")
+                logger.warning(f"Reranking failed; using vector ranking: {e}")
+            finally:
+                stats["timings_ms"]["rerank"] = round((asyncio.get_running_loop().time() - start) * 1000, 1)
+        
+        for name, found in search_results.items():
+            if name == "chapters":
+                context[name] = self.pool_passages(found)
+            elif name in ("knowledge", "ideas"):
+                context[name] = [{**r["payload"], "score": r["score"]} for r in found]
+            else:
+                context[name] = found
+        
+        if results.get("graph"):
+            context.update(results["graph"])
+        
+        context["retrieval"] = stats
+        return context
+    
+    async def _rerank(self, query: str,
+                      search_results: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Rerank chapter passages, knowledge and ideas as one candidate pool.
+        
+        Keeps the best RERANK_TOP_N hits overall; each kept hit's score is
+        replaced by its cross-encoder score (the vector score is kept as
+        `vector_score`). Other searches pass through unchanged.
+        """
+        candidates = []
+        for name in ("chapters", "knowledge", "ideas"):
+            for hit in search_results.get(name, []):
+                payload = hit["payload"] or {}
+                passage = payload.get("content") or ""
+                if payload.get("title") and name != "chapters":
+                    passage = f"{payload['title']}\n{passage}"
+                candidates.append({"source": name, "hit": hit, "text": passage})
+        
+        kept = await get_reranker().rerank(query, candidates)
+        
+        reranked = {
+            name: found for name, found in search_results.items()
+            if name not in ("chapters", "knowledge", "ideas")
+        }
+        for name in ("chapters", "knowledge", "ideas"):
+            if name in search_results:
+                reranked[name] = []
+        for c in kept:
+            reranked[c["source"]].append({
+                **c["hit"],
+                "score": c["rerank_score"],
+                "vector_score": c["hit"]["score"]
+            })
+        return reranked
+    
+    async def _lexical_search(self, query: str,
+                              searches: Dict[str, Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        BM25 hits for each named search spec, in the vector search hit
+        format, from the source of its collection and filtered by its
+        filter conditions.
+        """
+        lexical_index = get_lexical_index()
+        limit = self.top_k * settings.LEXICAL_CANDIDATES
+        found = await asyncio.gather(*(
+            lexical_index.search(query, source=spec["collection"], limit=limit) for spec in searches.values()
+        ))
+        return {
+            name: [hit for hit in hits if matches_filter(hit["payload"], spec.get("filter_conditions"))]
+            for (name, spec), hits in zip(searches.items(), found)
+        }
+    
+    async def _retrieve_graph(self, query: str, chapter_filter: int = None) -> Dict[str, Any]:
+        """
+        Graph context for the characters and locations the query mentions.
         
+        Mentions are found by the in-memory gazetteer; only when it finds
+        none is the graph's full-text index searched instead.
+        """
+        context = {}
+        graph_manager = await get_graph_manager()
+        mentions = await get_gazetteer().detect(query)
+        
+        if mentions["characters"] or mentions["locations"]:
+            graph_context = await graph_manager.get_context_for_response(
+                characters=mentions["characters"][:3],
+                locations=mentions["locations"][:3],
+                chapter=chapter_filter
+            )
+            context["graph"] = {
+                "characters": graph_context.get("characters", []),
+                "locations": graph_context.get("locations", []),
+                "events": []
+            }
+        else:
+            graph_results = await graph_manager.search_graph(query)
+            context["graph"] = graph_results
+            
+            # Extract character names for detailed lookup
+            character_names = [c.get("name") for c in graph_results.get("characters", [])]
+            if not character_names:
+                return context
+            graph_context = await graph_manager.get_context_for_response(
+                characters=character_names[:3],  # Limit to top 3
+                chapter=chapter_filter
+            )
+        
+        context["characters"] = graph_context.get("characters", [])
+        context["events"] = graph_context.get("events", [])
+        context["locations"] = graph_context.get("locations", [])
         return context
     
+    async def _fan_out(self, sources: Dict[str, Tuple[Awaitable, float]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Await all sources concurrently, each under its own timeout.
+        
+        Returns the results of the sources that succeeded, plus per-source
+        latency and the names of sources that timed out or failed.
+        """
+        loop = asyncio.get_running_loop()
+        timings = {}
+        
+        async def run(name: str, awaitable: Awaitable, timeout: float):
+            start = loop.time()
+            try:
+                return await asyncio.wait_for(awaitable, timeout)
+            finally:
+                timings[name] = round((loop.time() - start) * 1000, 1)
+        
+        names = list(sources)
+        outcomes = await asyncio.gather(
+            *(run(name, *sources[name]) for name in names),
+            return_exceptions=True
+        )
+        
+        results = {}
+        stats = {"timings_ms": timings, "timed_out": [], "failed": []}
+        for name, outcome in zip(names, outcomes):
+            if isinstance(outcome, asyncio.TimeoutError):
+                stats["timed_out"].append(name)
+                logger.warning(f"Retrieval source '{name}' timed out")
+            elif isinstance(outcome, Exception):
+                stats["failed"].append(name)
+                logger.warning(f"Retrieval source '{name}' failed: {outcome}")
+            else:
+                results[name] = outcome
+        
+        return results, stats
+    
+    def _passage_search(self, limit: int = None,
+                        filter_conditions: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Search spec over chapter passages, over-fetched for pooling."""
+        return {
+            "collection": "chapter_passages",
+            "limit": (limit or self.top_k) * settings.CHAPTER_PASSAGE_FANOUT,
+            "score_threshold": self.threshold,
+            "filter_conditions": filter_conditions
+        }
+    
+    def pool_passages(self, results: List[Dict[str, Any]], limit: int = None) -> List[Dict[str, Any]]:
+        """
+        Aggregate passage hits into ranked chapters.
+        
+        A chapter scores the max (or, with CHAPTER_PASSAGE_POOLING=sum, the
+        sum) of its passage scores. Its `content` is the matched passages in
+        reading order rather than the start of the chapter.
+        """
+        chapters: Dict[Any, Dict[str, Any]] = {}
+        for r in results:
+            payload = r["payload"]
+            chapter = chapters.get(payload.get("chapter_id"))
+            if chapter is None:
+                chapter = chapters[payload.get("chapter_id")] = {
+                    "id": payload.get("chapter_id"),
+                    "book_id": payload.get("book_id"),
+                    "chapter_number": payload.get("chapter_number"),
+                    "title": payload.get("title"),
+                    "score": 0.0,
+                    "passages": []
+                }
+            if settings.CHAPTER_PASSAGE_POOLING == "sum":
+                chapter["score"] += r["score"]
+            else:
+                chapter["score"] = max(chapter["score"], r["score"])
+            chapter["passages"].append({
+                "block_index": payload.get("block_index"),
+                "start_token": payload.get("start_token"),
+                "score": r["score"],
+                "content": payload.get("content", "")
+            })
+        
+        ranked = sorted(chapters.values(), key=lambda c: c["score"], reverse=True)[:limit or self.top_k]
+        for chapter in ranked:
+            chapter["passages"].sort(key=lambda p: (p["block_index"] or 0, p["start_token"] or 0))
+            chapter["content"] = "\n...\n".join(p["content"] for p in chapter["passages"])
+        return ranked
+    
     async def retrieve_chapters(self, query: str, limit: int = None) -> List[Dict[str, Any]]:
-        """Retrieve relevant chapters."""
-        query_embedding = generate_embedding(query)
+        """Retrieve relevant chapters by their best-matching passages."""
+        query_embedding = await embed(query)
         vector_manager = get_vector_manager()
         
-        results = vector_manager.search(
-            collection="chapters",
-            query_vector=query_embedding,
-            limit=limit or self.top_k,
-            score_threshold=self.threshold
-        )
+        results = await vector_manager.asearch_batch([
+            {**self._passage_search(limit), "query_vector": query_embedding}
+        ])
         
-        return [{"score": r["score"], **r["payload"]} for r in results]
+        return self.pool_passages(results[0], limit)
     
     async def retrieve_knowledge(self, query: str, 
                                  source_type: str = None,
                                  limit: int = None) -> List[Dict[str, Any]]:
         """Retrieve relevant knowledge base entries."""
-        query_embedding = generate_embedding(query)
+        query_embedding = await embed(query)
         vector_manager = get_vector_manager()
         
         filter_conditions = {}
@@ -117,22 +428,51 @@ class RAGService:
     
     async def hybrid_search(self, query: str, 
                            collections: List[str] = None) -> Dict[str, List[Dict[str, Any]]]:
-        """Perform hybrid search across multiple collections."""
+        """
+        Search multiple collections by vector and, for chapters and
+        knowledge, by BM25, fusing the two rankings by reciprocal rank.
+        """
         if collections is None:
             collections = ["chapters", "knowledge", "ideas"]
         
-        query_embedding = generate_embedding(query)
-        vector_manager = get_vector_manager()
+        async def vector_search() -> List[List[Dict[str, Any]]]:
+            query_embedding = await embed(query)
+            return await get_vector_manager().asearch_batch([
+                {**self._passage_search(), "query_vector": query_embedding}
+                if collection == "chapters" else
+                {
+                    "collection": collection,
+                    "query_vector": query_embedding,
+                    "limit": self.top_k,
+                    "score_threshold": self.threshold
+                }
+                for collection in collections
+            ])
+        
+        lexical_searches = {
+            c: {"collection": c} for c in collections if c in LEXICAL_SOURCES
+        } if settings.LEXICAL_ENABLED else {}
+        batch, lexical = await asyncio.gather(
+            vector_search(),
+            asyncio.wait_for(self._lexical_search(query, lexical_searches), settings.LEXICAL_TIMEOUT),
+            return_exceptions=True
+        )
+        if isinstance(batch, BaseException):
+            raise batch
+        if isinstance(lexical, BaseException):
+            logger.warning(f"Lexical search failed; using vector ranking: {lexical!r}")
+            lexical = {}
         
         results = {}
-        for collection in collections:
-            search_results = vector_manager.search(
-                collection=collection,
-                query_vector=query_embedding,
-                limit=self.top_k,
-                score_threshold=self.threshold
-            )
-            results[collection] = [{"score": r["score"], **r["payload"]} for r in search_results]
+        for collection, search_results in zip(collections, batch):
+            if collection in lexical:
+                search_results = reciprocal_rank_fusion(
+                    collection, {"vector": search_results, "lexical": lexical[collection]}
+                )
+            if collection == "chapters":
+                results[collection] = self.pool_passages(search_results)
+            else:
+                results[collection] = [{"score": r["score"], **r["payload"]} for r in search_results[:self.top_k]]
         
         return results
     
@@ -140,21 +480,19 @@ class RAGService:
                                       start_chapter: int, 
                                       end_chapter: int) -> List[Dict[str, Any]]:
         """Search within a specific chapter range."""
-        query_embedding = generate_embedding(query)
+        query_embedding = await embed(query)
         vector_manager = get_vector_manager()
         
-        # Get all chapters in range, then filter by similarity
-        results = vector_manager.search(
-            collection="chapters",
-            query_vector=query_embedding,
-            limit=self.top_k * 2,  # Get more and filter
-            score_threshold=self.threshold,
-            filter_conditions={
-                "chapter_number": list(range(start_chapter, end_chapter + 1))
+        results = await vector_manager.asearch_batch([
+            {
+                **self._passage_search(filter_conditions={
+                    "chapter_number": list(range(start_chapter, end_chapter + 1))
+                }),
+                "query_vector": query_embedding
             }
-        )
+        ])
         
-        return [{"score": r["score"], **r["payload"]} for r in results]
+        return self.pool_passages(results[0])
 
 
 def get_rag_service() -> RAGService:
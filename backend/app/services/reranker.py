@@ -0,0 +1,147 @@
+"""Cross-encoder reranking for retrieved passages."""
+import asyncio
+import hashlib
+import logging
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from sentence_transformers import CrossEncoder
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Global model instance
+_model = None
+
+
+def get_rerank_model() -> CrossEncoder:
+    """Get or create the cross-encoder model instance."""
+    global _model
+    if _model is None:
+        _model = CrossEncoder(settings.RERANK_MODEL, max_length=settings.RERANK_MAX_LENGTH, device="cpu")
+    return _model
+
+
+def _predict(pairs: List[List[str]], batch_size: int) -> List[float]:
+    """Score (query, passage) pairs, squashing logits to 0..1."""
+    logits = get_rerank_model().predict(pairs, batch_size=batch_size, convert_to_numpy=True)
+    return [1.0 / (1.0 + math.exp(-float(x))) for x in logits]
+
+
+class Reranker:
+    """
+    Scores (query, passage) pairs with a small cross-encoder on CPU.
+
+    Scores are cached in a bounded LRU keyed by a hash of (model, query,
+    passage), so a follow-up question over the same passages is free.
+    Uncached pairs are scored in batches on a dedicated thread so
+    inference never blocks the event loop.
+    """
+
+    def __init__(self, max_size: int = None, batch_size: int = None):
+        self.max_size = max_size or settings.RERANK_CACHE_SIZE
+        self.batch_size = batch_size or settings.RERANK_BATCH_SIZE
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._lru: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query: str, passage: str) -> str:
+        """Build the cache key for a pair."""
+        digest = hashlib.sha256(f"{settings.RERANK_MODEL}\x00{query}\x00{passage}".encode("utf-8"))
+        return digest.hexdigest()
+
+    async def score(self, query: str, passages: List[str]) -> List[float]:
+        """Relevance of each passage to the query, in input order."""
+        keys = [self.key(query, p) for p in passages]
+        scores: Dict[str, float] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    scores[key] = self._lru[key]
+
+        missing: Dict[str, str] = {}
+        for key, passage in zip(keys, passages):
+            if key not in scores:
+                missing.setdefault(key, passage)
+
+        if missing:
+            loop = asyncio.get_running_loop()
+            predicted = await loop.run_in_executor(
+                self.executor, _predict,
+                [[query, p] for p in missing.values()], self.batch_size
+            )
+            with self._lock:
+                for key, value in zip(missing, predicted):
+                    scores[key] = value
+                    self._lru[key] = value
+                    self._lru.move_to_end(key)
+                while len(self._lru) > self.max_size:
+                    self._lru.popitem(last=False)
+
+        with self._lock:
+            self.hits += len(passages) - len(missing)
+            self.misses += len(missing)
+        return [scores[k] for k in keys]
+
+    async def rerank(self, query: str, candidates: List[Dict[str, Any]],
+                     top_n: int = None, min_score: float = None) -> List[Dict[str, Any]]:
+        """
+        Order candidates by cross-encoder score and keep the best `top_n`.
+
+        Each candidate needs a `text`; the returned candidates carry their
+        score under `rerank_score`.
+        """
+        if not candidates:
+            return []
+        top_n = top_n or settings.RERANK_TOP_N
+        min_score = settings.RERANK_MIN_SCORE if min_score is None else min_score
+        scores = await self.score(query, [c["text"] for c in candidates])
+        ranked = sorted(
+            ({**c, "rerank_score": s} for c, s in zip(candidates, scores) if s >= min_score),
+            key=lambda c: c["rerank_score"],
+            reverse=True
+        )
+        return ranked[:top_n]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": settings.RERANK_ENABLED,
+                "size": len(self._lru),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def close(self):
+        """Release the inference thread."""
+        self.executor.shutdown(wait=False)
+
+
+# Reranker singleton
+_reranker: Optional[Reranker] = None
+
+
+def get_reranker() -> Reranker:
+    """Get or create the reranker singleton."""
+    global _reranker
+    if _reranker is None:
+        _reranker = Reranker()
+    return _reranker
+
+
+def close_reranker():
+    """Shut down the reranker."""
+    global _reranker
+    if _reranker is not None:
+        _reranker.close()
+        _reranker = None
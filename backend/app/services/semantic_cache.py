@@ -0,0 +1,216 @@
+"""Semantic cache of chat answers for near-duplicate questions."""
+import hashlib
+import json
+import logging
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database.postgres import AsyncSessionLocal
+from app.services.embeddings import embed
+
+logger = logging.getLogger(__name__)
+
+# Fields that identify a retrieved item; items without any are identified by content
+IDENTITY_FIELDS = ("id", "chapter_id", "doc_id", "document_id", "chunk_index", "block_index", "name", "title", "url")
+# Context sections that describe the retrieval rather than the story
+IGNORED_SECTIONS = ("retrieval", "detected_intent")
+
+# Current story-data version; bumped by triggers on the story tables
+STORY_VERSION_SQL = "SELECT last_value + is_called::int AS version FROM story_data_version"
+
+
+def _identity(item: Any) -> str:
+    if isinstance(item, dict):
+        fields = {k: item[k] for k in IDENTITY_FIELDS if item.get(k) is not None}
+        if fields:
+            return json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+    content = json.dumps(item, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def context_fingerprint(context: Dict[str, Any], extra: Iterable[Any] = ()) -> str:
+    """Hash of the IDs of the retrieved items in each context section, plus `extra`."""
+    sections = []
+    for section in sorted(context or {}):
+        if section in IGNORED_SECTIONS or not context[section]:
+            continue
+        value = context[section]
+        items = value if isinstance(value, list) else [value]
+        sections.append([section, sorted(_identity(item) for item in items)])
+    payload = json.dumps([sections, list(extra)], ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def invalidate_story_data():
+    """
+    Bump the story-data version, retiring every cached answer. PostgreSQL
+    writes to story tables do this by trigger; call it after writes
+    elsewhere, such as the Neo4j graph.
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(text("SELECT nextval('story_data_version')"))
+            await db.commit()
+    except Exception as e:
+        logger.warning(f"Story data version bump failed: {e}")
+
+
+class SemanticResponseCache:
+    """
+    Chat answers stored in PostgreSQL, matched by query similarity.
+
+    An answer is reused for a new question when both were asked with the
+    same provider, model, language, temperature and max_tokens, after the
+    same conversation history, over the same retrieved context (same
+    context fingerprint) and the same story-data version, and their
+    query embeddings have a cosine similarity of at least
+    SEMANTIC_CACHE_THRESHOLD. The version is a sequence bumped by any
+    write to chapters, knowledge, documents or story entities, so a write
+    retires every answer given before it. Every `prune_every` writes,
+    retired and expired rows are deleted and the table is trimmed to
+    `max_entries` by least recent use.
+    """
+
+    def __init__(self):
+        self.threshold = settings.SEMANTIC_CACHE_THRESHOLD
+        self.ttl = settings.SEMANTIC_CACHE_TTL
+        self.max_entries = settings.SEMANTIC_CACHE_MAX_ENTRIES
+        self.prune_every = settings.SEMANTIC_CACHE_PRUNE_EVERY
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    async def scope(self, query: str, context: Dict[str, Any], provider: str, model: str,
+                    language: str, extra: Iterable[Any] = ()) -> Dict[str, Any]:
+        """The lookup key for a question: its embedding and a scope hash."""
+        return {
+            "key": context_fingerprint(context, [provider, model, language, *extra]),
+            "embedding": await embed(query),
+            "version": None
+        }
+
+    async def get(self, scope: Dict[str, Any]) -> Optional[str]:
+        """
+        Return the cached answer closest to the query, or None on miss or
+        error. Records the story-data version in `scope` for put().
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    text(f"""
+                        WITH v AS ({STORY_VERSION_SQL}),
+                        best AS (
+                            SELECT c.id, 1 - (c.query_embedding <=> CAST(:embedding AS vector)) AS similarity
+                            FROM semantic_cache c CROSS JOIN v
+                            WHERE c.scope_key = :key AND c.story_version = v.version AND c.expires_at > NOW()
+                            ORDER BY c.query_embedding <=> CAST(:embedding AS vector)
+                            LIMIT 1
+                        ),
+                        hit AS (
+                            UPDATE semantic_cache c
+                            SET last_accessed_at = NOW(), hit_count = c.hit_count + 1
+                            FROM best
+                            WHERE c.id = best.id AND best.similarity >= :threshold
+                            RETURNING c.response
+                        )
+                        SELECT v.version, hit.response FROM v LEFT JOIN hit ON TRUE
+                    """),
+                    {"key": scope["key"], "embedding": str(scope["embedding"]), "threshold": self.threshold}
+                )
+                row = result.fetchone()
+                await db.commit()
+        except Exception as e:
+            self.errors += 1
+            logger.debug(f"Semantic cache lookup skipped: {e}")
+            return None
+
+        scope["version"] = row.version
+        if row.response is not None:
+            self.hits += 1
+            return row.response
+        self.misses += 1
+        return None
+
+    async def put(self, scope: Dict[str, Any], query: str, response: str):
+        """Store an answer under the version seen by get(), pruning periodically."""
+        if scope.get("version") is None:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    text("""
+                        INSERT INTO semantic_cache (scope_key, story_version, query, query_embedding,
+                                                    response, expires_at)
+                        VALUES (:key, :version, :query, CAST(:embedding AS vector), :response,
+                                NOW() + make_interval(secs => :ttl))
+                    """),
+                    {
+                        "key": scope["key"],
+                        "version": scope["version"],
+                        "query": query,
+                        "embedding": str(scope["embedding"]),
+                        "response": response,
+                        "ttl": self.ttl
+                    }
+                )
+                await db.commit()
+            self.writes += 1
+            if self.writes % self.prune_every == 0:
+                await self.prune()
+        except Exception as e:
+            self.errors += 1
+            logger.debug(f"Semantic cache write skipped: {e}")
+
+    async def prune(self) -> int:
+        """Delete retired and expired entries and trim to max_entries by least recent use."""
+        async with AsyncSessionLocal() as db:
+            stale = await db.execute(
+                text(f"""
+                    DELETE FROM semantic_cache
+                    WHERE expires_at <= NOW() OR story_version < ({STORY_VERSION_SQL})
+                """)
+            )
+            overflow = await db.execute(
+                text("""
+                    DELETE FROM semantic_cache
+                    WHERE id IN (
+                        SELECT id FROM semantic_cache
+                        ORDER BY last_accessed_at DESC
+                        OFFSET :max_entries
+                    )
+                """),
+                {"max_entries": self.max_entries}
+            )
+            await db.commit()
+        removed = (stale.rowcount or 0) + (overflow.rowcount or 0)
+        if removed:
+            logger.info(f"Pruned {removed} semantic cache entries")
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters for this process."""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": settings.SEMANTIC_CACHE_ENABLED,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# Cache singleton
+_semantic_cache: Optional[SemanticResponseCache] = None
+
+
+def get_semantic_cache() -> SemanticResponseCache:
+    """Get or create the semantic response cache singleton."""
+    global _semantic_cache
+    if _semantic_cache is None:
+        _semantic_cache = SemanticResponseCache()
+    return _semantic_cache
@@ -12,6 +12,7 @@ This service uses the LLM to make intelligent judgments about:
 
 from typing import List, Dict, Any, Optional
 from app.services.llm_service import get_llm_service
+from app.services.llm_scheduler import Priority
 from app.database.postgres import AsyncSessionLocal
 from sqlalchemy import text
 import json
@@ -23,8 +24,8 @@ logger = logging.getLogger(__name__)
 class StoryAnalysisService:
     """LLM-powered story analysis and consistency checking."""
     
-    def __init__(self, provider: str = None):
-        self.llm = get_llm_service(provider)
+    def __init__(self, provider: str = None, priority: Priority = Priority.BACKGROUND):
+        self.llm = get_llm_service(provider, priority)
     
     # =========================================================================
     # CHAPTER POSITION CONTEXT (Improvement #4)
@@ -201,7 +202,9 @@ Respond in JSON format:
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.3  # Lower temperature for more consistent analysis
+            temperature=0.3,  # Lower temperature for more consistent analysis
+            cache=True,
+            validate=self._extract_json
         )
         
         try:
@@ -381,7 +384,9 @@ Respond in JSON format:
         
         response = await self.llm.generate(
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.2
+            temperature=0.2,
+            cache=True,
+            validate=self._extract_json
         )
         
         try:
@@ -607,7 +612,8 @@ Respond in JSON format:
             logger.error(f"Failed to save analysis: {e}")
 
 
-def get_story_analysis_service(provider: str = None) -> StoryAnalysisService:
-    """Get story analysis service instance."""
-    return StoryAnalysisService(provider)
+def get_story_analysis_service(provider: str = None,
+                               priority: Priority = Priority.BACKGROUND) -> StoryAnalysisService:
+    """Get story analysis service instance; pass Priority.INTERACTIVE when a user is waiting."""
+    return StoryAnalysisService(provider, priority)
 
@@ -0,0 +1,258 @@
+"""
+Background job worker for Novel RAG Chatbot.
+
+Runs story extraction and chapter analysis jobs from the `background_jobs`
+queue outside the web process:
+
+    python -m app.worker
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database.postgres import init_db, close_db, AsyncSessionLocal
+from app.database.redis_client import init_redis, close_redis
+from app.database.neo4j_client import init_neo4j, close_neo4j
+from app.database.qdrant_client import init_qdrant
+from app.services.embeddings import close_embedding_engine
+from app.services.llm_service import close_llm_clients
+from app.services.llm_scheduler import init_worker_llm_scheduler
+from app.services.job_queue import get_job_queue
+from app.services.document_extraction import get_document_extraction_service
+from app.services.auto_analysis import AutoAnalysisService
+from app.services.chapter_blocks import get_chapter_block_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How often to return jobs held by dead workers to the queue
+STALE_CHECK_INTERVAL = 60.0
+
+
+async def run_document_extraction(payload: Dict[str, Any], provider: str) -> Dict[str, Any]:
+    """Extract story elements from an uploaded knowledge base document."""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            text("SELECT content FROM knowledge_base WHERE id = :id"),
+            {"id": payload["knowledge_id"]}
+        )
+        row = result.fetchone()
+    if not row:
+        return {"skipped": "document no longer exists"}
+
+    extraction_service = get_document_extraction_service(provider)
+    result = await extraction_service.extract_from_document(
+        content=row.content,
+        filename=payload.get("filename", ""),
+        series_id=payload.get("series_id"),
+        book_id=payload.get("book_id")
+    )
+    # What succeeded is saved; fail the job so a retry resumes the failed chunks
+    if result.get("incomplete"):
+        raise RuntimeError(f"Extraction chunks failed: {result['incomplete']}")
+    return result
+
+
+async def run_chapter_analysis(payload: Dict[str, Any], provider: str) -> Dict[str, Any]:
+    """Run automatic LLM analysis on the chapter blocks not yet analyzed."""
+    block_service = get_chapter_block_service()
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            text("SELECT content, summary FROM chapters WHERE id = :id"),
+            {"id": payload["chapter_id"]}
+        )
+        row = result.fetchone()
+        if not row:
+            return {"skipped": "chapter no longer exists"}
+        
+        blocks = await block_service.get_blocks(db, payload["chapter_id"])
+        if not blocks:
+            # Chapter saved before block tracking; split it now
+            await block_service.sync(db, payload["chapter_id"], row.content)
+            await db.commit()
+            blocks = await block_service.get_blocks(db, payload["chapter_id"])
+    
+    pending = [b for b in blocks if not b["analyzed"]]
+    if not pending:
+        return {"skipped": "no changed blocks", "blocks": len(blocks)}
+    
+    total_chars = sum(len(b["content"]) for b in blocks) or 1
+    changed_ratio = sum(len(b["content"]) for b in pending) / total_chars
+    
+    hashes = {b["content"]: b["hash"] for b in pending}
+    
+    async def window_done(window_blocks):
+        # Blocks of a fully analyzed window are not analyzed again by a retry
+        await block_service.mark_analyzed(payload["chapter_id"], [hashes[b] for b in window_blocks])
+    
+    service = AutoAnalysisService(provider)
+    analysis = await service.on_chapter_save(
+        chapter_id=payload["chapter_id"],
+        chapter_content=row.content,
+        book_id=payload["book_id"],
+        series_id=payload["series_id"],
+        chapter_number=payload.get("chapter_number") or 1,
+        changed_blocks=[b["content"] for b in pending],
+        refresh_summary=not row.summary or changed_ratio >= settings.CHAPTER_SUMMARY_REFRESH_RATIO,
+        on_window_done=window_done
+    )
+    
+    # Blocks of failed windows stay pending; let the queue retry them
+    errors = [analysis["error"]] if "error" in analysis else [
+        value["error"]
+        for window in analysis["windows"] for value in window.values()
+        if isinstance(value, dict) and "error" in value
+    ]
+    if errors:
+        raise RuntimeError(f"Chapter analysis incomplete: {errors[0]}")
+    analysis["blocks"] = {"total": len(blocks), "analyzed": len(pending), "reused": len(blocks) - len(pending)}
+    return analysis
+
+
+JOB_HANDLERS: Dict[str, Callable[[Dict[str, Any], str], Awaitable[Any]]] = {
+    "document_extraction": run_document_extraction,
+    "chapter_analysis": run_chapter_analysis,
+}
+
+
+class JobWorker:
+    """
+    Polls the job queue and runs jobs concurrently.
+
+    Each provider gets its own slot pool sized from JOB_PROVIDER_CONCURRENCY;
+    the queue enforces the same cap across all worker processes.
+    """
+
+    def __init__(self, worker_id: str = None):
+        self.queue = get_job_queue()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        providers = set(settings.job_provider_concurrency) | {settings.DEFAULT_LLM_PROVIDER}
+        self.slots = {p: asyncio.Semaphore(self.queue.provider_limit(p)) for p in providers}
+        self.poll_interval = settings.JOB_POLL_INTERVAL
+        self.heartbeat_interval = settings.JOB_HEARTBEAT_INTERVAL
+        self._running: set = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        """Stop claiming new jobs; running jobs are allowed to finish."""
+        self._stopping.set()
+
+    async def run(self):
+        """Claim and run jobs until stopped."""
+        logger.info(f"Worker {self.worker_id} started (providers: {sorted(self.slots)})")
+        loop = asyncio.get_running_loop()
+        last_stale_check = 0.0
+
+        while not self._stopping.is_set():
+            if loop.time() - last_stale_check > STALE_CHECK_INTERVAL:
+                last_stale_check = loop.time()
+                try:
+                    await self.queue.requeue_stale()
+                except Exception as e:
+                    logger.error(f"Stale job check failed: {e}")
+
+            claimed = False
+            for provider, slots in self.slots.items():
+                while not slots.locked() and not self._stopping.is_set():
+                    try:
+                        job = await self.queue.claim(provider, self.worker_id)
+                    except Exception as e:
+                        logger.error(f"Failed to claim {provider} job: {e}")
+                        job = None
+                    if job is None:
+                        break
+                    claimed = True
+                    await slots.acquire()
+                    task = asyncio.create_task(self._execute(job, slots))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+
+            if not claimed:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+        if self._running:
+            logger.info(f"Waiting for {len(self._running)} running job(s) to finish")
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _heartbeat(self, job: Dict[str, Any], handler_task: asyncio.Task):
+        """
+        Refresh the job's lock every JOB_HEARTBEAT_INTERVAL seconds so long
+        jobs are not re-queued as stale. If the lock was lost, the handler
+        is cancelled so two runs never write results side by side.
+        """
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                held = await self.queue.heartbeat(job["id"], self.worker_id)
+            except Exception as e:
+                logger.warning(f"Heartbeat for job {job['id']} failed: {e}")
+                continue
+            if not held:
+                logger.error(f"Job {job['id']} was taken over by another worker; cancelling it here")
+                handler_task.cancel()
+                return
+
+    async def _execute(self, job: Dict[str, Any], slots: asyncio.Semaphore):
+        """Run one job and record its outcome."""
+        heartbeat = None
+        try:
+            handler = JOB_HANDLERS.get(job["job_type"])
+            if handler is None:
+                raise ValueError(f"Unknown job type: {job['job_type']}")
+            logger.info(f"Running {job['job_type']} job {job['id']} (attempt {job['attempts']})")
+            handler_task = asyncio.create_task(handler(job["payload"], job["provider"]))
+            heartbeat = asyncio.create_task(self._heartbeat(job, handler_task))
+            try:
+                result = await handler_task
+            except asyncio.CancelledError:
+                if handler_task.cancelled() and not heartbeat.done():
+                    raise
+                logger.info(f"Job {job['id']} abandoned after losing its lock")
+                return
+            if await self.queue.complete(job["id"], result, self.worker_id):
+                logger.info(f"Job {job['id']} succeeded")
+            else:
+                logger.warning(f"Job {job['id']} finished after being taken over; result discarded")
+        except Exception as e:
+            await self.queue.fail(job, str(e), self.worker_id)
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+            slots.release()
+
+
+async def main(worker_id: Optional[str] = None):
+    """Initialize connections and run the worker until SIGINT/SIGTERM."""
+    init_worker_llm_scheduler()
+    await init_db()
+    await init_redis()
+    await init_neo4j()
+    await init_qdrant()
+
+    worker = JobWorker(worker_id)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    try:
+        await worker.run()
+    finally:
+        await close_db()
+        await close_redis()
+        await close_neo4j()
+        await close_embedding_engine()
+        await close_llm_clients()
+        logger.info(f"Worker {worker.worker_id} stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(os.environ.get("WORKER_ID")))
@@ -1,6 +1,9 @@
 -- Enable pgvector extension
 CREATE EXTENSION IF NOT EXISTS vector;
 
+-- Trigram matching for fuzzy entity name lookup
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Create enum for knowledge categories
 DO $$ BEGIN
     CREATE TYPE knowledge_category AS ENUM (
@@ -80,6 +83,44 @@ CREATE TABLE IF NOT EXISTS chapters (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Chapters split into content-hashed paragraph blocks for incremental re-embedding and analysis
+CREATE TABLE IF NOT EXISTS chapter_blocks (
+    chapter_id INTEGER NOT NULL REFERENCES chapters(id) ON DELETE CASCADE,
+    block_index INTEGER NOT NULL,
+    content_hash VARCHAR(64) NOT NULL,
+    content TEXT NOT NULL,
+    embedding vector(384),
+    analyzed_at TIMESTAMP WITH TIME ZONE, -- NULL until the block has been through auto-analysis
+    PRIMARY KEY (chapter_id, block_index)
+);
+
+-- BM25 lexical index: one row per indexed unit (chapter block, knowledge chunk, document chunk)
+CREATE TABLE IF NOT EXISTS lexical_documents (
+    doc_key VARCHAR(255) PRIMARY KEY, -- e.g. 'chapter:12:3', 'knowledge:7:0', 'document_chunk:41'
+    source VARCHAR(50) NOT NULL, -- 'chapters' or 'knowledge'
+    length INTEGER NOT NULL, -- Term count
+    payload JSONB DEFAULT '{}',
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Per-source document count and total length for BM25 (N and avgdl), kept by the indexer
+CREATE TABLE IF NOT EXISTS lexical_stats (
+    source VARCHAR(50) PRIMARY KEY,
+    doc_count BIGINT NOT NULL DEFAULT 0,
+    total_length BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO lexical_stats (source, doc_count, total_length)
+SELECT source, COUNT(*), SUM(length) FROM lexical_documents GROUP BY source
+ON CONFLICT (source) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS lexical_postings (
+    term VARCHAR(100) NOT NULL,
+    doc_key VARCHAR(255) NOT NULL REFERENCES lexical_documents(doc_key) ON DELETE CASCADE,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_key)
+);
+
 -- Knowledge base with categories
 CREATE TABLE IF NOT EXISTS knowledge_base (
     id SERIAL PRIMARY KEY,
@@ -292,6 +333,7 @@ CREATE TABLE IF NOT EXISTS chat_sessions (
     knowledge_sync_enabled BOOLEAN DEFAULT FALSE, -- Auto-sync new messages to knowledge
     synced_knowledge_id INTEGER, -- ID of the knowledge_base entry being synced to
     last_synced_message_id INTEGER, -- Last message ID that was synced
+    synced_chunk_count INTEGER DEFAULT 0, -- Knowledge chunks indexed so far
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     metadata JSONB DEFAULT '{}'
@@ -305,6 +347,7 @@ CREATE TABLE IF NOT EXISTS chat_messages (
     content TEXT NOT NULL,
     embedding vector(384),
     metadata JSONB DEFAULT '{}',
+    message_key VARCHAR(64) UNIQUE, -- Idempotency key of write-behind inserts
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
@@ -322,6 +365,63 @@ CREATE TABLE IF NOT EXISTS ideas (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Background jobs (story extraction, chapter analysis) run by worker processes
+CREATE TABLE IF NOT EXISTS background_jobs (
+    id SERIAL PRIMARY KEY,
+    job_type VARCHAR(50) NOT NULL, -- 'document_extraction', 'chapter_analysis'
+    provider VARCHAR(50) NOT NULL, -- LLM provider the job will call
+    payload JSONB NOT NULL DEFAULT '{}',
+    -- Status: queued, running, succeeded, failed
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_after TIMESTAMP WITH TIME ZONE DEFAULT NOW(), -- Retry backoff
+    locked_by VARCHAR(100), -- Worker holding the job
+    locked_at TIMESTAMP WITH TIME ZONE,
+    concurrency_key VARCHAR(255), -- Jobs sharing a key never run at once
+    result JSONB,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Per-chunk results of in-progress document extractions, for resuming
+CREATE TABLE IF NOT EXISTS extraction_checkpoints (
+    checkpoint_key VARCHAR(64) NOT NULL, -- Hash of document content and series
+    kind VARCHAR(50) NOT NULL, -- 'characters', 'world_rules', 'foreshadowing'
+    chunk_index INTEGER NOT NULL,
+    items JSONB NOT NULL DEFAULT '[]',
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (checkpoint_key, kind, chunk_index)
+);
+
+-- Cached responses of deterministic LLM calls (analysis and extraction prompts)
+CREATE TABLE IF NOT EXISTS llm_cache (
+    cache_key VARCHAR(64) PRIMARY KEY, -- Hash of provider, model, params and messages
+    provider VARCHAR(50),
+    model VARCHAR(200),
+    response TEXT NOT NULL,
+    hit_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    last_accessed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Cached chat answers, reused for near-identical questions over the same context
+CREATE TABLE IF NOT EXISTS semantic_cache (
+    id SERIAL PRIMARY KEY,
+    scope_key VARCHAR(64) NOT NULL, -- Hash of provider, model, language and retrieved context IDs
+    story_version BIGINT NOT NULL, -- story_data_version when the answer was generated
+    query TEXT NOT NULL,
+    query_embedding vector(384) NOT NULL,
+    response TEXT NOT NULL,
+    hit_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    last_accessed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
 -- Create indexes for vector similarity search
 CREATE INDEX IF NOT EXISTS chapters_embedding_idx ON chapters 
     USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
@@ -349,12 +449,35 @@ CREATE INDEX IF NOT EXISTS chapters_book_idx ON chapters(book_id);
 CREATE INDEX IF NOT EXISTS knowledge_base_category_idx ON knowledge_base(category);
 CREATE INDEX IF NOT EXISTS document_chunks_doc_idx ON document_chunks(document_id);
 CREATE INDEX IF NOT EXISTS documents_category_idx ON documents(category);
+CREATE INDEX IF NOT EXISTS background_jobs_ready_idx ON background_jobs(provider, status, run_after);
+CREATE INDEX IF NOT EXISTS lexical_postings_doc_idx ON lexical_postings(doc_key);
+CREATE INDEX IF NOT EXISTS lexical_documents_source_idx ON lexical_documents(source);
+CREATE INDEX IF NOT EXISTS llm_cache_accessed_idx ON llm_cache(last_accessed_at DESC);
+CREATE INDEX IF NOT EXISTS semantic_cache_scope_idx ON semantic_cache(scope_key, story_version);
+CREATE INDEX IF NOT EXISTS semantic_cache_accessed_idx ON semantic_cache(last_accessed_at DESC);
+CREATE INDEX IF NOT EXISTS background_jobs_type_idx ON background_jobs(job_type, created_at DESC);
+CREATE INDEX IF NOT EXISTS background_jobs_concurrency_idx ON background_jobs(concurrency_key, status)
+    WHERE concurrency_key IS NOT NULL;
 
 -- New indexes for series/book structure
 CREATE INDEX IF NOT EXISTS books_series_idx ON books(series_id);
 CREATE INDEX IF NOT EXISTS story_arcs_series_idx ON story_arcs(series_id);
 CREATE INDEX IF NOT EXISTS character_profiles_series_idx ON character_profiles(series_id);
 
+-- Entity lookup: exact, alias, fuzzy and full-text character matching
+CREATE OR REPLACE FUNCTION lower_aliases(aliases TEXT[]) RETURNS TEXT[] AS $$
+    SELECT array_agg(lower(a)) FROM unnest(aliases) AS a
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION profile_tsvector(description TEXT, personality TEXT) RETURNS tsvector AS $$
+    SELECT to_tsvector('simple', coalesce(description, '') || ' ' || coalesce(personality, ''))
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE INDEX IF NOT EXISTS character_profiles_name_lower_idx ON character_profiles(lower(name));
+CREATE INDEX IF NOT EXISTS character_profiles_name_trgm_idx ON character_profiles USING gin (lower(name) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS character_profiles_aliases_idx ON character_profiles USING gin (lower_aliases(aliases));
+CREATE INDEX IF NOT EXISTS character_profiles_text_idx ON character_profiles USING gin (profile_tsvector(description, personality));
+
 -- Indexes for character knowledge tracking
 CREATE INDEX IF NOT EXISTS story_facts_series_idx ON story_facts(series_id);
 CREATE INDEX IF NOT EXISTS character_knowledge_character_idx ON character_knowledge(character_id);
@@ -374,3 +497,31 @@ CREATE INDEX IF NOT EXISTS story_analyses_resolved_idx ON story_analyses(is_reso
 CREATE INDEX IF NOT EXISTS world_rules_series_idx ON world_rules(series_id);
 CREATE INDEX IF NOT EXISTS world_rules_category_idx ON world_rules(rule_category);
 
+-- Story-data version: any write to story content retires semantically cached answers
+CREATE SEQUENCE IF NOT EXISTS story_data_version;
+
+CREATE OR REPLACE FUNCTION bump_story_data_version() RETURNS trigger AS $$
+BEGIN
+    PERFORM nextval('story_data_version');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    story_table TEXT;
+BEGIN
+    FOREACH story_table IN ARRAY ARRAY[
+        'series', 'books', 'story_arcs', 'chapters', 'knowledge_base', 'documents', 'document_chunks',
+        'character_profiles', 'story_facts', 'character_knowledge', 'character_states', 'foreshadowing',
+        'foreshadowing_reinforcements', 'world_rules', 'ideas'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', story_table || '_story_version', story_table);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+            'FOR EACH STATEMENT EXECUTE FUNCTION bump_story_data_version()',
+            story_table || '_story_version', story_table
+        );
+    END LOOP;
+END;
+$$;